@@ -0,0 +1,95 @@
+"""
+Benchmark of the compiled fhir path accessors against the former recursive key search, on a synthetic bundle of
+Observations (three lookups per entry, as in fhir_to_csv):
+
+    python -m benchmarks.bench_fhir_path [number_of_entries]
+"""
+import sys
+import time
+from typing import Any, Optional, Union
+
+from flamesdk.resources.utils.fhir import _compile_fhir_path, fhir_to_csv
+from flamesdk.resources.utils.logging import FlameLogger
+
+COL_KEY_SEQ = "resource.code.coding.code"
+ROW_KEY_SEQ = "resource.subject.reference"
+VALUE_KEY_SEQ = "resource.value"  # resolved to 'valueQuantity' by the fallback
+
+
+def _search_fhir_resource(fhir_entry: Union[dict[str, Any], list[Any]],
+                          keys: list[str],
+                          current: int = 0) -> Optional[Any]:
+    # the former recursive implementation (without the unreachable logging branches), kept as baseline
+    key = keys[current]
+    if (current < (len(keys) - 1)) or (type(fhir_entry) == list):
+        if type(fhir_entry) == dict:
+            if key in fhir_entry.keys():
+                next_value = _search_fhir_resource(fhir_entry[key], keys, current + 1)
+                if next_value is not None:
+                    return next_value
+            else:
+                return None
+        elif type(fhir_entry) == list:
+            for e in fhir_entry:
+                next_value = _search_fhir_resource(e, keys, current)
+                if next_value is not None:
+                    return next_value
+        else:
+            return None
+    elif type(fhir_entry) == dict:
+        try:
+            return fhir_entry[key]
+        except KeyError:
+            return fhir_entry[[k for k in fhir_entry.keys() if key in k][0]]
+    return None
+
+
+def synthetic_bundle(number_of_entries: int) -> dict[str, Any]:
+    return {'resourceType': 'Bundle',
+            'total': number_of_entries,
+            'entry': [{'fullUrl': f"http://fhir/Observation/{i}",
+                       'resource': {'resourceType': 'Observation',
+                                    'id': str(i),
+                                    'status': 'final',
+                                    'code': {'coding': [{'system': 'http://loinc.org',
+                                                         'code': f"code-{i % 50}",
+                                                         'display': 'Synthetic measurement'}]},
+                                    'subject': {'reference': f"Patient/{i // 50}"},
+                                    'effectiveDateTime': '2024-01-01T00:00:00Z',
+                                    'valueQuantity': {'value': i * 0.5, 'unit': 'mg'}}}
+                      for i in range(number_of_entries)],
+            'link': []}
+
+
+def _entries_per_second(bundle: dict[str, Any], extract) -> float:
+    start = time.perf_counter()
+    for entry in bundle['entry']:
+        extract(entry)
+    return len(bundle['entry']) / (time.perf_counter() - start)
+
+
+def main(number_of_entries: int = 200000) -> None:
+    bundle = synthetic_bundle(number_of_entries)
+    key_seqs = [key_seq.split('.') for key_seq in (COL_KEY_SEQ, ROW_KEY_SEQ, VALUE_KEY_SEQ)]
+    flame_logger = FlameLogger(silent=True)
+
+    recursive = _entries_per_second(bundle,
+                                    lambda entry: [_search_fhir_resource(entry, keys) for keys in key_seqs])
+    accessors = [_compile_fhir_path(keys, flame_logger) for keys in key_seqs]
+    compiled = _entries_per_second(bundle, lambda entry: [accessor(entry) for accessor in accessors])
+    print(f"key lookups ({number_of_entries} entries, 3 lookups each)")
+    print(f"\trecursive search:   {recursive:12.0f} entries/s")
+    print(f"\tcompiled accessors: {compiled:12.0f} entries/s ({compiled / recursive:.2f}x)")
+
+    start = time.perf_counter()
+    fhir_to_csv(bundle,
+                col_key_seq=COL_KEY_SEQ,
+                value_key_seq=VALUE_KEY_SEQ,
+                input_resource='Observation',
+                flame_logger=flame_logger,
+                row_key_seq=ROW_KEY_SEQ)
+    print(f"fhir_to_csv: {number_of_entries / (time.perf_counter() - start):12.0f} entries/s")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,64 @@
+"""
+Peak memory and time of collecting fhir cells and writing them as csv, for the former dict-of-dicts against the
+array-backed _FhirTableBuilder (measured with tracemalloc on synthetic cells, numeric values per patient and code;
+tracemalloc inflates the times of both considerably):
+
+    python -m benchmarks.bench_fhir_table [number_of_patients] [number_of_codes]
+"""
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+from flamesdk.resources.utils.fhir import _FhirTableBuilder, _table_to_csv
+from flamesdk.resources.utils.logging import FlameLogger
+
+
+def _cells(number_of_patients: int, number_of_codes: int):
+    for code in range(number_of_codes):
+        for patient in range(number_of_patients):
+            yield f"code-{code}", f"Patient/{patient:08d}", (patient * code) % 997 * 0.25
+
+
+def _dict_of_dicts(cells) -> StringIO:
+    df_dict = {}
+    for col_id, row_id, value in cells:
+        if col_id not in df_dict.keys():
+            df_dict[col_id] = {}
+        df_dict[col_id][row_id] = value
+    columns = list(df_dict.keys())
+    row_ids = dict.fromkeys(row_id for col in df_dict.values() for row_id in col)
+    lines = [','.join([''] + [str(c) for c in columns])]
+    for row_id in row_ids:
+        lines.append(','.join([str(row_id)] + [str(df_dict[col].get(row_id, '')) for col in columns]))
+    io = StringIO()
+    io.write('\n'.join(lines))
+    return io
+
+
+def _table_builder(cells) -> StringIO:
+    table = _FhirTableBuilder()
+    for col_id, row_id, value in cells:
+        table.add(col_id, row_id, value)
+    return _table_to_csv(table, row_col_name='', separator=',', flame_logger=FlameLogger(silent=True))
+
+
+def _measure(convert, number_of_patients: int, number_of_codes: int) -> tuple[float, float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = convert(_cells(number_of_patients, number_of_codes))
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 2 ** 20, len(output.getvalue())
+
+
+def main(number_of_patients: int = 100000, number_of_codes: int = 10) -> None:
+    print(f"{number_of_patients} patients x {number_of_codes} codes")
+    for name, convert in (("dict of dicts", _dict_of_dicts), ("table builder", _table_builder)):
+        duration, peak_mib, csv_size = _measure(convert, number_of_patients, number_of_codes)
+        print(f"\t{name}: {duration:6.2f}s, peak {peak_mib:8.1f}MiB (csv {csv_size / 2 ** 20:.1f}MiB)")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
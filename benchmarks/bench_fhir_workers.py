@@ -0,0 +1,72 @@
+"""
+Time of converting a paginated fhir search to csv serially and with worker processes decoding and flattening the
+following pages (synthetic Observation pages served by an httpx MockTransport, so the benchmark runs offline). The
+parent's cpu time bounds the achievable speedup, as the workers' share of the work runs in parallel on further cores:
+
+    python -m benchmarks.bench_fhir_workers [number_of_pages] [entries_per_page] [max_workers]
+"""
+import json
+import logging
+import sys
+import time
+from unittest.mock import patch
+
+from httpx import MockTransport, Response
+
+from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient
+from flamesdk.resources.client_apis.data_api import DataAPI
+from flamesdk.resources.utils.fhir import fhir_to_csv
+from flamesdk.resources.utils.logging import FlameLogger
+
+
+def _page(page: int, number_of_pages: int, entries_per_page: int) -> bytes:
+    bundle = {"resourceType": "Bundle",
+              "id": f"bundle-{page}",
+              "total": number_of_pages * entries_per_page,
+              "link": [],
+              "entry": [{"fullUrl": f"http://fhir-server/fhir/Observation/{page}-{j}",
+                         "resource": {"resourceType": "Observation",
+                                      "id": f"{page}-{j}",
+                                      "status": "final",
+                                      "code": {"coding": [{"system": "http://loinc.org", "code": f"code-{j % 20}"}]},
+                                      "subject": {"reference": f"Patient/{page}-{j // 20}"},
+                                      "valueQuantity": {"value": j * 0.5, "unit": "kg"}}}
+                        for j in range(entries_per_page)]}
+    if page < number_of_pages - 1:
+        bundle["link"].append({"relation": "next", "url": f"http://fhir-server/fhir/Observation?page={page + 1}"})
+    return json.dumps(bundle).encode()
+
+
+def main(number_of_pages: int = 20, entries_per_page: int = 10000, max_workers: int = 4) -> None:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    pages = [_page(page, number_of_pages, entries_per_page) for page in range(number_of_pages)]
+
+    def handler(request):
+        if request.url.path.endswith("/kong/datastore/bench"):
+            return Response(200, json={"data": [{"name": "source1"}]})
+        return Response(200, content=pages[int(request.url.params.get("page", 0))])
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.get_async_transport",
+               return_value=MockTransport(handler)):
+        data_api = DataAPI.__new__(DataAPI)
+        data_api.data_client = DataApiClient("bench", "nginx", "data_token", "key_token", FlameLogger(silent=True))
+    first_page = data_api.get_fhir_data(["Observation"])[0]["Observation"]
+
+    print(f"{number_of_pages} pages x {entries_per_page} entries")
+    for workers in [1] + list(range(2, max_workers + 1)):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        output = fhir_to_csv(first_page,
+                             col_key_seq="resource.code.coding.code",
+                             value_key_seq="resource.valueQuantity.value",
+                             row_key_seq="resource.subject.reference",
+                             input_resource="Observation",
+                             flame_logger=FlameLogger(silent=True),
+                             data_client=data_api,
+                             workers=workers)
+        duration, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        print(f"\t{workers} worker(s): {duration:6.2f}s, parent cpu {cpu:6.2f}s "
+              f"(csv {len(output.getvalue()) / 2 ** 20:.1f}MiB)")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
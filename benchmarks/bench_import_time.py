@@ -0,0 +1,48 @@
+"""
+Import-time benchmark of `from flamesdk import FlameCoreSDK`, based on `python -X importtime`.
+
+Each measurement runs in a fresh interpreter. The best of several runs is compared against the budget, and the
+slowest modules are listed to point at the culprit of a regression. Exits with status 1 if the budget is exceeded:
+
+    python -m benchmarks.bench_import_time [budget_in_ms]
+"""
+import subprocess
+import sys
+
+IMPORT_STATEMENT = "from flamesdk import FlameCoreSDK"
+# Budget in milliseconds (the eager imports of httpx/fastapi/uvicorn used to take ~600ms on their own)
+DEFAULT_BUDGET_MS = 250
+
+
+def measure_import_time(statement: str = IMPORT_STATEMENT) -> tuple[int, list[tuple[int, str]]]:
+    """
+    Runs the import statement in a fresh interpreter with -X importtime
+    :param statement: the import statement to measure
+    :return: total cumulative import time of all flamesdk modules (in us) and the (self time, name) per module
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True)
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(self_us), name.strip()))
+        # top-level entries (no indentation) account for everything imported below them
+        if not name.startswith('  ') and name.strip().startswith('flamesdk'):
+            total += int(cumulative_us)
+    return total, modules
+
+
+def main(budget_ms: float = DEFAULT_BUDGET_MS, runs: int = 5) -> int:
+    measurements = [measure_import_time() for _ in range(runs)]
+    total, modules = min(measurements, key=lambda measurement: measurement[0])
+    print(f"'{IMPORT_STATEMENT}': {total / 1000:.1f}ms (best of {runs}, budget {budget_ms}ms)")
+    for self_us, name in sorted(modules, reverse=True)[:10]:
+        print(f"\t{self_us / 1000:7.1f}ms  {name}")
+    return 0 if total / 1000 <= budget_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS))
@@ -0,0 +1,64 @@
+"""
+Benchmark of the shared keep-alive transport against the former per-request 'Connection: close' behaviour.
+
+A local stand-in server (HTTP/1.1 with keep-alive support) replaces nginx, so the benchmark runs offline:
+
+    python -m benchmarks.bench_transport [number_of_requests]
+"""
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from httpx import AsyncClient
+
+from flamesdk.resources.utils.event_loop import run_coroutine
+from flamesdk.resources.utils.transport import get_async_transport
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # nginx sends responses with TCP_NODELAY as well
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+async def _run_requests(client: AsyncClient, number_of_requests: int, headers: list[tuple[str, str]]) -> float:
+    start = time.perf_counter()
+    for _ in range(number_of_requests):
+        response = await client.get("/healthz", headers=headers)
+        response.raise_for_status()
+    return number_of_requests / (time.perf_counter() - start)
+
+
+def main(number_of_requests: int = 2000) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        before = run_coroutine(_run_requests(AsyncClient(base_url=base_url),
+                                             number_of_requests,
+                                             headers=[('Connection', 'close')]))
+        after = run_coroutine(_run_requests(AsyncClient(base_url=base_url, transport=get_async_transport()),
+                                            number_of_requests,
+                                            headers=[]))
+    finally:
+        server.shutdown()
+    print(f"requests={number_of_requests}")
+    print(f"before (Connection: close):   {before:10.1f} req/s")
+    print(f"after (shared keep-alive pool): {after:10.1f} req/s")
+    print(f"speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,24 +1,27 @@
+from __future__ import annotations
+
+import copy
+import os
 import time
-import asyncio
-from httpx import AsyncClient
 from datetime import datetime
 from io import StringIO
 
-from typing import Any, Literal, Optional, Union
-from collections.abc import Iterable
+from typing import IO, TYPE_CHECKING, Any, Callable, Literal, Optional, Union
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
-from flamesdk.resources.client_apis.data_api import DataAPI
-from flamesdk.resources.client_apis.message_broker_api import MessageBrokerAPI, Message
-from flamesdk.resources.client_apis.storage_api import StorageAPI, LocalDifferentialPrivacyParams
-from flamesdk.resources.client_apis.po_api import POAPI
 from flamesdk.resources.node_config import NodeConfig
-from flamesdk.resources.rest_api import FlameAPI
-from flamesdk.resources.utils.fhir import fhir_to_csv
-from flamesdk.resources.utils.utils import wait_until_nginx_online
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import AnalysisStatus, LogTypeLiteral
 
+# The service clients pull in httpx, and the FlameAPI pulls in fastapi/uvicorn. They are imported when the
+# FlameCoreSDK starts (or the respective feature is first used) instead of at `import flamesdk`.
+if TYPE_CHECKING:
+    from httpx import AsyncClient
+    from flamesdk.resources.client_apis.message_broker_api import Message
+    from flamesdk.resources.client_apis.storage_api import LocalDifferentialPrivacyParams
+
 
 class FlameCoreSDK:
 
@@ -31,6 +34,14 @@ class FlameCoreSDK:
                                                                                       AnalysisStatus.STOPPED.value,
                                                                                       AnalysisStatus.FAILED.value)
     ) -> None:
+        from flamesdk.resources.client_apis.data_api import DataAPI
+        from flamesdk.resources.client_apis.message_broker_api import MessageBrokerAPI
+        from flamesdk.resources.client_apis.storage_api import StorageAPI
+        from flamesdk.resources.client_apis.po_api import POAPI
+        from flamesdk.resources.utils.utils import wait_until_nginx_online
+
+        self._startup_timings: dict[str, float] = {}
+        startup_start = time.perf_counter()
         self._flame_logger = FlameLogger(silent=silent)
         self.flame_log("Starting FlameCoreSDK")
 
@@ -39,60 +50,64 @@ class FlameCoreSDK:
         self.config = NodeConfig()
 
         # Wait until nginx is online
+        phase_start = time.perf_counter()
         try:
             wait_until_nginx_online(self.config.nginx_name, self._flame_logger)
         except Exception as e:
             self.flame_log(f"Nginx connection failure (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value)
-
-        # Set up the connection to all the services needed
-        ## Connect to MessageBroker
-        self.flame_log("\tConnecting to MessageBroker...", end='', halt_submission=True)
-        try:
-            self._message_broker_api = MessageBrokerAPI(self.config, self._flame_logger)
-            self.flame_log("success", append=True)
-        except Exception as e:
-            self._message_broker_api = None
-            self.flame_log(f"failed (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value, append=True)
-        try:
-            ### Update config with self_config from MessageBroker
-            self.config = self._message_broker_api.config
-        except Exception as e:
-            self.flame_log(f"Unable to retrieve node config from message broker (error_msg='{repr(e)}')",
-                           log_type=LogTypeLiteral.ERROR.value)
-
-        ## Connect to POService
-        self.flame_log("\tConnecting to PO service...", end='', halt_submission=True)
-        try:
-            self._po_api = POAPI(self.config, self._flame_logger, stream_log_level)
-            self._flame_logger.add_po_api(self._po_api)
-            self.flame_log("success", append=True)
-        except Exception as e:
-            self._po_api = None
-            self.flame_log(f"failed (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value, append=True)
-
-        ## Connect to ResultService
-        self.flame_log("\tConnecting to ResultService...", end='', halt_submission=True)
-        try:
-            self._storage_api = StorageAPI(self.config, self._flame_logger)
-            self.flame_log("success", append=True)
-        except Exception as e:
-            self._storage_api = None
-            self.flame_log(f"failed (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value, append=True)
-
-        if (self.config.node_role == 'default') or aggregator_requires_data:
-            ## Connection to DataService
-            self.flame_log("\tConnecting to DataApi...", end='', halt_submission=True)
+        self._startup_timings['nginx'] = time.perf_counter() - phase_start
+
+        # Set up the connection to all the services needed (independent handshakes run concurrently). The
+        # MessageBrokerAPI sets the node's role and id on the shared config while the other services connect, these
+        # are constructed from a snapshot of the config (they only read the settings given by environment variables)
+        config_snapshot = copy.copy(self.config)
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="flamesdk-startup") as executor:
+            ## Connect to MessageBroker
+            message_broker_future = executor.submit(self._connect_service,
+                                                    "MessageBroker",
+                                                    'message_broker',
+                                                    lambda: MessageBrokerAPI(self.config, self._flame_logger))
+            ## Connect to POService
+            po_future = executor.submit(self._connect_service,
+                                        "PO service",
+                                        'po_service',
+                                        lambda: POAPI(config_snapshot, self._flame_logger, stream_log_level))
+            ## Connect to ResultService
+            storage_future = executor.submit(self._connect_service,
+                                             "ResultService",
+                                             'result_service',
+                                             lambda: StorageAPI(config_snapshot, self._flame_logger))
+            ## Connection to DataService (needed by default nodes, and by aggregators requiring data). The node role
+            ## is only known after the MessageBroker handshake, so the connection is attempted alongside it while the
+            ## role is unknown, and only reported (or else discarded) once the role is known
+            data_future = executor.submit(self._attempt_connection,
+                                          lambda: DataAPI(config_snapshot, self._flame_logger)) \
+                if aggregator_requires_data or (config_snapshot.node_role in (None, 'default')) else None
+
+            self._po_api = po_future.result()
+            if self._po_api is not None:
+                self._flame_logger.add_po_api(self._po_api)
+            self._storage_api = storage_future.result()
+            self._message_broker_api = message_broker_future.result()
             try:
-                self._data_api = DataAPI(self.config, self._flame_logger)
-                self.flame_log("success", append=True)
+                ### Update config with self_config from MessageBroker
+                self.config = self._message_broker_api.config
             except Exception as e:
-                self._data_api = None
-                self.flame_log(f"failed (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value, append=True)
-        else:
-            self._data_api = True
+                self.flame_log(f"Unable to retrieve node config from message broker (error_msg='{repr(e)}')",
+                               log_type=LogTypeLiteral.ERROR.value)
+
+            if not (aggregator_requires_data or (self.config.node_role == 'default')):
+                self._data_api = True
+            elif data_future is not None:
+                self._data_api = self._report_connection("DataApi", 'data_api', *data_future.result())
+            else:
+                self._data_api = self._connect_service("DataApi",
+                                                       'data_api',
+                                                       lambda: DataAPI(self.config, self._flame_logger))
 
         # Start the FlameAPI thread used for incoming messages and health checks
         self.flame_log("\tStarting FlameApi thread...", end='', halt_submission=True)
+        phase_start = time.perf_counter()
         try:
             self._flame_api_thread = Thread(target=self._start_flame_api)
             self._status_sync = status_sync
@@ -101,6 +116,11 @@ class FlameCoreSDK:
         except Exception as e:
             self._flame_api_thread = None
             self.flame_log(f"failed (error_msg='{repr(e)}')", log_type=LogTypeLiteral.ERROR.value, append=True)
+        self._startup_timings['flame_api'] = time.perf_counter() - phase_start
+        self._startup_timings['total'] = time.perf_counter() - startup_start
+        self.flame_log("Startup timings (in seconds): " +
+                       ", ".join([f"{phase}={duration:.3f}" for phase, duration in self._startup_timings.items()]),
+                       log_type=LogTypeLiteral.DEBUG.value)
 
         if all([self._message_broker_api, self._po_api, self._storage_api, self._data_api, self._flame_api_thread]):
             self._flame_logger.set_runstatus(AnalysisStatus.EXECUTING.value)
@@ -260,6 +280,14 @@ class FlameCoreSDK:
         else:
             self._flame_logger.raise_error(msg)
 
+    def get_startup_timings(self) -> dict[str, float]:
+        """
+        Returns the duration of each startup phase (nginx, message_broker, po_service, result_service, data_api,
+        flame_api, total) in seconds. Service connections run concurrently, so their durations overlap.
+        :return: dict of phase names and durations
+        """
+        return dict(self._startup_timings)
+
     def get_progress(self) -> int:
         """
         Return current progress integer of this analysis
@@ -276,7 +304,7 @@ class FlameCoreSDK:
         self._flame_logger.set_progress(progress)
 
     def fhir_to_csv(self,
-                    fhir_data: dict[str, Any],
+                    fhir_data: Union[dict[str, Any], str],
                     col_key_seq: str,
                     value_key_seq: str,
                     input_resource: str,
@@ -285,8 +313,14 @@ class FlameCoreSDK:
                     col_id_filters: Optional[list[str]] = None,
                     row_col_name: str = '',
                     separator: str = ',',
-                    output_type: Literal["file", "dict"] = "file"
-                    ) -> Optional[Union[StringIO, dict[Any, dict[Any, Any]]]]:
+                    output_type: Literal["file", "stream", "dict", "numpy", "pandas", "arrow"] = "file",
+                    prefetch_pages: int = 2,
+                    sink: Optional[Union[str, os.PathLike, IO[str]]] = None,
+                    stream_entries: bool = False,
+                    pushdown: bool = False,
+                    exact_filters: bool = False,
+                    workers: Optional[int] = 1
+                    ) -> Optional[Union[StringIO, Iterator[str], str, os.PathLike, IO[str], dict[Any, dict[Any, Any]], Any]]:
         """
         Convert a FHIR Bundle (or other FHIR-formatted dict) to CSV, pivoting on specified keys.
 
@@ -294,7 +328,7 @@ class FlameCoreSDK:
         applies optional filters, and produces either a CSV‐formatted file-like object
         or a nested dictionary representation
 
-        :param fhir_data: FHIR data to convert
+        :param fhir_data: FHIR data to convert, or a FHIR query retrieving it
         :param col_key_seq:
         :param value_key_seq:
         :param input_resource:
@@ -303,10 +337,25 @@ class FlameCoreSDK:
         :param col_id_filters:
         :param row_col_name:
         :param separator:
-        :param output_type:
-        :return: CSV formatted data as StringIO or dict
-        """
-        if type(self._data_api) == DataAPI:
+        :param output_type: 'file' (CSV as StringIO, or written into sink), 'stream' (generator of CSV lines), 'dict', or
+                            columnar: 'numpy' (dict of arrays per column), 'pandas' (DataFrame) or 'arrow'
+                            (pyarrow.Table), which require the respective package
+        :param prefetch_pages: number of following pages of a paginated bundle retrieved ahead while parsing
+        :param sink: optional file path or writable text file-like object the CSV is written into line by line
+                     (output_type='file'), instead of being held in memory
+        :param stream_entries: parse the entries of following pages incrementally from the responses, instead of
+                               decoding each page as a whole (bounds memory for pages with large _count values)
+        :param pushdown: if fhir_data is a query, add an _elements projection to it, derived from the key sequences
+        :param exact_filters: the row/column id filters match ids as a whole (not as substrings), which allows pushdown
+                              to add them to the query as search parameters (the client-side filters still apply)
+        :param workers: number of processes decoding and flattening the following pages of a paginated bundle in
+                        parallel (None for one per cpu core, default: 1 for a serial conversion in the calling thread),
+                        the output is identical to the serial one (the workers decode whole pages, stream_entries only
+                        applies to a serial conversion)
+        :return: CSV formatted data as StringIO, the sink, a generator of CSV lines, dict or columnar data
+        """
+        if self._has_data_api():
+            from flamesdk.resources.utils.fhir import fhir_to_csv
             return fhir_to_csv(fhir_data=fhir_data,
                                col_key_seq=col_key_seq,
                                value_key_seq=value_key_seq,
@@ -318,7 +367,13 @@ class FlameCoreSDK:
                                row_col_name=row_col_name,
                                separator=separator,
                                output_type=output_type,
-                               data_client=self._data_api)
+                               data_client=self._data_api,
+                               prefetch_pages=prefetch_pages,
+                               sink=sink,
+                               stream_entries=stream_entries,
+                               pushdown=pushdown,
+                               exact_filters=exact_filters,
+                               workers=workers)
         else:
             self.flame_log("Data API is not available, cannot convert FHIR to CSV",
                            log_type=LogTypeLiteral.WARNING.value)
@@ -342,7 +397,8 @@ class FlameCoreSDK:
         :param attempt_timeout: timeout of each attempt, if timeout is None (the last attempt will be indefinite though)
         :return: a tuple of nodes ids that acknowledged and not acknowledged the message
         """
-        return asyncio.run(self._message_broker_api.send_message(receivers,
+        from flamesdk.resources.utils.event_loop import run_coroutine
+        return run_coroutine(self._message_broker_api.send_message(receivers,
                                                                  message_category,
                                                                  message,
                                                                  max_attempts,
@@ -362,7 +418,8 @@ class FlameCoreSDK:
         :param timeout: time in seconds to wait for the message, if None waits indefinitely
         :return:
         """
-        return asyncio.run(self._message_broker_api.await_messages(senders, message_category, message_id, timeout))
+        from flamesdk.resources.utils.event_loop import run_coroutine
+        return run_coroutine(self._message_broker_api.await_messages(senders, message_category, message_id, timeout))
 
     def get_messages(self, status: Literal['unread', 'read'] = 'unread') -> list[Message]:
         """
@@ -429,6 +486,8 @@ class FlameCoreSDK:
         This method is only available for nodes for which the method `get_role(self)` returns "aggregator".
         :param result: the final result (single object or list of objects). If a list is provided,
                        each element will be submitted separately by calling the endpoint multiple times.
+                       A file path (pathlib.Path), binary file object or generator of bytes chunks is streamed to the hub
+                       as is, without being read into memory (a str is submitted as a regular result).
         :param output_type: output type of final results (can be list of type literals if multiple_results=True, default: string)
         :param multiple_results: whether the result is to be split into separate results (per element in tuple) or a single result
         :param filename: optional filename for the result file on the hub. For multiple_results, pass a list of names
@@ -443,13 +502,21 @@ class FlameCoreSDK:
                                data: Any,
                                location: Literal["local", "global"],
                                remote_node_ids: Optional[list[str]] = None,
-                               tag: Optional[str] = None) -> Union[dict[str, dict[str, str]], dict[str, str]]:
+                               tag: Optional[str] = None,
+                               broadcast: bool = False,
+                               codec: Optional[str] = None) -> Union[dict[str, dict[str, str]], dict[str, str]]:
         """
         Saves intermediate results/data either on the hub (location="global"), or locally (location="local")
-        :param data: the result to save
+        :param data: the result to save. A file path (pathlib.Path), binary file object or generator of bytes chunks is streamed
+        to the storage as is (retrieved as bytes), without being read into memory
         :param location: the location to save the result, local saves in the node, global saves in central instance of MinIO
         :param remote_node_ids: optional remote node ids (used for accessing remote node's public key for encryption)
         :param tag: optional storage tag
+        :param broadcast: whether to upload global data once for all remote nodes (encrypted under a single content key
+        that is wrapped for each receiver) instead of once per remote node
+        :param codec: serializer of the data, 'pickle5' (any object, numpy arrays out-of-band), 'npy' (numpy array), 'arrow'
+        (pyarrow table) or 'msgpack' (plain data), chosen by the type of the data if None. Receivers decode it
+        automatically.
         :return: the request status code{"status":, "url":, "id": }, or dict of said dicts if encrypted mode is used, i.e. remote_node_ids are set
         """
         if (location == "global") and (remote_node_ids is None):
@@ -458,7 +525,9 @@ class FlameCoreSDK:
         return self._storage_api.save_intermediate_data(data,
                                                         location=location,
                                                         remote_node_ids=remote_node_ids,
-                                                        tag=tag)
+                                                        tag=tag,
+                                                        broadcast=broadcast,
+                                                        codec=codec)
 
     def get_intermediate_data(self,
                               location: Literal["local", "global"],
@@ -484,7 +553,9 @@ class FlameCoreSDK:
                                message_category: str = "intermediate_data",
                                max_attempts: int = 1,
                                timeout: Optional[int] = None,
-                               attempt_timeout: int = 10) -> tuple[list[str], list[str]]:
+                               attempt_timeout: int = 10,
+                               broadcast: bool = False,
+                               codec: Optional[str] = None) -> tuple[list[str], list[str]]:
         """
         Sends intermediate data to specified receivers using the Result Service and Message Broker.
 
@@ -500,6 +571,11 @@ class FlameCoreSDK:
             max_attempts (int): the maximum number of attempts to send the message
             timeout (int, optional): time in seconds to wait for the message acknowledgement, if None waits indefinitely
             attempt_timeout (int): timeout of each attempt, if timeout is None (the last attempt will be indefinite though)
+            broadcast (bool): whether to upload the data only once for all receivers (encrypted under a single content
+                              key, of which each receiver gets its own wrapped copy), instead of once per receiver.
+                              Falls back to one upload per receiver if the storage service does not support it.
+            codec (str, optional): serializer of the data ('pickle5', 'npy', 'arrow' or 'msgpack'), chosen by the type
+                                   of the data if None.
 
         Returns:
             tuple[list[str], list[str]]:
@@ -521,7 +597,9 @@ class FlameCoreSDK:
         result_id_body = {k: v['id']
                           for k, v in self.save_intermediate_data(data,
                                                                   "global",
-                                                                  remote_node_ids=receivers).items()}
+                                                                  remote_node_ids=receivers,
+                                                                  broadcast=broadcast,
+                                                                  codec=codec).items()}
         return self.send_message(receivers,
                                  message_category,
                                  {"result_id": result_id_body},
@@ -592,7 +670,7 @@ class FlameCoreSDK:
         Returns a list of all data sources available for this project.
         :return: the list of data sources
         """
-        if isinstance(self._data_api, DataAPI):
+        if self._has_data_api():
             return self._data_api.get_data_sources()
         else:
             self.flame_log("Data API is not available, cannot retrieve data sources",
@@ -605,7 +683,7 @@ class FlameCoreSDK:
         :param data_id: the id of the data source
         :return: the data client
         """
-        if isinstance(self._data_api, DataAPI):
+        if self._has_data_api():
             return self._data_api.get_data_client(data_id)
         else:
             self.flame_log("Data API is not available, cannot retrieve data client",
@@ -618,21 +696,25 @@ class FlameCoreSDK:
         :param fhir_queries: list of queries to get the data
         :return:
         """
-        if isinstance(self._data_api, DataAPI):
+        if self._has_data_api():
             return self._data_api.get_fhir_data(fhir_queries)
         else:
             self.flame_log("Data API is not available, cannot retrieve FHIR data",
                            log_type=LogTypeLiteral.WARNING.value)
             return None
 
-    def get_s3_data(self, s3_keys: Optional[list[str]] = []) -> Optional[list[dict[str, bytes]]]:
+    def get_s3_data(self,
+                    s3_keys: Optional[list[str]] = [],
+                    spill_dir: Optional[str] = None) -> Optional[list[dict[str, Union[bytes, str]]]]:
         """
         Returns the data from the S3 store associated with the given key.
         :param s3_keys:f
+        :param spill_dir: if given, each object is streamed into a file below spill_dir/<source name>/ instead of being
+        held in memory, and the path of the file is returned in place of its content
         :return:
         """
-        if isinstance(self._data_api, DataAPI):
-            return self._data_api.get_s3_data(s3_keys)
+        if self._has_data_api():
+            return self._data_api.get_s3_data(s3_keys, spill_dir)
         else:
             self.flame_log("Data API is not available, cannot retrieve S3 data",
                            log_type=LogTypeLiteral.WARNING.value)
@@ -640,13 +722,60 @@ class FlameCoreSDK:
 
 
     ########################################Internal###############################################
+    def _connect_service(self, service_name: str, phase: str, connect: Callable[[], Any]) -> Optional[Any]:
+        """
+        Connects to a service during startup, logging the result and recording the duration of the phase
+        :param service_name: name of the service used in logs
+        :param phase: name of the startup phase
+        :param connect: callable creating the service api
+        :return: the service api, or None if the connection failed
+        """
+        return self._report_connection(service_name, phase, *self._attempt_connection(connect))
+
+    @staticmethod
+    def _attempt_connection(connect: Callable[[], Any]) -> tuple[Optional[Any], Optional[Exception], float]:
+        """
+        Connects to a service without reporting the result (see _report_connection)
+        :param connect: callable creating the service api
+        :return: the service api (None if the connection failed), the error (if any) and the duration in seconds
+        """
+        phase_start = time.perf_counter()
+        try:
+            service, error = connect(), None
+        except Exception as e:
+            service, error = None, e
+        return service, error, time.perf_counter() - phase_start
+
+    def _report_connection(self,
+                           service_name: str,
+                           phase: str,
+                           service: Optional[Any],
+                           error: Optional[Exception],
+                           duration: float) -> Optional[Any]:
+        if error is None:
+            self.flame_log(f"\tConnecting to {service_name}...success")
+        else:
+            self.flame_log(f"\tConnecting to {service_name}...failed (error_msg='{repr(error)}')",
+                           log_type=LogTypeLiteral.ERROR.value)
+        self._startup_timings[phase] = duration
+        return service
+
+    def _has_data_api(self) -> bool:
+        """
+        Checks whether a connection to the DataApi has been established
+        :return: True if the DataApi is available
+        """
+        from flamesdk.resources.client_apis.data_api import DataAPI
+        return isinstance(self._data_api, DataAPI)
+
     def _start_flame_api(self) -> None:
         """
         Start the flame api, this is used for incoming messages from the message broker and health checks
         :return:
         """
+        from flamesdk.resources.rest_api import FlameAPI
         self.flame_api = FlameAPI(self._message_broker_api.message_broker_client,
-                                  self._data_api.data_client if isinstance(self._data_api, DataAPI) else self._data_api,
+                                  self._data_api.data_client if self._has_data_api() else self._data_api,
                                   self._storage_api.storage_client,
                                   self._po_api.po_client,
                                   self._flame_logger,
@@ -665,6 +794,7 @@ class FlameCoreSDK:
             self.set_progress(100)
             self._flame_logger.set_runstatus(AnalysisStatus.EXECUTED.value)
             self.flame_log("Node finished successfully")
+            self._flame_logger.flush(timeout=30)
             self.config.finish_analysis()
         return self.config.finished
 
@@ -1,85 +1,479 @@
-from typing import Optional, Any
 import asyncio
-from httpx import AsyncClient, HTTPStatusError, ConnectError, TimeoutException, Timeout
+import codecs
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from typing import Optional, Any, TypedDict, Union
+from httpx import AsyncClient, HTTPStatusError, ConnectError, Response, TimeoutException, Timeout
 import re
 
 
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import LogTypeLiteral
+from flamesdk.resources.utils.event_loop import get_event_loop, run_coroutine
+from flamesdk.resources.utils.fhir import get_next_page_query
+from flamesdk.resources.utils.response_cache import get_response_cache
+from flamesdk.resources.utils.transport import get_async_transport, get_keycloak_auth, set_keycloak_token
+
+
+# number of most recently retrieved fhir bundles whose data source is remembered (see get_bundle_source)
+MAX_REMEMBERED_BUNDLES = 1024
+
+
+class S3Object(TypedDict):
+    key: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
 
 
 class DataApiClient:
-    def __init__(self, project_id: str, nginx_name: str, data_source_token: str, keycloak_token: str, flame_logger: FlameLogger) -> None:
+    def __init__(self,
+                 project_id: str,
+                 nginx_name: str,
+                 data_source_token: str,
+                 keycloak_token: str,
+                 flame_logger: FlameLogger,
+                 max_concurrency: int = 10) -> None:
         self.nginx_name = nginx_name
         self.flame_logger = flame_logger
+        # upper bound of data requests in flight at once (shared by all sources and queries of a get_data call)
+        self.max_concurrency = max_concurrency
+        # id of the most recently retrieved fhir bundles -> name of the data source that produced it (pins follow-up
+        # pages), least recently used first
+        self._bundle_sources: OrderedDict[str, str] = OrderedDict()
         self.client = AsyncClient(base_url=f"http://{nginx_name}/kong",
                                   headers={"apikey": data_source_token,
                                            "Content-Type": "application/json"},
-                                  follow_redirects=True)
+                                  follow_redirects=True,
+                                  transport=get_async_transport())
         self.hub_client = AsyncClient(base_url=f"http://{nginx_name}/hub-adapter",
-                                      headers={"Authorization": f"Bearer {keycloak_token}",
-                                               "accept": "application/json"},
-                                      follow_redirects=True)
+                                      headers={"accept": "application/json"},
+                                      auth=get_keycloak_auth(keycloak_token),
+                                      follow_redirects=True,
+                                      transport=get_async_transport())
 
         self.project_id = project_id
-        self.available_sources = asyncio.run(self._retrieve_available_sources())
+        self.available_sources = run_coroutine(self._retrieve_available_sources())
 
     def refresh_token(self, keycloak_token: str) -> None:
-        self.hub_client = AsyncClient(base_url=f"http://{self.nginx_name}/hub-adapter",
-                                      headers={"Authorization": f"Bearer {keycloak_token}",
-                                               "accept": "application/json"},
-                                      follow_redirects=True)
+        set_keycloak_token(keycloak_token)
 
     def get_available_sources(self) -> list[dict[str, Any]]:
         return self.available_sources
 
+    def get_bundle_source(self, bundle: dict[str, Any]) -> Optional[str]:
+        """
+        Returns the name of the data source that produced the given fhir bundle
+        :param bundle: a fhir bundle retrieved via get_data or iter_fhir_pages (one of the last MAX_REMEMBERED_BUNDLES)
+        :return: the source name, or None if the bundle can not be attributed to a single source
+        """
+        source_name = self._bundle_sources.get(bundle.get('id')) if isinstance(bundle.get('id'), str) else None
+        if source_name is not None:
+            self._bundle_sources.move_to_end(bundle['id'])
+        if (source_name is None) and (len(self.available_sources) == 1):
+            source_name = self.available_sources[0]['name']
+        return source_name
+
+    def iter_fhir_pages(self, source_name: str, fhir_query: str, prefetch: int = 2) -> Iterator[dict[str, Any]]:
+        """
+        Iterates over the pages (bundles) of a fhir query on a single data source, following the bundles' next links.
+        While the caller processes a page, up to prefetch following pages are retrieved in the background.
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param prefetch: number of pages to retrieve ahead of the caller
+        :return: iterator over the bundles
+        """
+        return self._iter_fetched_fhir_pages(source_name, fhir_query, prefetch, raw=False)
+
+    def iter_fhir_page_bytes(self, source_name: str, fhir_query: str, prefetch: int = 2) -> Iterator[bytes]:
+        """
+        Iterates over the pages of a fhir query on a single data source like iter_fhir_pages, but yields each page's
+        json as retrieved, without decoding its entries (only the fields preceding them, to follow the next link)
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param prefetch: number of pages to retrieve ahead of the caller
+        :return: iterator over the json bytes of the bundles
+        """
+        return self._iter_fetched_fhir_pages(source_name, fhir_query, prefetch, raw=True)
+
+    def _iter_fetched_fhir_pages(self,
+                                 source_name: str,
+                                 fhir_query: str,
+                                 prefetch: int,
+                                 raw: bool) -> Iterator[Union[dict[str, Any], bytes]]:
+        pages = run_coroutine(_new_queue(max(1, prefetch)))
+        fetcher = asyncio.run_coroutine_threadsafe(self._fetch_fhir_pages(source_name, fhir_query, pages, raw),
+                                                   get_event_loop())
+        try:
+            while True:
+                page = run_coroutine(pages.get())
+                if page is None:
+                    break
+                elif isinstance(page, Exception):
+                    self.flame_logger.raise_error(f"Failed to retrieve fhir data page for query {fhir_query} "
+                                                  f"from source {source_name}: {repr(page)}")
+                    break
+                yield page
+        finally:
+            fetcher.cancel()
+
+    def iter_fhir_page_streams(self,
+                               source_name: str,
+                               fhir_query: str,
+                               read_ahead: int = 16) -> Iterator['FhirPageStream']:
+        """
+        Iterates over the pages of a fhir query on a single data source like iter_fhir_pages, but without decoding
+        whole bundles: the items of each page's 'entry' array are parsed incrementally from the response byte stream
+        and handed over as soon as they are complete. A page's remaining fields become available in its bundle
+        attribute once its entries have been consumed (advancing to the next page drains the current one).
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param read_ahead: number of parsed response chunks (batches of entries) retrieved ahead of the caller
+        :return: iterator over the page streams
+        """
+        items = run_coroutine(_new_queue(max(1, read_ahead)))
+        fetcher = asyncio.run_coroutine_threadsafe(self._stream_fhir_pages(source_name, fhir_query, items),
+                                                   get_event_loop())
+
+        ended = False
+
+        def read_item() -> Union[object, list[dict[str, Any]], dict[str, Any], None]:
+            # after a failure or the last page, the queue is closed and every further read ends the iteration
+            nonlocal ended
+            if ended:
+                return None
+            item = run_coroutine(items.get())
+            if isinstance(item, Exception):
+                ended = True
+                self.flame_logger.raise_error(f"Failed to stream fhir data page for query {fhir_query} "
+                                              f"from source {source_name}: {repr(item)}")
+                return None
+            ended = item is None
+            return item
+
+        try:
+            while read_item() is _PAGE_START:
+                page = FhirPageStream(read_item)
+                yield page
+                page.drain()
+        finally:
+            fetcher.cancel()
+
+    def iter_s3_objects(self,
+                        source_name: str,
+                        prefix: Optional[str] = None,
+                        delimiter: Optional[str] = None) -> Iterator[Union[S3Object, str]]:
+        """
+        Iterates over the objects of an s3 data source (ListObjectsV2), following the continuation tokens of truncated
+        listings. Prefix and delimiter are evaluated by the data source.
+        :param source_name: name of the data source
+        :param prefix: only list keys starting with this prefix
+        :param delimiter: if given, keys containing the delimiter after the prefix are rolled up into common prefixes
+        :return: iterator over the objects (key, size, etag and last_modified), followed by the common prefixes (str)
+        """
+        continuation = None
+        while True:
+            try:
+                objects, common_prefixes, continuation = run_coroutine(self._list_s3_page(source_name,
+                                                                                          prefix,
+                                                                                          delimiter,
+                                                                                          continuation))
+            except (HTTPStatusError, ConnectError, TimeoutException, ElementTree.ParseError) as e:
+                self.flame_logger.raise_error(f"Failed to list S3 objects of source {source_name}: {repr(e)}")
+            yield from objects
+            yield from common_prefixes
+            if continuation is None:
+                break
+
     def get_data(self,
                  s3_keys: Optional[list[str]] = None,
-                 fhir_queries: Optional[list[str]] = None) -> Optional[list[dict[str, Any]]]:
+                 fhir_queries: Optional[list[str]] = None,
+                 spill_dir: Optional[str] = None) -> Optional[list[dict[str, Any]]]:
         if (s3_keys is None) and ((fhir_queries is None) or (len(fhir_queries) == 0)):
             return None
-        dataset_sources = []
-        for source in self.available_sources:
-            datasets = {}
-            # get fhir data
-            if fhir_queries is not None:
-                for fhir_query in fhir_queries:  # premise: retrieves data for each fhir_query from each data source
-                    try:
-                        response = asyncio.run(self.client.get(f"{source['name']}/fhir/{fhir_query}",
-                                                               headers=[('Connection', 'close')],
-                                                               timeout=Timeout(5, write=None, read=None)))
-                        response.raise_for_status()
-                    except (HTTPStatusError, ConnectError, TimeoutException) as e:
-                        self.flame_logger.new_log(f"Failed to retrieve fhir data for query {fhir_query} "
-                                                  f"from source {source['name']}: {repr(e)}",
-                                                  log_type=LogTypeLiteral.WARNING.value)
-                        continue
-                    datasets[fhir_query] = response.json()
-            # get s3 data
+        # get fhir data
+        if fhir_queries is not None:
+            return run_coroutine(self._get_fhir_datasets(fhir_queries))
+        # get s3 data
+        dataset_sources, failures = run_coroutine(self._get_s3_datasets(s3_keys, spill_dir))
+        for source_name, res_name, e in failures:
+            self.flame_logger.raise_error(f"Failed to retrieve s3 data for key {res_name} "
+                                          f"from source {source_name}: {repr(e)}")
+        return dataset_sources
+
+    async def _get_s3_datasets(self,
+                               s3_keys: list[str],
+                               spill_dir: Optional[str]) -> tuple[list[dict[str, Union[bytes, str]]],
+                                                                  list[tuple[str, str, Exception]]]:
+        """
+        Retrieves the s3 objects matching the given keys from each data source, with all downloads issued concurrently
+        (at most max_concurrency at a time)
+        :param s3_keys: names of the s3 datasets (all datasets if empty)
+        :param spill_dir: if given, each object is streamed into a file below this directory instead of into memory
+        :return: one dict per data source, mapping each key to its content (or file path, in listing order), and the
+        (source name, key, exception) of each failed download
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        source_names = [source['name'] for source in self.available_sources]
+        # the data sources only list keys sharing the common prefix of the requested ones
+        prefix = os.path.commonprefix(s3_keys) if s3_keys else None
+        dataset_names = await asyncio.gather(*[self._get_s3_dataset_names(source_name, prefix)
+                                               for source_name in source_names])
+        # premise: only retrieves data corresponding to s3_keys from each data source
+        requests = [(i, res_name)
+                    for i, response_names in enumerate(dataset_names)
+                    for res_name in response_names
+                    if (len(s3_keys) == 0) or (res_name in s3_keys)]
+        responses = await asyncio.gather(*[self._get_s3_dataset(source_names[i], res_name, spill_dir, semaphore)
+                                           for i, res_name in requests],
+                                         return_exceptions=True)
+
+        dataset_sources, failures = [{} for _ in source_names], []
+        for (i, res_name), data in zip(requests, responses):
+            if isinstance(data, BaseException):
+                failures.append((source_names[i], res_name, data))
             else:
-                response_names = asyncio.run(self._get_s3_dataset_names(source['name']))
-                for res_name in response_names:  # premise: only retrieves data corresponding to s3_keys from each data source
-                    if (len(s3_keys) == 0) or (res_name in s3_keys):
-                        try:
-                            response = asyncio.run(self.client.get(f"{source['name']}/s3/{res_name}",
-                                                                   headers=[('Connection', 'close')],
-                                                                   timeout=Timeout(5, write=None, read=None)))
-                            response.raise_for_status()
-                        except (HTTPStatusError, ConnectError, TimeoutException) as e:
-                            self.flame_logger.raise_error(f"Failed to retrieve s3 data for key {res_name} "
-                                                          f"from source {source['name']}: {repr(e)}")
-                        datasets[res_name] = response.content
-            dataset_sources.append(datasets)
+                dataset_sources[i][res_name] = data
+        return dataset_sources, failures
+
+    async def _get_s3_dataset(self,
+                              source_name: str,
+                              res_name: str,
+                              spill_dir: Optional[str],
+                              semaphore: asyncio.Semaphore) -> Union[bytes, str]:
+        async with semaphore:
+            if spill_dir is None:
+                return (await self._get_cached(source_name, 's3', f"{source_name}/s3/{res_name}")).content
+            return await self._spill_s3_dataset(source_name, res_name, spill_dir)
+
+    async def _spill_s3_dataset(self, source_name: str, res_name: str, spill_dir: str) -> str:
+        # streams the object into <spill_dir>/<source_name>/<key> chunk by chunk (via a temporary file, so that an
+        # interrupted download never leaves a truncated object behind) and returns the path of the file
+        source_dir = os.path.abspath(os.path.join(spill_dir, source_name))
+        path = os.path.abspath(os.path.join(source_dir, res_name))
+        if os.path.commonpath([source_dir, path]) != source_dir:
+            raise ValueError(f"S3 key {res_name} points outside of the spill directory")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                async with self.client.stream("GET",
+                                              f"{source_name}/s3/{res_name}",
+                                              timeout=Timeout(5, write=None, read=None)) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return path
+
+    async def _get_fhir_datasets(self, fhir_queries: list[str]) -> list[dict[str, Any]]:
+        """
+        Retrieves the data for each fhir query from each data source, with all requests issued concurrently
+        (at most max_concurrency at a time)
+        :param fhir_queries: list of fhir queries
+        :return: one dict per data source, mapping each successful fhir query to its data (in query order)
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        # premise: retrieves data for each fhir_query from each data source
+        requests = [(source['name'], fhir_query) for source in self.available_sources for fhir_query in fhir_queries]
+        responses = await asyncio.gather(*[self._get_fhir_dataset(source_name, fhir_query, semaphore)
+                                           for source_name, fhir_query in requests])
+
+        dataset_sources = [{} for _ in self.available_sources]
+        for i, data in enumerate(responses):
+            if data is not None:
+                dataset_sources[i // len(fhir_queries)][requests[i][1]] = data
         return dataset_sources
 
-    async def _get_s3_dataset_names(self, source_name: str) -> list[str]:
+    async def _get_fhir_dataset(self,
+                                source_name: str,
+                                fhir_query: str,
+                                semaphore: asyncio.Semaphore) -> Optional[dict[str, Any]]:
+        async with semaphore:
+            try:
+                response = await self._get_cached(source_name, 'fhir', f"{source_name}/fhir/{fhir_query}")
+            except (HTTPStatusError, ConnectError, TimeoutException) as e:
+                self.flame_logger.new_log(f"Failed to retrieve fhir data for query {fhir_query} "
+                                          f"from source {source_name}: {repr(e)}",
+                                          log_type=LogTypeLiteral.WARNING.value)
+                return None
+            data = response.json()
+        self._remember_bundle_source(data, source_name)
+        return data
+
+    async def _fetch_fhir_pages(self, source_name: str, fhir_query: str, pages: asyncio.Queue, raw: bool) -> None:
+        # retrieves one page after another (each next link is only known once its predecessor has arrived), the
+        # bounded queue lets the retrieval run ahead of the consumer by at most its maxsize pages
+        cancelled = False
         try:
-            response = await self.client.get(f"{source_name}/s3", headers=[('Connection', 'close')])
+            next_query = fhir_query
+            while next_query:
+                response = await self._get_cached(source_name, 'fhir', f"{source_name}/fhir/{next_query}")
+                bundle = _read_bundle_head(response.content) if raw else response.json()
+                self._remember_bundle_source(bundle, source_name)
+                await pages.put(response.content if raw else bundle)
+                next_query = get_next_page_query(bundle)
+                if next_query:
+                    self.flame_logger.new_log(f"Prefetching next batch query={next_query} from source {source_name}",
+                                              log_type=LogTypeLiteral.DEBUG.value)
+        except asyncio.CancelledError:
+            # the consumer stopped iterating, nobody is waiting for the end of the queue
+            cancelled = True
+            raise
+        except Exception as e:
+            # any failure (http status, transport, decoding) is reported by the consumer
+            await pages.put(e)
+        finally:
+            if not cancelled:
+                await pages.put(None)
+
+    async def _stream_fhir_pages(self, source_name: str, fhir_query: str, items: asyncio.Queue) -> None:
+        # puts _PAGE_START, the entries parsed from each response chunk (as lists), the page's remaining fields (as
+        # dict) for each page, and None once the last page has been streamed (or after an exception put on failure)
+        cancelled = False
+        try:
+            next_query = fhir_query
+            while next_query:
+                parser = _BundleStreamParser()
+                async with self.client.stream("GET",
+                                              f"{source_name}/fhir/{next_query}",
+                                              timeout=Timeout(5, write=None, read=None)) as response:
+                    response.raise_for_status()
+                    await items.put(_PAGE_START)
+                    async for chunk in response.aiter_bytes():
+                        entries = parser.feed(chunk)
+                        if entries:
+                            await items.put(entries)
+                    entries = parser.close()
+                    if entries:
+                        await items.put(entries)
+                self._remember_bundle_source(parser.bundle, source_name)
+                await items.put(parser.bundle)
+                next_query = get_next_page_query(parser.bundle)
+                if next_query:
+                    self.flame_logger.new_log(f"Streaming next batch query={next_query} from source {source_name}",
+                                              log_type=LogTypeLiteral.DEBUG.value)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            await items.put(e)
+        finally:
+            if not cancelled:
+                await items.put(None)
+
+    async def _get_cached(self, source_name: str, kind: str, path: str) -> Response:
+        """
+        Retrieves a data source response through the on-disk response cache (if configured): a cached response is
+        revalidated with a conditional request and, if still valid (304), it is replayed from disk, with the headers it
+        was originally received with, instead of being transferred again. The disk accesses run in the event loop's
+        default executor, not on the shared loop itself
+        :param source_name: name of the data source
+        :param kind: kind of the request ('fhir' or 's3')
+        :param path: request path relative to the data source api
+        :return: the (successful) response
+        """
+        cache = get_response_cache()
+        if cache is None:
+            response = await self.client.get(path, timeout=Timeout(5, write=None, read=None))
             response.raise_for_status()
-        except (HTTPStatusError, ConnectError, TimeoutException) as e:
-            self.flame_logger.raise_error(f"Failed to retrieve S3 dataset names from source {source_name}: {repr(e)}")
-        responses = re.findall(r'<Key>(.*?)</Key>', str(response.text))
-        return responses
+            return response
+        loop = asyncio.get_running_loop()
+        key = cache.key(source_name, kind, path)
+        response = await self.client.get(path,
+                                         headers=await loop.run_in_executor(None, cache.conditional_headers, key),
+                                         timeout=Timeout(5, write=None, read=None))
+        if response.status_code == 304:
+            cached = await loop.run_in_executor(None, cache.read, key)
+            if cached is not None:
+                self.flame_logger.new_log(f"Serving {kind} response for {path} from the response cache",
+                                          log_type=LogTypeLiteral.DEBUG.value)
+                body, headers = cached
+                return Response(200, headers=headers, content=body, request=response.request)
+            # the cached body vanished in the meantime (evicted or removed), so retrieve it unconditionally
+            response = await self.client.get(path, timeout=Timeout(5, write=None, read=None))
+        response.raise_for_status()
+        await loop.run_in_executor(None, cache.store, key, response.content, response.headers)
+        return response
+
+    def _remember_bundle_source(self, bundle: Any, source_name: str) -> None:
+        if isinstance(bundle, dict) and isinstance(bundle.get('id'), str):
+            self._bundle_sources[bundle['id']] = source_name
+            self._bundle_sources.move_to_end(bundle['id'])
+            while len(self._bundle_sources) > MAX_REMEMBERED_BUNDLES:
+                self._bundle_sources.popitem(last=False)
+
+    async def _get_s3_dataset_names(self, source_name: str, prefix: Optional[str] = None) -> list[str]:
+        names, continuation = [], None
+        while True:
+            try:
+                objects, _, continuation = await self._list_s3_page(source_name, prefix, None, continuation)
+            except (HTTPStatusError, ConnectError, TimeoutException, ElementTree.ParseError) as e:
+                self.flame_logger.raise_error(f"Failed to retrieve S3 dataset names from source {source_name}: "
+                                              f"{repr(e)}")
+            names.extend(s3_object['key'] for s3_object in objects)
+            if continuation is None:
+                return names
+
+    async def _list_s3_page(self,
+                            source_name: str,
+                            prefix: Optional[str],
+                            delimiter: Optional[str],
+                            continuation: Optional[tuple[str, str]]) -> tuple[list[S3Object],
+                                                                              list[str],
+                                                                              Optional[tuple[str, str]]]:
+        """
+        Retrieves one page of a ListObjectsV2 listing
+        :param source_name: name of the data source
+        :param prefix: prefix of the listed keys
+        :param delimiter: delimiter rolling up keys into common prefixes
+        :param continuation: the (parameter, value) continuing a truncated listing, None for the first page
+        :return: the objects and common prefixes of the page, and the continuation of the next page (None on the last)
+        """
+        params = {'list-type': '2'}
+        if prefix:
+            params['prefix'] = prefix
+        if delimiter:
+            params['delimiter'] = delimiter
+        if continuation is not None:
+            params[continuation[0]] = continuation[1]
+        response = await self.client.get(f"{source_name}/s3", params=params)
+        response.raise_for_status()
+        root = ElementTree.fromstring(response.text)
+
+        def text(element: ElementTree.Element, tag: str) -> Optional[str]:
+            # ignores the namespace of the S3 schema (http://s3.amazonaws.com/doc/2006-03-01/)
+            for child in element:
+                if child.tag.rsplit('}', 1)[-1] == tag:
+                    return child.text
+            return None
+
+        objects, common_prefixes = [], []
+        for element in root:
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag == 'Contents':
+                objects.append(S3Object(key=text(element, 'Key'),
+                                        size=int(text(element, 'Size') or 0),
+                                        etag=text(element, 'ETag'),
+                                        last_modified=text(element, 'LastModified')))
+            elif tag == 'CommonPrefixes':
+                common_prefixes.append(text(element, 'Prefix'))
+
+        next_continuation = None
+        if (text(root, 'IsTruncated') or '').lower() == 'true':
+            if text(root, 'NextContinuationToken'):
+                next_continuation = ('continuation-token', text(root, 'NextContinuationToken'))
+            elif objects or common_prefixes:
+                # data sources without continuation tokens continue after the last key (or prefix) returned
+                next_continuation = ('start-after', max([o['key'] for o in objects] + common_prefixes))
+        return objects, common_prefixes, next_continuation
 
     def get_data_source_client(self, data_id: str) -> AsyncClient:
         """
@@ -105,3 +499,172 @@ class DataApiClient:
                                           f" {repr(e)}")
 
         return response.json()['data']
+
+
+async def _new_queue(maxsize: int) -> asyncio.Queue:
+    # created on the background event loop, since queues bind to the running loop on python<3.10
+    return asyncio.Queue(maxsize)
+
+
+# marks the start of a page in the item queue of a page stream
+_PAGE_START = object()
+
+
+class FhirPageStream:
+    """
+    A page of a fhir search whose entries are parsed while being iterated (see DataApiClient.iter_fhir_page_streams).
+    """
+
+    def __init__(self, read_item: Callable[[], Any]) -> None:
+        self.bundle: Optional[dict[str, Any]] = None
+        self._read_item = read_item
+        self.entries = self._iter_entries()
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return self.entries
+
+    def drain(self) -> None:
+        for _ in self.entries:
+            pass
+
+    def _iter_entries(self) -> Iterator[dict[str, Any]]:
+        while True:
+            item = self._read_item()
+            if isinstance(item, list):
+                yield from item
+            else:
+                # the remaining top-level fields of the bundle mark the end of the page
+                self.bundle = item
+                return
+
+
+class _BundleStreamParser:
+    """
+    Incremental parser of a fhir bundle's json byte stream. The items of the top-level 'entry' array are decoded one
+    at a time as soon as they are complete, all other top-level fields are collected into bundle. Only the unparsed
+    remainder of the stream is buffered.
+    """
+    _WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, head_only: bool = False) -> None:
+        self.bundle: dict[str, Any] = {}
+        # stop at the start of the 'entry' array, leaving the entries (and any fields following them) unparsed
+        self.head_only = head_only
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        # size of the unparsed remainder required before an incomplete value is decoded again (grows geometrically, so
+        # large values are not re-scanned on every chunk)
+        self._retry_size = 0
+
+    def feed(self, chunk: bytes) -> list[dict[str, Any]]:
+        """
+        Parses the next chunk of the byte stream
+        :param chunk: the bytes
+        :return: the entries completed by this chunk
+        """
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(chunk)
+        self._pos = 0
+        return self._parse(final=False)
+
+    def close(self) -> list[dict[str, Any]]:
+        """
+        Finishes parsing at the end of the byte stream
+        :raises ValueError: if the stream did not contain a complete json object
+        :return: the remaining entries
+        """
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(b'', final=True)
+        self._pos = 0
+        entries = self._parse(final=True)
+        if self._state != 'end':
+            raise ValueError("Incomplete fhir bundle in response")
+        return entries
+
+    @property
+    def at_entries(self) -> bool:
+        return self._state == 'entries'
+
+    def _parse(self, final: bool) -> list[dict[str, Any]]:
+        entries = []
+        if self.head_only and self.at_entries:
+            return entries
+        buffer = self._buffer
+        while True:
+            pos = self._WHITESPACE.match(buffer, self._pos).end()
+            self._pos = pos
+            if pos >= len(buffer):
+                return entries
+            char = buffer[pos]
+            if self._state == 'start':
+                if char != '{':
+                    raise ValueError(f"Expected a json object as fhir bundle (found {char!r})")
+                self._pos, self._state = pos + 1, 'key'
+            elif self._state in ('key', 'entries') and (char == ','):
+                self._pos = pos + 1
+            elif (self._state == 'key') and (char == '}'):
+                self._pos, self._state = pos + 1, 'end'
+            elif (self._state == 'entries') and (char == ']'):
+                self._pos, self._state = pos + 1, 'key'
+            elif (self._state == 'value') and (self._key == 'entry') and (char == '['):
+                self._pos, self._state = pos + 1, 'entries'
+                if self.head_only:
+                    return entries
+            elif self._state == 'end':
+                raise ValueError("Unexpected data after the end of the fhir bundle")
+            else:
+                decoded = self._decode(buffer, pos, final)
+                if decoded is None:
+                    return entries
+                value, end = decoded
+                if self._state == 'key':
+                    end = self._WHITESPACE.match(buffer, end).end()
+                    if end >= len(buffer):
+                        return entries
+                    elif buffer[end] != ':':
+                        raise ValueError(f"Expected ':' after key {value!r} in fhir bundle")
+                    self._key, self._state = value, 'value'
+                    end += 1
+                elif self._state == 'value':
+                    self.bundle[self._key] = value
+                    self._state = 'key'
+                else:
+                    entries.append(value)
+                self._pos = end
+
+    def _decode(self, buffer: str, pos: int, final: bool) -> Optional[tuple[Any, int]]:
+        if (not final) and ((len(buffer) - pos) < self._retry_size):
+            return None
+        try:
+            value, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            self._retry_size = 2 * (len(buffer) - pos)
+            return None
+        if (end == len(buffer)) and not final:
+            # a number or literal at the end of the buffer may continue in the next chunk
+            self._retry_size = len(buffer) - pos + 1
+            return None
+        self._retry_size = 0
+        return value, end
+
+
+def _read_bundle_head(content: bytes, chunk_size: int = 64 * 1024) -> dict[str, Any]:
+    """
+    Decodes the top-level fields of a fhir bundle's json that precede its 'entry' array (such as id, total and link),
+    without decoding the entries. If the bundle has no link among these fields, it is decoded as a whole.
+    :param content: the json bytes of the bundle
+    :param chunk_size: number of bytes decoded at a time, until the entries are reached
+    :return: the decoded fields
+    """
+    parser = _BundleStreamParser(head_only=True)
+    for start in range(0, len(content), chunk_size):
+        parser.feed(content[start:start + chunk_size])
+        if parser.at_entries:
+            break
+    if parser.at_entries and ('link' in parser.bundle):
+        return parser.bundle
+    return json.loads(content)
@@ -2,12 +2,19 @@ import os
 import uuid
 import asyncio
 import datetime
-from typing import Optional, Literal
+import heapq
+import threading
+import time
+from itertools import islice
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Optional, Literal, Hashable, Callable, Union
 from httpx import AsyncClient, HTTPStatusError, ConnectError, TimeoutException
 
 from flamesdk.resources.node_config import NodeConfig
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import LogTypeLiteral
+from flamesdk.resources.utils.event_loop import run_coroutine
+from flamesdk.resources.utils.transport import get_async_transport, get_keycloak_auth, set_keycloak_token
 
 
 class Message:
@@ -29,6 +36,7 @@ class Message:
         :param recipients: the list of recipients
         """
         self.flame_logger = flame_logger
+        self._status_listeners: list[Callable[['Message', str], None]] = []
         if outgoing:
             if "meta" in message.keys():
                 self.flame_logger.raise_error("Cannot use field 'meta' in message body. "
@@ -60,7 +68,10 @@ class Message:
         Marks the message as read.
         :return:
         """
+        previous_status = self.body["meta"]["status"]
         self.body["meta"]["status"] = "read"
+        for listener in self._status_listeners:
+            listener(self, previous_status)
 
     def _update_meta_data(self,
                           outgoing: bool,
@@ -93,35 +104,332 @@ class Message:
                 self.body["meta"]["arrived_at"] = str(datetime.datetime.now())
 
 
+class MessageStore:
+    def __init__(self) -> None:
+        """
+        Thread-safe message container indexed by message id, by (sender, category, status) and by arrival time, so
+        that lookups, deletions and age-based clears do not require scanning all stored messages.
+        """
+        self._lock = threading.RLock()
+        self._next_seq = 0
+        # seq -> message, insertion ordered (i.e. by arrival)
+        self._messages: dict[int, Message] = {}
+        self._arrival_times: dict[int, float] = {}
+        self._seq_by_message: dict[int, list[int]] = {}
+        self._by_id: dict[str, dict[int, None]] = {}
+        self._by_key: dict[tuple[str, str, str], dict[int, None]] = {}
+        self._by_status: dict[str, dict[int, None]] = {}
+        # status -> min-heap of (arrival_time, seq), entries are invalidated lazily
+        self._age_heaps: dict[str, list[tuple[float, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        with self._lock:
+            return iter(list(self._messages.values()))
+
+    def __reversed__(self) -> Iterator[Message]:
+        with self._lock:
+            return iter(list(reversed(self._messages.values())))
+
+    def __contains__(self, message: object) -> bool:
+        return id(message) in self._seq_by_message
+
+    def add(self, message: Message) -> None:
+        """
+        Adds a message to the store.
+        :param message: the message to add
+        :return:
+        """
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            meta = message.body["meta"]
+            self._messages[seq] = message
+            self._arrival_times[seq] = time.monotonic()
+            self._seq_by_message.setdefault(id(message), []).append(seq)
+            self._by_id.setdefault(meta["id"], {})[seq] = None
+            self._index_status(seq, meta)
+            if len(self._seq_by_message[id(message)]) == 1:
+                message._status_listeners.append(self._on_status_change)
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self.add(message)
+
+    def get_by_id(self, message_id: str) -> list[Message]:
+        """
+        Returns all stored messages with the given id.
+        :param message_id: the message id
+        :return: the list of messages
+        """
+        with self._lock:
+            return [self._messages[seq] for seq in self._by_id.get(message_id, ())]
+
+    def find(self,
+             sender: str,
+             category: str,
+             status: Literal["read", "unread"] = "unread",
+             message_id: Optional[str] = None) -> list[Message]:
+        """
+        Returns all stored messages from sender with the given category and status.
+        :param sender: the sender's node id
+        :param category: the message category
+        :param status: the message status
+        :param message_id: optional message id the messages have to match
+        :return: the list of messages
+        """
+        with self._lock:
+            seqs = self._by_key.get((sender, category, status), ())
+            if message_id is not None:
+                seqs = [seq for seq in self._by_id.get(message_id, ()) if seq in seqs]
+            return [self._messages[seq] for seq in seqs]
+
+    def with_status(self, status: Literal["read", "unread", "all"]) -> list[Message]:
+        """
+        Returns all stored messages with the given status.
+        :param status: the message status, or 'all'
+        :return: the list of messages
+        """
+        with self._lock:
+            if status == "all":
+                return list(self._messages.values())
+            return [self._messages[seq] for seq in self._by_status.get(status, ())]
+
+    def remove(self, message: Message) -> None:
+        """
+        Removes the earliest stored occurrence of a message.
+        :param message: the message to remove
+        :raises ValueError: if the message is not stored
+        :return:
+        """
+        with self._lock:
+            seqs = self._seq_by_message.get(id(message))
+            if not seqs:
+                raise ValueError("MessageStore.remove(x): x not in store")
+            self._delete(seqs[0])
+
+    def remove_by_id(self, message_id: str) -> int:
+        """
+        Removes all messages with the given id.
+        :param message_id: the message id
+        :return: the number of removed messages
+        """
+        with self._lock:
+            seqs = list(self._by_id.get(message_id, ()))
+            for seq in seqs:
+                self._delete(seq)
+            return len(seqs)
+
+    def clear(self, status: Literal["read", "unread", "all"] = "all", min_age: Optional[float] = None) -> int:
+        """
+        Removes all messages with the given status. If min_age is set, only messages that have been stored for longer
+        than min_age seconds are removed.
+        :param status: the status of the messages to remove, or 'all'
+        :param min_age: optional minimum age in seconds
+        :return: the number of removed messages
+        """
+        with self._lock:
+            statuses = list(self._by_status.keys()) if status == "all" else [status]
+            number_of_deleted_messages = 0
+            for s in statuses:
+                if min_age is None:
+                    seqs = list(self._by_status.get(s, ()))
+                else:
+                    seqs = []
+                    heap = self._age_heaps.get(s, [])
+                    threshold = time.monotonic() - min_age
+                    while heap and (heap[0][0] < threshold):
+                        _, seq = heapq.heappop(heap)
+                        if seq in self._by_status.get(s, ()):
+                            seqs.append(seq)
+                for seq in seqs:
+                    self._delete(seq)
+                number_of_deleted_messages += len(seqs)
+            return number_of_deleted_messages
+
+    def _index_status(self, seq: int, meta: dict) -> None:
+        status = meta["status"]
+        self._by_key.setdefault((meta["sender"], meta["category"], status), {})[seq] = None
+        self._by_status.setdefault(status, {})[seq] = None
+        heap = self._age_heaps.setdefault(status, [])
+        heapq.heappush(heap, (self._arrival_times[seq], seq))
+        if len(heap) > 2 * len(self._by_status[status]) + 64:
+            # drop entries invalidated by deletions and status changes
+            heap[:] = [(t, s) for t, s in heap if s in self._by_status[status]]
+            heapq.heapify(heap)
+
+    def _unindex_status(self, seq: int, meta: dict, status: str) -> None:
+        for index, key in ((self._by_key, (meta["sender"], meta["category"], status)),
+                           (self._by_status, status)):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(seq, None)
+                if not bucket:
+                    del index[key]
+
+    def _delete(self, seq: int) -> None:
+        message = self._messages.pop(seq)
+        meta = message.body["meta"]
+        del self._arrival_times[seq]
+        seqs = self._seq_by_message[id(message)]
+        seqs.remove(seq)
+        if not seqs:
+            del self._seq_by_message[id(message)]
+            message._status_listeners.remove(self._on_status_change)
+        id_bucket = self._by_id[meta["id"]]
+        del id_bucket[seq]
+        if not id_bucket:
+            del self._by_id[meta["id"]]
+        self._unindex_status(seq, meta, meta["status"])
+
+    def _on_status_change(self, message: Message, previous_status: str) -> None:
+        with self._lock:
+            meta = message.body["meta"]
+            if previous_status == meta["status"]:
+                return
+            for seq in self._seq_by_message.get(id(message), ()):
+                self._unindex_status(seq, meta, previous_status)
+                self._index_status(seq, meta)
+
+
+class MessageListView(Sequence):
+    def __init__(self, store: MessageStore) -> None:
+        """
+        List-like view of a MessageStore, kept for compatibility with code using the former message lists.
+        :param store: the underlying message store
+        """
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._store)
+
+    def __reversed__(self) -> Iterator[Message]:
+        return reversed(self._store)
+
+    def __contains__(self, message: object) -> bool:
+        return message in self._store
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, list[Message]]:
+        if isinstance(index, slice):
+            return list(self._store)[index]
+        length = len(self._store)
+        if not (-length <= index < length):
+            raise IndexError("message index out of range")
+        if index >= 0:
+            return next(islice(iter(self._store), index, None))
+        return next(islice(reversed(self._store), -index - 1, None))
+
+    def __repr__(self) -> str:
+        return repr(list(self._store))
+
+    def append(self, message: Message) -> None:
+        self._store.add(message)
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        self._store.extend(messages)
+
+    def remove(self, message: Message) -> None:
+        self._store.remove(message)
+
+    def copy(self) -> list[Message]:
+        return list(self._store)
+
+    def clear(self) -> None:
+        self._store.clear("all")
+
+
+class MessageNotifier:
+    def __init__(self) -> None:
+        """
+        Thread-safe registry of waiting coroutines. Waiters register a future under a key (e.g. (sender, category) or a
+        message id) in their own event loop, notify wakes all waiters of a key from any thread.
+        """
+        self._lock = threading.Lock()
+        self._waiters: dict[Hashable, list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+    def register(self, key: Hashable) -> asyncio.Future:
+        """
+        Registers a new waiter for the given key in the running event loop.
+        :param key: the notification key
+        :return: future that is resolved on the next notification of the key
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.setdefault(key, []).append((loop, future))
+        return future
+
+    def unregister(self, key: Hashable, future: asyncio.Future) -> None:
+        """
+        Removes a waiter, if it has not been notified yet.
+        :param key: the notification key
+        :param future: the future returned by register
+        :return:
+        """
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters[:] = [(loop, f) for loop, f in waiters if f is not future]
+                if not waiters:
+                    del self._waiters[key]
+
+    def notify(self, key: Hashable) -> None:
+        """
+        Wakes all waiters registered for the given key (safe to call from any thread).
+        :param key: the notification key
+        :return:
+        """
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve_future, future)
+
+
+def _resolve_future(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
 class MessageBrokerClient:
     def __init__(self, config: NodeConfig, flame_logger: FlameLogger) -> None:
         self.nodeConfig = config
         self.flame_logger = flame_logger
         self._message_broker = AsyncClient(
             base_url=f"http://{self.nodeConfig.nginx_name}/message-broker",
-            headers={"Authorization": f"Bearer {config.keycloak_token}", "Accept": "application/json"},
-            follow_redirects=True
+            headers={"Accept": "application/json"},
+            auth=get_keycloak_auth(config.keycloak_token),
+            follow_redirects=True,
+            transport=get_async_transport()
         )
-        asyncio.run(self._connect())
         self.list_of_known_message_ids: set[str] = set()
-        self.list_of_incoming_messages: list[Message] = []
-        self.list_of_outgoing_messages: list[Message] = []
+        self.incoming_messages = MessageStore()
+        self.outgoing_messages = MessageStore()
+        self._notifier = MessageNotifier()
         self.message_number = 0
-        message_node_info = asyncio.run(self.get_self_config(config.analysis_id))
+        message_node_info, self._prefetched_participants = run_coroutine(self._initialize(config.analysis_id))
         self.nodeConfig.set_role(message_node_info["nodeType"])
         self.nodeConfig.set_node_id(message_node_info["nodeId"])
 
+    @property
+    def list_of_incoming_messages(self) -> MessageListView:
+        return MessageListView(self.incoming_messages)
+
+    @property
+    def list_of_outgoing_messages(self) -> MessageListView:
+        return MessageListView(self.outgoing_messages)
+
     def refresh_token(self, keycloak_token: str):
-        self._message_broker = AsyncClient(
-            base_url=f"http://{self.nodeConfig.nginx_name}/message-broker",
-            headers={"Authorization": f"Bearer {keycloak_token}", "Accept": "application/json"},
-            follow_redirects=True
-        )
+        set_keycloak_token(keycloak_token)
 
     async def get_self_config(self, analysis_id: str) -> dict[str, str]:
         try:
-            response = await self._message_broker.get(f'/analyses/{analysis_id}/participants/self',
-                                                      headers=[('Connection', 'close')])
+            response = await self._message_broker.get(f'/analyses/{analysis_id}/participants/self')
             response.raise_for_status()
         except (HTTPStatusError, ConnectError, TimeoutException) as e:
             self.flame_logger.raise_error(f"Failed to retrieve self configuration for analysis {analysis_id}: "
@@ -129,18 +437,25 @@ class MessageBrokerClient:
         return response.json()
 
     async def get_partner_nodes(self, self_node_id: str, analysis_id: str) -> list[dict[str, str]]:
+        if (self._prefetched_participants is not None) and (analysis_id == self.nodeConfig.analysis_id):
+            # participants were already retrieved during startup
+            participants, self._prefetched_participants = self._prefetched_participants, None
+        else:
+            participants = await self._get_participants(analysis_id)
+        response = [node_conf for node_conf in participants if node_conf['nodeId'] != self_node_id]
+        return response
+
+    async def _get_participants(self, analysis_id: str) -> list[dict[str, str]]:
         try:
-            response = await self._message_broker.get(f'/analyses/{analysis_id}/participants',
-                                                      headers=[('Connection', 'close')])
+            response = await self._message_broker.get(f'/analyses/{analysis_id}/participants')
             response.raise_for_status()
         except (HTTPStatusError, ConnectError, TimeoutException) as e:
             self.flame_logger.raise_error(f"Failed to retrieve partner nodes for analysis {analysis_id} : {repr(e)}")
-        response = [node_conf for node_conf in response.json() if node_conf['nodeId'] != self_node_id]
-        return response
+        return response.json()
 
     async def test_connection(self) -> bool:
         try:
-            response = await self._message_broker.get("/healthz", headers=[('Connection', 'close')])
+            response = await self._message_broker.get("/healthz")
             response.raise_for_status()
             return True
         except (HTTPStatusError, ConnectError, TimeoutException) as e:
@@ -156,13 +471,17 @@ class MessageBrokerClient:
             response.raise_for_status()
         except (HTTPStatusError, ConnectError, TimeoutException) as e:
             self.flame_logger.raise_error(f"Failed to subscribe to message broker: {repr(e)}")
-        try:
-            response = await self._message_broker.get(f'/analyses/{os.getenv("ANALYSIS_ID")}/participants/self',
-                                                      headers=[('Connection', 'close')])
-            response.raise_for_status()
-        except (HTTPStatusError, ConnectError, TimeoutException) as e:
-            self.flame_logger.raise_error(f"Successfully subscribed to message broker, "
-                                          f"but failed to retrieve participants: {repr(e)}")
+
+    async def _initialize(self, analysis_id: str) -> tuple[dict[str, str], list[dict[str, str]]]:
+        """
+        Runs the independent startup handshakes (subscription, self configuration, participants) concurrently.
+        :param analysis_id: the analysis id
+        :return: the self configuration and the list of all participants
+        """
+        _, self_config, participants = await asyncio.gather(self._connect(),
+                                                            self.get_self_config(analysis_id),
+                                                            self._get_participants(analysis_id))
+        return self_config, participants
 
     async def send_message(self, message: Message) -> None:
         self.message_number += 1
@@ -176,10 +495,9 @@ class MessageBrokerClient:
             try:
                 response = await self._message_broker.post(f'/analyses/{os.getenv("ANALYSIS_ID")}/messages',
                                                            json=body,
-                                                           headers=[('Connection', 'close'),
-                                                                    ("Content-Type", "application/json")])
+                                                           headers=[("Content-Type", "application/json")])
                 response.raise_for_status()
-                self.list_of_outgoing_messages.append(message)
+                self.outgoing_messages.add(message)
                 break
             except (HTTPStatusError, ConnectError, TimeoutException) as e:
                 if attempt_count < 10:
@@ -204,7 +522,9 @@ class MessageBrokerClient:
                 self.flame_logger.new_log(f"message body: {message.body}",
                                           log_type=LogTypeLiteral.DEBUG.value)
                 self.list_of_known_message_ids.add(message.body["meta"]["id"])
-            self.list_of_incoming_messages.append(message)
+            self.incoming_messages.add(message)
+            self._notifier.notify(("message", message.body["meta"]["sender"], message.body["meta"]["category"]))
+            self._notifier.notify(("acknowledgement", message.body["meta"]["id"]))
 
         if needs_acknowledgment:
             if is_new_message:
@@ -214,7 +534,7 @@ class MessageBrokerClient:
                     f"incoming message with category={body['meta']['category']} from sender={body['meta']['sender']}",
                     log_type=LogTypeLiteral.DEBUG.value
                 )
-            asyncio.run(self.acknowledge_message(message))
+            run_coroutine(self.acknowledge_message(message))
 
     def delete_message_by_id(self, message_id: str, type: Literal["outgoing", "incoming"]) -> int:
         """
@@ -225,12 +545,8 @@ class MessageBrokerClient:
         """
         number_of_deleted_messages = 0
         if type in ["outgoing", "incoming"]:
-            message_list = self.list_of_outgoing_messages.copy() if type == "outgoing" else self.list_of_incoming_messages.copy()
-            for message in message_list:
-                if message.body["meta"]["id"] == message_id:
-                    self.list_of_outgoing_messages.remove(message) \
-                        if type == "outgoing" else self.list_of_incoming_messages.remove(message)
-                    number_of_deleted_messages += 1
+            message_store = self.outgoing_messages if type == "outgoing" else self.incoming_messages
+            number_of_deleted_messages = message_store.remove_by_id(message_id)
         if number_of_deleted_messages == 0:
             self.flame_logger.new_log(f"Could not find message with id={message_id} in {type} messages.",
                                       log_type=LogTypeLiteral.WARNING.value)
@@ -241,53 +557,48 @@ class MessageBrokerClient:
                             node_id: str,
                             message_category: str,
                             message_id: Optional[str] = None) -> tuple[str, list[Message]]:
-        possible_responses = []
-        for msg in self.list_of_incoming_messages:
-            if ((node_id == msg.body["meta"]["sender"]) and
-                    (message_category == msg.body["meta"]["category"]) and
-                    ("unread" == msg.body["meta"]["status"])):
-                if message_id is not None:
-                    if message_id == msg.body["meta"]["id"]:
-                        possible_responses.append(msg)
-                else:
-                    possible_responses.append(msg)
-
-        if len(possible_responses) == 0:
-            number_of_incoming_messages = len(self.list_of_incoming_messages)
-            while True:
-                await asyncio.sleep(1)
-                if len(self.list_of_incoming_messages) > number_of_incoming_messages:
-                    for msg in self.list_of_incoming_messages:
-                        if ((node_id == msg.body["meta"]["sender"]) and
-                                (message_category == msg.body["meta"]["category"]) and
-                                ("unread" == msg.body["meta"]["status"])):
-                            if message_id is not None:
-                                if message_id == msg.body["meta"]["id"]:
-                                    possible_responses.append(msg)
-                            else:
-                                possible_responses.append(msg)
-                            return node_id, possible_responses
-        else:
-            return node_id, possible_responses
+        """
+        Waits until at least one unread message of the given category from the given node has arrived. Instead of
+        polling, the waiter is woken by receive_message as soon as a matching message arrives.
+        :param node_id: the sender's node id
+        :param message_category: the message category
+        :param message_id: optional message id to wait for
+        :return: the node id and the list of matching messages
+        """
+        key = ("message", node_id, message_category)
+        while True:
+            # register before searching, so that a message arriving in between is not missed
+            future = self._notifier.register(key)
+            try:
+                possible_responses = self.incoming_messages.find(node_id, message_category, "unread", message_id)
+                if possible_responses:
+                    return node_id, possible_responses
+                await future
+            finally:
+                self._notifier.unregister(key, future)
 
     async def acknowledge_message(self, message: Message) -> None:
         await self.send_message(message)
 
     async def await_message_acknowledgement(self, message: Message, receiver: str) -> str:
-        number_of_incoming_messages = len(self.list_of_incoming_messages)
-        for incoming_message in self.list_of_incoming_messages:
-            if (incoming_message.body["meta"]["id"] == message.body["meta"]["id"]) and \
-                    (incoming_message.body["meta"]["akn_id"] == receiver):
-                self.list_of_incoming_messages.remove(incoming_message)
-                return receiver
+        """
+        Waits until the given receiver has acknowledged the message. The waiter is woken by receive_message as soon as
+        a message with the same id arrives.
+        :param message: the sent message
+        :param receiver: the node id of the receiver
+        :return: the receiver's node id
+        """
+        key = ("acknowledgement", message.body["meta"]["id"])
         while True:
-            if len(self.list_of_incoming_messages) > number_of_incoming_messages:
-                for incoming_message in self.list_of_incoming_messages:
-                    if (incoming_message.body["meta"]["id"] == message.body["meta"]["id"]) and \
-                            (incoming_message.body["meta"]["akn_id"] == receiver):
-                        self.list_of_incoming_messages.remove(incoming_message)
+            future = self._notifier.register(key)
+            try:
+                for incoming_message in self.incoming_messages.get_by_id(message.body["meta"]["id"]):
+                    if incoming_message.body["meta"]["akn_id"] == receiver:
+                        self.incoming_messages.remove(incoming_message)
                         return receiver
-            await asyncio.sleep(1)
+                await future
+            finally:
+                self._notifier.unregister(key, future)
 
     def clear_messages(self,
                        type: Literal["outgoing", "incoming"],
@@ -297,23 +608,8 @@ class MessageBrokerClient:
         Clear the incoming messages list.
         :param type:
         :param status: the status of the messages to clear
-        :param min_age:
+        :param min_age: if set, only messages that arrived more than min_age seconds ago are cleared
         :return:
         """
-        number_of_deleted_messages = 0
-        message_list = self.list_of_outgoing_messages.copy() if type == 'outgoing' else self.list_of_incoming_messages.copy()
-        for message in message_list:
-            if message.body["meta"]["status"] == status:
-                if min_age is not None:
-                    created_at = datetime.datetime.strptime(message.body["meta"]["created_at"],
-                                                            "%Y-%m-%d %H:%M:%S.%f")
-                    if (datetime.datetime.now() - created_at).seconds > min_age:
-                        self.list_of_outgoing_messages.remove(message) \
-                            if type == 'outgoing' else self.list_of_incoming_messages.remove(message)
-                        number_of_deleted_messages += 1
-                else:
-                    self.list_of_outgoing_messages.remove(message) \
-                        if type == 'outgoing' else self.list_of_incoming_messages.remove(message)
-                    number_of_deleted_messages += 1
-
-        return number_of_deleted_messages
+        message_store = self.outgoing_messages if type == 'outgoing' else self.incoming_messages
+        return message_store.clear(status, min_age)
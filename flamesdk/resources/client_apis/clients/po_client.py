@@ -1,22 +1,23 @@
+from typing import Any
 from httpx import Client, HTTPStatusError, ConnectError, TimeoutException
 
 from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.utils.transport import get_sync_transport, get_keycloak_auth, set_keycloak_token
 
 
 class POClient:
     def __init__(self, nginx_name: str, keycloak_token: str, flame_logger: FlameLogger) -> None:
         self.nginx_name = nginx_name
         self.client = Client(base_url=f"http://{nginx_name}/po",
-                             headers={"Authorization": f"Bearer {keycloak_token}",
-                                      "accept": "application/json"},
-                             follow_redirects=True)
+                             headers={"accept": "application/json"},
+                             auth=get_keycloak_auth(keycloak_token),
+                             follow_redirects=True,
+                             transport=get_sync_transport())
         self.flame_logger = flame_logger
+        self._batch_endpoint_available = True
 
     def refresh_token(self, keycloak_token: str) -> None:
-        self.client = Client(base_url=f"http://{self.nginx_name}/po",
-                             headers={"Authorization": f"Bearer {keycloak_token}",
-                                      "accept": "application/json"},
-                             follow_redirects=True)
+        set_keycloak_token(keycloak_token)
 
     def stream_logs(self, log: str, log_type: str, analysis_id: str, status: str, progress: int) -> None:
         log_dict = {
@@ -35,3 +36,36 @@ class POClient:
             print("HTTP Error in po api:", repr(e))
         except Exception as e:
             print("Unforeseen Error in po api:", repr(e))
+
+    def stream_logs_batch(self, logs: list[dict[str, Any]], analysis_id: str) -> None:
+        """
+        Streams multiple logs with a single request. Falls back to individual requests, if the PO service does not
+        provide the batch endpoint. Raises on failure (http errors other than a missing batch endpoint, connection
+        errors and timeouts), so that the logs can be submitted again.
+        :param logs: list of log dicts with keys 'log', 'log_type', 'status' and 'progress'
+        :param analysis_id: the analysis id
+        :return:
+        """
+        if not logs:
+            return
+        log_dicts = [{"log": log["log"],
+                      "log_type": log["log_type"],
+                      "analysis_id": analysis_id,
+                      "status": log["status"],
+                      "progress": log["progress"]} for log in logs]
+        if self._batch_endpoint_available:
+            try:
+                response = self.client.post("/stream_logs/batch",
+                                            json=log_dicts,
+                                            headers={"Content-Type": "application/json"})
+                response.raise_for_status()
+                return
+            except HTTPStatusError as e:
+                if e.response.status_code not in (404, 405):
+                    raise
+                self._batch_endpoint_available = False
+        for log_dict in log_dicts:
+            response = self.client.post("/stream_logs",
+                                        json=log_dict,
+                                        headers={"Content-Type": "application/json"})
+            response.raise_for_status()
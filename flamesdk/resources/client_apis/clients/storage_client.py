@@ -1,15 +1,25 @@
+import io
+import itertools
 import math
+import os
+import pathlib
+import tempfile
+import types
 import uuid
-from httpx import Client, HTTPStatusError, ConnectError, TimeoutException, Timeout
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from httpx import Client, HTTPStatusError, ConnectError, Response, TimeoutException, Timeout
 import pickle
 import re
 from datetime import datetime
 from io import BytesIO
-from typing import Any, Literal, Optional
+from typing import IO, Any, Literal, Optional, Union
 from typing_extensions import TypedDict
 
 from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.utils.serialization import deserialize, select_codec, serialize, stream_frame_header
 from flamesdk.resources.utils.constants import LogTypeLiteral
+from flamesdk.resources.utils.transport import get_sync_transport, get_keycloak_auth, set_keycloak_token
 
 
 EXT_TO_OUTPUT_TYPE: dict[str, list[str]] = {
@@ -19,23 +29,149 @@ EXT_TO_OUTPUT_TYPE: dict[str, list[str]] = {
 }
 
 
+# size of the chunks read from files (and file objects) of streamed results
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+StreamSource = Union[os.PathLike, IO[bytes], Generator[bytes, Any, Any]]
+
+
+def is_stream_source(result: Any) -> bool:
+    """
+    Returns whether a result is to be streamed (file paths, binary file objects and generators of bytes chunks) rather
+    than serialized. Strings are regular results, never paths, and so are text file objects and other iterators.
+    :param result: the result to push
+    :return:
+    """
+    if isinstance(result, (str, bytes, bytearray, memoryview)):
+        return False
+    elif isinstance(result, (os.PathLike, io.BufferedIOBase, io.RawIOBase, types.GeneratorType)):
+        return True
+    elif hasattr(result, 'read') and not isinstance(result, io.TextIOBase):
+        # other file-like objects are binary if reading nothing returns bytes
+        try:
+            return isinstance(result.read(0), bytes)
+        except Exception:
+            return False
+    return False
+
+
+def _iter_chunks(file: IO[bytes]) -> Iterator[bytes]:
+    chunk = file.read(STREAM_CHUNK_SIZE)
+    while chunk:
+        yield chunk
+        chunk = file.read(STREAM_CHUNK_SIZE)
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Binary file object reading from a sequence of leading chunks followed by an iterator of chunks (read by httpx in
+    chunks of its own while uploading, so that a streamed result is never held in memory as a whole).
+    """
+
+    def __init__(self,
+                 head: list[bytes],
+                 chunks: Iterable[bytes],
+                 on_close: Optional[Callable[[], None]] = None) -> None:
+        super().__init__()
+        self._chunks = itertools.chain(head, chunks)
+        self._pending = memoryview(b'')
+        self._on_close = on_close
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk).cast('B')
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self) -> None:
+        if (self._on_close is not None) and not self.closed:
+            self._on_close()
+        super().close()
+
+
+class _FramedFile(io.RawIOBase):
+    """
+    Seekable binary file object reading a frame header followed by the contents of a file, so that httpx determines
+    the length of a framed file upload (sent with Content-Length instead of chunked transfer encoding).
+    """
+
+    def __init__(self, header: bytes, path: os.PathLike) -> None:
+        super().__init__()
+        self._header = header
+        self._file = open(path, 'rb')
+        self._length = len(header) + os.fstat(self._file.fileno()).st_size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, offset)
+        if self._position > len(self._header):
+            self._file.seek(self._position - len(self._header))
+        else:
+            self._file.seek(0)
+        return self._position
+
+    def readinto(self, buffer: Any) -> int:
+        if self._position < len(self._header):
+            size = min(len(buffer), len(self._header) - self._position)
+            buffer[:size] = self._header[self._position:self._position + size]
+        else:
+            size = self._file.readinto(buffer)
+        self._position += size
+        return size
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
 class LocalDifferentialPrivacyParams(TypedDict, total=True):
     epsilon: float
     sensitivity: float
 
 
 class StorageClient:
-    def __init__(self, nginx_name, keycloak_token, flame_logger: FlameLogger) -> None:
+    def __init__(self,
+                 nginx_name,
+                 keycloak_token,
+                 flame_logger: FlameLogger,
+                 max_concurrency: int = 8,
+                 compression: Optional[str] = 'auto') -> None:
         self.nginx_name = nginx_name
+        # upper bound of uploads in flight at once when pushing a result to several remote nodes
+        self.max_concurrency = max_concurrency
+        # compression of intermediate data ('auto', 'zstd', 'lz4', 'zlib' or None, see serialization.serialize)
+        self.compression = compression
+        # set to False once the storage service rejected a broadcast upload as unknown (404 or 405)
+        self._broadcast_supported = True
         self.client = Client(base_url=f"http://{nginx_name}/storage",
-                             headers={"Authorization": f"Bearer {keycloak_token}"},
-                             follow_redirects=True)
+                             auth=get_keycloak_auth(keycloak_token),
+                             follow_redirects=True,
+                             transport=get_sync_transport())
         self.flame_logger = flame_logger
 
     def refresh_token(self, keycloak_token: str):
-        self.client = Client(base_url=f"http://{self.nginx_name}/storage",
-                             headers={"Authorization": f"Bearer {keycloak_token}"},
-                             follow_redirects=True)
+        set_keycloak_token(keycloak_token)
 
     def push_result(self,
                     result: Any,
@@ -44,17 +180,21 @@ class StorageClient:
                     type: Literal["final", "global", "local"] = "final",
                     output_type: Literal['str', 'bytes', 'pickle'] = 'pickle',
                     filename: Optional[str] = None,
-                    local_dp: Optional[LocalDifferentialPrivacyParams] = None) -> dict[str, str]:
+                    local_dp: Optional[LocalDifferentialPrivacyParams] = None,
+                    codec: Optional[str] = None) -> dict[str, str]:
         """
         Pushes the result to the hub. Making it available for analysts to download.
 
-        :param result: the Object to push
+        :param result: the Object to push, or the bytes to stream from a file path (os.PathLike), binary file object or
+        generator of bytes chunks (a str is pushed as a regular result)
         :param tag: optional storage tag
         :param remote_node_id: optional remote node id (used for accessing remote node's public key for encryption)
         :param type: location to save the result, final saves in the hub to be downloaded, global saves in central instance of MinIO, local saves in the node
         :param output_type: the type of the result, str, bytes or pickle only for final results
         :param filename: optional filename given to result
         :param local_dp: parameters for local differential privacy, only for final floating-point type results
+        :param codec: serializer of intermediate (global or local) results (see flamesdk.resources.utils.serialization),
+        chosen by the type of the result if None
         :return:
         """
         if tag and (type != "local"):
@@ -68,6 +208,162 @@ class StorageClient:
             self.flame_logger.raise_error(f"Invalid tag format: {tag}. "
                                           f"Tag must consist only of lowercase letters, numbers, and hyphens")
 
+        if is_stream_source(result):
+            if isinstance(local_dp, dict):
+                self.flame_logger.raise_error("Local differential privacy can not be applied on streamed results")
+            # streamed bytes are uploaded as they are (framed as 'raw' payload if intermediate data)
+            codec = None if type == "final" else 'raw'
+            if (filename is None) and isinstance(result, os.PathLike):
+                filename = os.path.basename(result)
+            file_body = self._open_stream(result, framed=codec is not None)
+        else:
+            codec = self._resolve_codec(result, type, codec)
+            file_body = self._serialize_result(result, type, output_type, local_dp, codec)
+
+        if remote_node_id is not None:
+            data = {"remote_node_id": remote_node_id}
+        elif tag:
+            data = {"tag": tag}
+        else:
+            data = {}
+        if codec is not None:
+            data["codec"] = codec
+
+        request_path = f"/{type}"
+
+        # check if local dp parameters have been supplied
+        if isinstance(local_dp, dict):
+            # append to request path
+            request_path += "/localdp"
+            # local_dp is guaranteed to not be None, so remap values to string and update request data mapping
+            data.update({k: str(v) for k, v in local_dp.items()})
+
+        effective_output_type = "str" if isinstance(local_dp, dict) else output_type
+        try:
+            response = self._upload(file_body, request_path, data, filename, effective_output_type)
+        except (HTTPStatusError, ConnectError, TimeoutException) as e:
+            self.flame_logger.raise_error(f"Failed to push results: {repr(e)}")
+        return self._push_response(response, type)
+
+    def push_result_to_nodes(self,
+                             result: Any,
+                             remote_node_ids: list[str],
+                             type: Literal["global", "local"] = "global",
+                             broadcast: bool = False,
+                             codec: Optional[str] = None) -> dict[str, dict[str, str]]:
+        """
+        Pushes the result once for each of the given remote nodes (each copy encrypted for its receiver). The result is
+        serialized only once, and the uploads run concurrently (at most max_concurrency at a time).
+
+        In broadcast mode (global type only) the result is uploaded a single time instead: the storage service encrypts
+        it once under a content key and only wraps that key for each receiver. If the storage service does not support
+        broadcasts, the result is pushed for each remote node as above.
+
+        :param result: the Object to push, or the bytes to stream from a file path (os.PathLike), binary file object or
+        generator of bytes chunks (file objects and generators are spooled to a temporary file for several uploads)
+        :param remote_node_ids: remote node ids (used for accessing remote node's public key for encryption)
+        :param type: location to save the result, global saves in central instance of MinIO, local saves in the node
+        :param broadcast: whether to upload a single copy for all remote nodes
+        :param codec: serializer of the result (see flamesdk.resources.utils.serialization), chosen by the type of the
+        result if None
+        :return: the push response of each remote node id
+        """
+        type = "intermediate" if type == "global" else type
+        spooled_path = None
+        if not is_stream_source(result):
+            codec = self._resolve_codec(result, type, codec)
+            file_body = self._serialize_result(result, type, 'pickle', None, codec)
+
+            def open_body() -> Union[bytes, IO[bytes]]:
+                return file_body
+        else:
+            codec = 'raw'
+            if (not isinstance(result, os.PathLike)) and (broadcast or (len(remote_node_ids) > 1)):
+                # file objects and generators can only be read once, so they are spooled to disk for several uploads
+                result = spooled_path = self._spool_stream(result)
+            # a path is opened again for each upload, any other source is uploaded once
+            stream = None if isinstance(result, os.PathLike) else self._open_stream(result, framed=True)
+
+            def open_body() -> Union[bytes, IO[bytes]]:
+                return self._open_stream(result, framed=True) if stream is None else stream
+        try:
+            return self._push_to_nodes(open_body, remote_node_ids, type, broadcast, codec)
+        finally:
+            if spooled_path is not None:
+                os.remove(spooled_path)
+
+    def _push_to_nodes(self,
+                       open_body: Callable[[], Union[bytes, IO[bytes]]],
+                       remote_node_ids: list[str],
+                       type: str,
+                       broadcast: bool,
+                       codec: str) -> dict[str, dict[str, str]]:
+        if broadcast and (type == "intermediate") and self._broadcast_supported:
+            try:
+                response = self._upload(open_body(),
+                                        "/intermediate/broadcast",
+                                        {"remote_node_ids": remote_node_ids, "codec": codec},
+                                        None,
+                                        'pickle')
+                return self._broadcast_response(response, remote_node_ids)
+            except HTTPStatusError as e:
+                if e.response.status_code not in (404, 405):
+                    self.flame_logger.raise_error(f"Failed to broadcast results: {repr(e)}")
+                self._broadcast_supported = False
+                self.flame_logger.new_log("Storage service does not support broadcasts, pushing results for each "
+                                          "remote node instead", log_type=LogTypeLiteral.WARNING.value)
+            except (ConnectError, TimeoutException) as e:
+                self.flame_logger.raise_error(f"Failed to broadcast results: {repr(e)}")
+
+        def upload(remote_node_id: str) -> Union[Response, Exception]:
+            try:
+                return self._upload(open_body(),
+                                    f"/{type}",
+                                    {"remote_node_id": remote_node_id, "codec": codec},
+                                    None,
+                                    'pickle')
+            except (HTTPStatusError, ConnectError, TimeoutException) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(remote_node_ids))),
+                                thread_name_prefix="flamesdk-upload") as executor:
+            responses = list(executor.map(upload, remote_node_ids))
+
+        returns = {}
+        for remote_node_id, response in zip(remote_node_ids, responses):
+            if isinstance(response, Exception):
+                self.flame_logger.raise_error(f"Failed to push results for remote node {remote_node_id}: "
+                                              f"{repr(response)}")
+            returns[remote_node_id] = self._push_response(response, type)
+        return returns
+
+    def _broadcast_response(self, response: Response, remote_node_ids: list[str]) -> dict[str, dict[str, str]]:
+        # the storage service answers with the url of each receiver's copy: {"results": {node_id: {"url": ...}}}
+        self.flame_logger.new_log(f"broadcasting intermediate result to {len(remote_node_ids)} nodes",
+                                  log_type=LogTypeLiteral.INFO.value)
+        self.flame_logger.new_log(f"broadcast response body: {response.json()}",
+                                  log_type=LogTypeLiteral.DEBUG.value)
+        results = response.json()["results"]
+        return {remote_node_id: {"status": "success",
+                                 "url": results[remote_node_id]["url"],
+                                 "id": results[remote_node_id]["url"].split("/")[-1]}
+                for remote_node_id in remote_node_ids}
+
+    def _serialize_result(self,
+                          result: Any,
+                          type: str,
+                          output_type: Literal['str', 'bytes', 'pickle'],
+                          local_dp: Optional[LocalDifferentialPrivacyParams],
+                          codec: Optional[str] = None) -> Optional[bytes]:
+        """
+        Serializes the result into the request body of its upload
+        :param result: the Object to push
+        :param type: location to save the result (final, intermediate or local)
+        :param output_type: the type of the result, str, bytes or pickle only for final results
+        :param local_dp: parameters for local differential privacy, only for final floating-point type results
+        :param codec: serializer of intermediate results (framed payload), None for plain pickles
+        :return: the serialized result
+        """
         # check if local dp parameters have been supplied
         use_local_dp = isinstance(local_dp, dict)
 
@@ -99,9 +395,11 @@ class StorageClient:
                 file_body = str(result).encode('utf-8')
             elif (type == 'final') and (output_type == 'bytes'):
                 file_body = bytes(result)
+            elif codec is not None:
+                file_body = serialize(result, codec, compression=self.compression, flame_logger=self.flame_logger)
             else:
                 file_body = pickle.dumps(result)
-        except (TypeError, ValueError, UnicodeEncodeError, pickle.PicklingError) as e:
+        except (TypeError, ValueError, UnicodeEncodeError, ImportError, pickle.PicklingError) as e:
             if output_type != 'pickle':
                 self.flame_logger.new_log(f"Failed to translate result data to type={output_type}: {repr(e)}",
                                           log_type=LogTypeLiteral.WARNING.value)
@@ -114,38 +412,67 @@ class StorageClient:
             else:
                 self.flame_logger.raise_error(f"Failed to pickle result data: {repr(e)}")
                 file_body = None
+        return file_body
 
-        if remote_node_id is not None:
-            data = {"remote_node_id": remote_node_id}
-        elif tag:
-            data = {"tag": tag}
-        else:
-            data = {}
-
-        request_path = f"/{type}"
-
-        if use_local_dp:
-            # append to request path
-            request_path += "/localdp"
-            # local_dp is guaranteed to not be None, so remap values to string and update request data mapping
-            data.update({k: str(v) for k, v in local_dp.items()})
+    def _resolve_codec(self, result: Any, type: str, codec: Optional[str]) -> Optional[str]:
+        # final results stay plain pickles (to be downloaded by analysts), intermediate data is framed by a codec
+        if type == "final":
+            if codec is not None:
+                self.flame_logger.new_log("Codecs only apply to intermediate data (will be ignored)",
+                                          log_type=LogTypeLiteral.WARNING.value)
+            return None
+        return codec if codec is not None else select_codec(result)
 
+    def _open_stream(self, source: StreamSource, framed: bool) -> IO[bytes]:
+        """
+        Opens a streamed result for its upload, without reading it into memory
+        :param source: file path, binary file object or generator of bytes chunks
+        :param framed: whether to prefix the stream with the frame header of a 'raw' payload (intermediate data)
+        :return: a binary file object to upload (to be closed after the upload)
+        """
+        if isinstance(source, os.PathLike):
+            return _FramedFile(stream_frame_header('raw'), source) if framed else open(source, 'rb')
+        chunks = _iter_chunks(source) if hasattr(source, 'read') else source
+        return _ChunkReader([stream_frame_header('raw')] if framed else [], chunks)
+
+    def _spool_stream(self, source: StreamSource) -> pathlib.Path:
+        with tempfile.NamedTemporaryFile(prefix='flamesdk-upload-', delete=False) as file:
+            for chunk in (_iter_chunks(source) if hasattr(source, 'read') else source):
+                file.write(chunk)
+        return pathlib.Path(file.name)
+
+    def _upload(self,
+                file_body: Union[bytes, IO[bytes]],
+                request_path: str,
+                data: dict[str, str],
+                filename: Optional[str],
+                output_type: str) -> Response:
+        """
+        Uploads a serialized result to the storage service (raises on failure)
+        :param file_body: the serialized result, or a binary file object streaming it (closed after the upload)
+        :param request_path: the storage path to upload to
+        :param data: the form fields of the upload
+        :param filename: optional filename given to result (auto-generated if None)
+        :param output_type: the type of the result, determining the extension of an auto-generated filename
+        :return: the response of the storage service
+        """
+        if filename:
+            resolved_name = filename
+        else:
+            resolved_name = (f"result_{str(uuid.uuid4())[-4:]}_{datetime.now().strftime('%y%m%d%H%M%S')}"
+                             f"{EXT_TO_OUTPUT_TYPE[output_type][0]}")
+        file = BytesIO(file_body) if isinstance(file_body, bytes) else file_body
         try:
-            effective_output_type = "str" if use_local_dp else output_type
-            if filename:
-                resolved_name = filename
-            else:
-                resolved_name = (f"result_{str(uuid.uuid4())[-4:]}_{datetime.now().strftime('%y%m%d%H%M%S')}"
-                                 f"{EXT_TO_OUTPUT_TYPE[effective_output_type][0]}")
             response = self.client.put(request_path,
-                                       files={"file": (resolved_name,
-                                                       BytesIO(file_body))},
+                                       files={"file": (resolved_name, file)},
                                        data=data,
-                                       headers=[('Connection', 'close')],
                                        timeout=Timeout(5, read=None, write=None))
-            response.raise_for_status()
-        except (HTTPStatusError, ConnectError, TimeoutException) as e:
-            self.flame_logger.raise_error(f"Failed to push results: {repr(e)}")
+        finally:
+            file.close()
+        response.raise_for_status()
+        return response
+
+    def _push_response(self, response: Response, type: str) -> dict[str, str]:
         if type != "final":
             self.flame_logger.new_log(f"sending intermediate result",
                                       log_type=LogTypeLiteral.INFO.value)
@@ -226,7 +553,10 @@ class StorageClient:
             response.raise_for_status()
         except (HTTPStatusError, ConnectError, TimeoutException) as e:
             self.flame_logger.raise_error(f"Failed to retrieve file from URL: {repr(e)}")
-        return pickle.loads(BytesIO(response.content).read())
+        try:
+            return deserialize(response.content, flame_logger=self.flame_logger)
+        except (ValueError, ImportError, pickle.UnpicklingError) as e:
+            self.flame_logger.raise_error(f"Failed to deserialize file from URL: {repr(e)}")
 
     def get_local_tags(self, filter: Optional[str] = None) -> list[str]:
         """
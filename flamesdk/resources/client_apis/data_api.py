@@ -1,7 +1,8 @@
+from collections.abc import Iterator
 from httpx import AsyncClient
 from typing import Optional, Union, Any
 
-from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient
+from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient, FhirPageStream, S3Object
 from flamesdk.resources.node_config import NodeConfig
 from flamesdk.resources.utils.logging import FlameLogger
 
@@ -39,12 +40,72 @@ class DataAPI:
             return None
         return self.data_client.get_data(fhir_queries=fhir_queries)
 
-    def get_s3_data(self, s3_keys: Optional[list[str]] = []) -> Optional[list[dict[str, bytes]]]:
+    def get_s3_data(self,
+                    s3_keys: Optional[list[str]] = [],
+                    spill_dir: Optional[str] = None) -> Optional[list[dict[str, Union[bytes, str]]]]:
         """
         Returns s3 data for each key
         :param s3_keys: name of s3 datasets
+        :param spill_dir: if given, the objects are streamed into files below this directory and their paths returned
         :return:
         """
         if s3_keys is None:
             return None
-        return self.data_client.get_data(s3_keys=s3_keys)
+        return self.data_client.get_data(s3_keys=s3_keys, spill_dir=spill_dir)
+
+    def iter_s3_objects(self,
+                        source_name: str,
+                        prefix: Optional[str] = None,
+                        delimiter: Optional[str] = None) -> Iterator[Union[S3Object, str]]:
+        """
+        Iterates over the objects of an s3 data source (with key, size, etag and last_modified), across all pages of
+        the listing.
+        :param source_name: name of the data source
+        :param prefix: only list keys starting with this prefix
+        :param delimiter: if given, keys are rolled up into common prefixes (yielded as str after the objects)
+        :return: iterator over the objects
+        """
+        return self.data_client.iter_s3_objects(source_name, prefix, delimiter)
+
+    def get_fhir_data_source(self, fhir_data: dict[str, Any]) -> Optional[str]:
+        """
+        Returns the name of the data source that produced the given fhir bundle.
+        :param fhir_data: a fhir bundle returned by get_fhir_data or iter_fhir_pages
+        :return: the source name, or None if unknown
+        """
+        return self.data_client.get_bundle_source(fhir_data)
+
+    def iter_fhir_pages(self, source_name: str, fhir_query: str, prefetch: int = 2) -> Iterator[dict[str, Any]]:
+        """
+        Iterates over all pages of a fhir query on a single data source, retrieving the next pages in the background.
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param prefetch: number of pages retrieved ahead of the one being processed
+        :return: iterator over the fhir bundles
+        """
+        return self.data_client.iter_fhir_pages(source_name, fhir_query, prefetch)
+
+    def iter_fhir_page_bytes(self, source_name: str, fhir_query: str, prefetch: int = 2) -> Iterator[bytes]:
+        """
+        Iterates over all pages of a fhir query on a single data source like iter_fhir_pages, but yields the json bytes
+        of each bundle instead of decoding it.
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param prefetch: number of pages retrieved ahead of the one being processed
+        :return: iterator over the json bytes of the fhir bundles
+        """
+        return self.data_client.iter_fhir_page_bytes(source_name, fhir_query, prefetch)
+
+    def iter_fhir_page_streams(self,
+                               source_name: str,
+                               fhir_query: str,
+                               read_ahead: int = 16) -> Iterator[FhirPageStream]:
+        """
+        Iterates over all pages of a fhir query on a single data source, parsing the entries of each page
+        incrementally from the response instead of decoding whole bundles.
+        :param source_name: name of the data source
+        :param fhir_query: fhir query of the first page
+        :param read_ahead: number of parsed response chunks retrieved ahead of the caller
+        :return: iterator over the page streams (iterables of entries)
+        """
+        return self.data_client.iter_fhir_page_streams(source_name, fhir_query, read_ahead)
@@ -5,13 +5,14 @@ from typing import Literal, Optional
 from flamesdk.resources.node_config import NodeConfig
 from flamesdk.resources.client_apis.clients.message_broker_client import MessageBrokerClient, Message
 from flamesdk.resources.utils.logging import FlameLogger, LogTypeLiteral
+from flamesdk.resources.utils.event_loop import run_coroutine
 
 
 class MessageBrokerAPI:
     def __init__(self, config: NodeConfig, flame_logger: FlameLogger) -> None:
         self.message_broker_client = MessageBrokerClient(config, flame_logger)
         self.config = self.message_broker_client.nodeConfig
-        self.participants = asyncio.run(self.message_broker_client.get_partner_nodes(self.config.node_id,
+        self.participants = run_coroutine(self.message_broker_client.get_partner_nodes(self.config.node_id,
                                                                                      self.config.analysis_id))
 
     async def send_message(self,
@@ -79,6 +80,9 @@ class MessageBrokerAPI:
 
             # Run the tasks and wait for the message acknowledgement until the timeout or all messages are acknowledged
             done, pending = await asyncio.wait(await_list, timeout=attempt_timeout, return_when=asyncio.ALL_COMPLETED)
+            # Stop waiting for missing acknowledgements (the event loop outlives this call)
+            for task in pending:
+                task.cancel()
 
             # Check if the message was acknowledged
             for task in done:
@@ -119,6 +123,8 @@ class MessageBrokerAPI:
                 )
             )
         done, pending = await asyncio.wait(await_list, timeout=timeout, return_when=asyncio.ALL_COMPLETED)
+        for task in pending:
+            task.cancel()
         responses = dict()
         for node_id in node_ids:
             for task in done:
@@ -138,8 +144,7 @@ class MessageBrokerAPI:
         Get all messages that have been sent to the node and have the specified un-/read status
         :return:
         """
-        return [msg for msg in self.message_broker_client.list_of_incoming_messages
-                if msg.body["meta"]["status"] == status]
+        return self.message_broker_client.incoming_messages.with_status(status)
 
     def delete_messages_by_id(self, message_ids: list[str]) -> int:
         """
@@ -188,7 +193,7 @@ class MessageBrokerAPI:
         """
         time_start = datetime.now()
         # Send the message
-        asyncio.run(self.send_message(receivers=receivers,
+        run_coroutine(self.send_message(receivers=receivers,
                                       message_category=message_category,
                                       message=message,
                                       max_attempts=max_attempts,
@@ -199,6 +204,6 @@ class MessageBrokerAPI:
             timeout = 1
 
         # Wait for the responses
-        responses = asyncio.run(self.await_messages(receivers, message_category, timeout=timeout))
+        responses = run_coroutine(self.await_messages(receivers, message_category, timeout=timeout))
         return responses
 
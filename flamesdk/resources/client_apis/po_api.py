@@ -1,3 +1,5 @@
+from typing import Any
+
 from flamesdk.resources.client_apis.clients.po_client import POClient
 from flamesdk.resources.node_config import NodeConfig
 from flamesdk.resources.utils.logging import FlameLogger
@@ -20,3 +22,13 @@ class POAPI:
         """
         if LogTypeLiteral(log_type).level >= self.stream_log_level:
             self.po_client.stream_logs(log, log_type, self.analysis_id, status, progress)
+
+    def stream_logs_batch(self, logs: list[dict[str, Any]]) -> None:
+        """
+        Streams multiple logs to the PO service with a single request (raises if the submission failed).
+        :param logs: list of log dicts with keys 'msg', 'log_type', 'status' and 'progress'
+        """
+        logs = [{"log": log["msg"], "log_type": log["log_type"], "status": log["status"], "progress": log["progress"]}
+                for log in logs if LogTypeLiteral(log["log_type"]).level >= self.stream_log_level]
+        if logs:
+            self.po_client.stream_logs_batch(logs, self.analysis_id)
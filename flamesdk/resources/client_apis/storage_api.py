@@ -23,7 +23,8 @@ class StorageAPI:
         """
         sends the final result to the hub. Making it available for analysts to download.
         This method is only available for nodes for which the method `get_role(self)` returns "aggregator".
-        :param result: the final result (single object or list of objects)
+        :param result: the final result (single object or list of objects), file paths, binary file objects and
+        generators of bytes chunks are streamed
         :param output_type: output type of final results (default: "str")
         :param multiple_results: whether the result is to be split into separate results (per element in tuple) or a single result
         :param filename: optional filename for the result file on the hub. For multiple_results, pass a list of names
@@ -87,24 +88,27 @@ class StorageAPI:
                                data: Any,
                                location: Literal["global", "local"],
                                remote_node_ids: Optional[list[str]] = None,
-                               tag: Optional[str] = None) -> Union[dict[str, dict[str, str]], dict[str, str]]:
+                               tag: Optional[str] = None,
+                               broadcast: bool = False,
+                               codec: Optional[str] = None) -> Union[dict[str, dict[str, str]], dict[str, str]]:
         """
         saves intermediate results/data either on the hub (location="global"), or locally
-        :param data: the result to save
+        :param data: the result to save, file paths, binary file objects and generators of bytes chunks are streamed
         :param location: the location to save the result, local saves in the node, global saves in central instance of MinIO
         :param remote_node_ids: optional remote node ids (used for accessing remote node's public key for encryption)
         :param tag: optional storage tag
+        :param broadcast: whether to upload a single copy of global data for all remote nodes
+        :param codec: serializer of the data ('pickle5', 'npy', 'arrow', 'msgpack'), chosen by its type if None
         :return: list of the request status codes and url access and ids
         """
-        returns = {}
         if remote_node_ids:
-            for remote_node_id in remote_node_ids:
-                returns[remote_node_id] = self.storage_client.push_result(data,
-                                                                          remote_node_id=remote_node_id,
-                                                                          type=location)
-            return returns
+            return self.storage_client.push_result_to_nodes(data,
+                                                            remote_node_ids,
+                                                            type=location,
+                                                            broadcast=broadcast,
+                                                            codec=codec)
         else:
-            return self.storage_client.push_result(data, tag=tag, type=location)
+            return self.storage_client.push_result(data, tag=tag, type=location, codec=codec)
 
     def get_intermediate_data(self,
                               location: Literal["local", "global"],
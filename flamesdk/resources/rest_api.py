@@ -15,6 +15,7 @@ from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient
 from flamesdk.resources.client_apis.clients.storage_client import StorageClient
 from flamesdk.resources.client_apis.clients.po_client import POClient
 from flamesdk.resources.utils.utils import extract_remaining_time_from_token
+from flamesdk.resources.utils.transport import set_keycloak_token
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import AnalysisStatus, LogTypeLiteral
 
@@ -94,15 +95,8 @@ class FlameAPI:
                     self.flame_logger.raise_error(f"No token provided for refresh")
                     raise HTTPException(status_code=400, detail="Token is required")
 
-                # refresh token in po client
-                self.po_client.refresh_token(new_token)
-                # refresh token in message-broker
-                self.message_broker.refresh_token(new_token)
-                if isinstance(data_client, DataApiClient):
-                    # refresh token in data client
-                    self.data_client.refresh_token(new_token)
-                # refresh token in result client
-                self.storage_client.refresh_token(new_token)
+                # rotate the token shared by po, message-broker, data and result clients (connections are kept)
+                set_keycloak_token(new_token)
                 # refresh token in self
                 self.keycloak_token = new_token
                 return JSONResponse(content={"message": "Token refreshed successfully"})
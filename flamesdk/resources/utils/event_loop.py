@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Coroutine, Optional, TypeVar
+
+
+T = TypeVar('T')
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_THREAD: Optional[threading.Thread] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the SDK's long-lived event loop, starting it in a dedicated daemon thread on first use. All asynchronous
+    I/O of the SDK runs on this loop, so that clients, connection pools, tasks and timers persist across calls.
+    :return: the running background event loop
+    """
+    global _LOOP, _LOOP_THREAD
+    with _LOOP_LOCK:
+        if (_LOOP is None) or _LOOP.is_closed() or (_LOOP_THREAD is None) or (not _LOOP_THREAD.is_alive()):
+            loop = asyncio.new_event_loop()
+            loop_ready = threading.Event()
+
+            def run_loop() -> None:
+                asyncio.set_event_loop(loop)
+                loop.call_soon(loop_ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=run_loop, name="flamesdk-event-loop", daemon=True)
+            thread.start()
+            loop_ready.wait()
+            _LOOP, _LOOP_THREAD = loop, thread
+        return _LOOP
+
+
+def in_event_loop_thread() -> bool:
+    """
+    Returns whether the caller is running on the SDK's background event loop thread.
+    :return:
+    """
+    return (_LOOP_THREAD is not None) and (threading.current_thread() is _LOOP_THREAD)
+
+
+def run_coroutine(coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+    """
+    Submits a coroutine to the SDK's background event loop and blocks until its result is available (synchronous
+    facade replacing asyncio.run).
+    :param coroutine: the coroutine to run
+    :param timeout: optional time in seconds to wait for the result
+    :raises RuntimeError: if called from the event loop thread itself (this would deadlock)
+    :raises TimeoutError: if the result is not available within timeout (the coroutine is cancelled)
+    :return: the coroutine's result
+    """
+    if in_event_loop_thread():
+        coroutine.close()
+        raise RuntimeError("run_coroutine must not be called from the SDK event loop thread, await the coroutine instead")
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
@@ -1,15 +1,38 @@
+import importlib
+import os
+import pickle
+import struct
+import subprocess
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from io import StringIO
-from typing import Optional, Any, Literal, Union
+from itertools import islice
+from operator import lt
+from urllib.parse import parse_qsl, urlencode
+from typing import IO, TYPE_CHECKING, Optional, Any, Literal, Union
 
-from flamesdk.resources.client_apis.data_api import DataAPI
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import LogTypeLiteral
 
+if TYPE_CHECKING:
+    from flamesdk.resources.client_apis.data_api import DataAPI
+
 
 _KNOWN_RESOURCES = ['Observation', 'QuestionnaireResponse']
+# columnar output types and the (optional) packages they require
+_COLUMNAR_OUTPUT_PACKAGES = {'numpy': 'numpy', 'pandas': 'pandas', 'arrow': 'pyarrow'}
+# Observation search parameters (exact match on codes/references) for the key sequences they correspond to
+_OBSERVATION_SEARCH_PARAMETERS = {'resource.code.coding.code': 'code',
+                                  'resource.component.code.coding.code': 'component-code',
+                                  'resource.component.valueCodeableConcept.coding.code': 'component-value-concept',
+                                  'resource.valueCodeableConcept.coding.code': 'value-concept',
+                                  'resource.subject.reference': 'subject'}
 
 
-def fhir_to_csv(fhir_data: dict[str, Any],
+def fhir_to_csv(fhir_data: Union[dict[str, Any], str],
                 col_key_seq: str,
                 value_key_seq: str,
                 input_resource: str,
@@ -19,153 +42,745 @@ def fhir_to_csv(fhir_data: dict[str, Any],
                 col_id_filters: Optional[list[str]] = None,
                 row_col_name: str = '',
                 separator: str = ',',
-                output_type: Literal["file", "dict"] = "file",
-                data_client: Optional[Union[DataAPI, bool]] = None) -> Union[StringIO, dict[Any, dict[Any, Any]]]:
+                output_type: Literal["file", "stream", "dict", "numpy", "pandas", "arrow"] = "file",
+                data_client: Optional[Union['DataAPI', bool]] = None,
+                prefetch_pages: int = 2,
+                sink: Optional[Union[str, os.PathLike, IO[str]]] = None,
+                stream_entries: bool = False,
+                pushdown: bool = False,
+                exact_filters: bool = False,
+                workers: Optional[int] = 1
+                ) -> Union[StringIO, Iterator[str], str, os.PathLike, IO[str], dict[Any, dict[Any, Any]], Any]:
     if input_resource not in _KNOWN_RESOURCES:
         flame_logger.raise_error(f"Unknown resource specified (given={input_resource}, known={_KNOWN_RESOURCES})")
     if input_resource == 'Observation' and not row_key_seq:
         flame_logger.raise_error(f"Resource 'Observation' specified, but no valid row key sequence was given "
                                  f"(given={row_key_seq})")
+    if isinstance(fhir_data, str):
+        # a fhir query, retrieved here (with projection and filters pushed down to the server, if requested)
+        if (data_client is None) or isinstance(data_client, bool):
+            flame_logger.raise_error(f"A fhir query was given (query={fhir_data}), but no data client to retrieve it")
+        query = _pushdown_query(fhir_data, input_resource, col_key_seq, value_key_seq, row_key_seq,
+                                row_id_filters, col_id_filters, exact_filters) if pushdown else fhir_data
+        flame_logger.new_log(f"Retrieving fhir data for query={query}", log_type=LogTypeLiteral.DEBUG.value)
+        bundles = _get_fhir_bundles(data_client, query, flame_logger)
+        if len(bundles) > 1:
+            flame_logger.new_log(f"Merging the fhir data of {len(bundles)} data sources for query={query}",
+                                 log_type=LogTypeLiteral.DEBUG.value)
+    else:
+        if pushdown:
+            flame_logger.new_log("Pushdown requires a fhir query (fhir_data was already retrieved), it is skipped",
+                                 log_type=LogTypeLiteral.WARNING.value)
+            pushdown = False
+        bundles = [fhir_data]
 
-    df_dict = {}
+    table = _FhirTableBuilder()
     col_keys = col_key_seq.split('.')
     value_keys = value_key_seq.split('.')
     row_keys = row_key_seq.split('.') if row_key_seq else None
     flame_logger.new_log(f"Converting fhir data resource of type={input_resource} to csv")
-    total_count = int(fhir_data['total'])
-    count_mod = 10 ** (len(str(total_count)) - 2)
-    count_mod = count_mod if count_mod > 1 else 1
-    current_count = 0
-    while True:
-        for i, entry in enumerate(fhir_data['entry']):
-            current_count += 1
-            if (current_count == 1) or not (current_count % count_mod):
-                flame_logger.new_log(f"Parsing fhir data entry no={current_count} of {total_count}")
+    # the total is optional in fhir bundles
+    total_count = sum(int(bundle['total']) for bundle in bundles) \
+        if all(bundle.get('total') is not None for bundle in bundles) else None
+    flattener_args = (input_resource, col_keys, value_keys, row_keys, row_id_filters, col_id_filters)
+    flattener = _FhirEntryFlattener(*flattener_args, flame_logger=flame_logger, total_count=total_count)
+    workers = os.cpu_count() if workers is None else workers
+    pool = _FhirFlattenWorkers(workers, flattener_args, flattener, table) if workers > 1 else None
+    try:
+        for bundle in bundles:
+            # the pages of each bundle are followed on the data source that produced it
+            for page in _iter_fhir_page_entries(bundle, data_client, flame_logger, prefetch_pages, stream_entries,
+                                                raw_pages=pool is not None):
+                if isinstance(page, bytes):
+                    pool.submit(page)
+                else:
+                    if pool is not None:
+                        # the pages in flight precede this one
+                        pool.drain()
+                    flattener.flatten(page, table.add)
+        if pool is not None:
+            pool.drain()
+    finally:
+        if pool is not None:
+            pool.close()
+    if pushdown and flattener.filtered:
+        # the client-side filters still apply, entries the server should have excluded point to a pushdown mismatch
+        flame_logger.new_log(f"Pushed down query returned {flattener.filtered} entries not matching the row/column id "
+                             f"filters, these were discarded", log_type=LogTypeLiteral.WARNING.value)
+
+    # set output format
+    if (output_type == "file") and (sink is not None):
+        output = _table_to_csv_sink(table=table,
+                                    row_col_name=row_col_name,
+                                    separator=separator,
+                                    sink=sink,
+                                    flame_logger=flame_logger)
+    elif output_type == "file":
+        output = _table_to_csv(table=table, row_col_name=row_col_name, separator=separator, flame_logger=flame_logger)
+    elif output_type == "stream":
+        output = table.iter_csv_lines(row_col_name, separator)
+    elif output_type in _COLUMNAR_OUTPUT_PACKAGES:
+        output = _table_to_columns(table=table,
+                                   row_col_name=row_col_name,
+                                   output_type=output_type,
+                                   flame_logger=flame_logger)
+    else:
+        output = table.to_dict()
+
+    return output
+
+
+def _pushdown_query(query: str,
+                    input_resource: str,
+                    col_key_seq: str,
+                    value_key_seq: str,
+                    row_key_seq: Optional[str],
+                    row_id_filters: Optional[list[str]],
+                    col_id_filters: Optional[list[str]],
+                    exact_filters: bool) -> str:
+    """
+    Adds an _elements projection and search parameters derived from the key sequences and filters to a fhir query.
+    Only the top-level resource elements of the key sequences are requested. Search parameters match exactly, whereas
+    the client-side filters match substrings, so row (or else column) id filters are only pushed down if they are
+    declared to be exact (i.e. the ids match them as a whole) and their key sequence corresponds to an Observation
+    search parameter. Parameters already present in the query are kept as they are.
+    :return: the query with the pushed down parameters
+    """
+    path, _, query_string = query.partition('?')
+    parameters = parse_qsl(query_string, keep_blank_values=True)
+    present = {name for name, _ in parameters}
+
+    key_seqs = [key_seq for key_seq in (col_key_seq, value_key_seq, row_key_seq) if key_seq]
+    if all(key_seq.startswith('resource.') for key_seq in key_seqs) and ('_elements' not in present):
+        # the last key of a sequence may be the base name of a choice element (e.g. 'value' for valueQuantity),
+        # which is how choice elements are requested in _elements as well
+        elements = dict.fromkeys(key_seq.split('.')[1] for key_seq in key_seqs)
+        parameters.append(('_elements', ','.join(elements)))
+
+    if exact_filters and (input_resource == 'Observation'):
+        filters = [(row_key_seq, row_id_filters)] if row_id_filters is not None else [(col_key_seq, col_id_filters)]
+        for key_seq, id_filters in filters:
+            search_parameter = _OBSERVATION_SEARCH_PARAMETERS.get(key_seq)
+            if (search_parameter is not None) and id_filters and (search_parameter not in present):
+                parameters.append((search_parameter, ','.join(id_filters)))
+    return f"{path}?{urlencode(parameters, safe=',/:')}" if parameters else path
+
+
+def _get_fhir_bundles(data_client: 'DataAPI', query: str, flame_logger: FlameLogger) -> list[dict[str, Any]]:
+    """
+    Retrieves the fhir bundles of a query from all data sources
+    :return: the bundle of each data source that returned data for the query
+    """
+    bundles = [r[query] for r in (data_client.get_fhir_data([query]) or []) if r and (query in r)]
+    if not bundles:
+        flame_logger.raise_error(f"No fhir data was returned by any data source for query={query}")
+    return bundles
+
+
+def get_next_page_query(fhir_data: dict[str, Any]) -> str:
+    """
+    Returns the query of the next page of a paginated fhir bundle
+    :param fhir_data: the fhir bundle
+    :return: the query following '/fhir/' in the bundle's next link, or an empty string on the last page
+    """
+    next_query = ''
+    for e in fhir_data.get('link', []):
+        link_relation, link_url = str(e['relation']), str(e['url'])
+        if link_relation == 'next':
+            next_query = link_url.split('/fhir/')[-1]
+    return next_query
+
+
+def _iter_fhir_page_entries(fhir_data: dict[str, Any],
+                            data_client: Optional[Union['DataAPI', bool]],
+                            flame_logger: FlameLogger,
+                            prefetch_pages: int,
+                            stream_entries: bool,
+                            raw_pages: bool = False) -> Iterator[Union[Iterable[dict[str, Any]], bytes]]:
+    # yields the entries of the given bundle, followed by those of its next pages (if a data client is given), the
+    # next pages of a known source are yielded as json bytes instead if raw_pages is set
+    yield fhir_data['entry']
+    if (data_client is None) or (isinstance(data_client, bool)):
+        return
+
+    next_query = get_next_page_query(fhir_data)
+    if next_query:
+        flame_logger.new_log(f"Parsing next batch query={next_query}", log_type=LogTypeLiteral.DEBUG.value)
+        source_name = data_client.get_fhir_data_source(fhir_data)
+        if (source_name is not None) and raw_pages:
+            # follow the pages on the source that produced the bundle, leaving their decoding to the caller
+            yield from data_client.iter_fhir_page_bytes(source_name, next_query, prefetch_pages)
+        elif (source_name is not None) and stream_entries:
+            # follow the pages on the source that produced the bundle, parsing entries as they arrive
+            for page in data_client.iter_fhir_page_streams(source_name, next_query):
+                yield page.entries
+        elif source_name is not None:
+            # follow the pages on the source that produced the bundle, retrieving ahead while parsing
+            for fhir_data in data_client.iter_fhir_pages(source_name, next_query, prefetch_pages):
+                yield fhir_data['entry']
+        else:
+            while next_query:
+                # the source of the bundle is unknown, so the next page is requested from all sources, of which only
+                # one may answer
+                bundles = _get_fhir_bundles(data_client, next_query, flame_logger)
+                if len(bundles) > 1:
+                    flame_logger.raise_error(f"The next page query={next_query} of a fhir bundle of unknown origin "
+                                             f"was answered by {len(bundles)} data sources")
+                fhir_data = bundles[0]
+                yield fhir_data['entry']
+                next_query = get_next_page_query(fhir_data)
+                if next_query:
+                    flame_logger.new_log(f"Parsing next batch query={next_query}",
+                                         log_type=LogTypeLiteral.DEBUG.value)
+    flame_logger.new_log("Fhir data parsing finished")
+
+
+class _FhirEntryFlattener:
+    """
+    Extracts the (column id, row id, value) cells of fhir entries with compiled accessors, applying the row and column
+    id filters, and logs the parsing progress.
+    """
+
+    def __init__(self,
+                 input_resource: str,
+                 col_keys: list[str],
+                 value_keys: list[str],
+                 row_keys: Optional[list[str]],
+                 row_id_filters: Optional[list[str]],
+                 col_id_filters: Optional[list[str]],
+                 flame_logger: FlameLogger,
+                 total_count: Optional[int] = None,
+                 log_progress: bool = True) -> None:
+        self.input_resource = input_resource
+        self.row_id_filters = row_id_filters
+        self.col_id_filters = col_id_filters
+        self.flame_logger = flame_logger
+        # compile the key sequences into accessors once per conversion (entries of QuestionnaireResponses are
+        # searched from the item level onwards)
+        if input_resource == 'Observation':
+            self.get_col_id = _compile_fhir_path(col_keys, flame_logger)
+            self.get_row_id = _compile_fhir_path(row_keys, flame_logger)
+            self.get_value = _compile_fhir_path(value_keys, flame_logger)
+        else:
+            self.get_col_id = _compile_fhir_path(col_keys[2:], flame_logger)
+            self.get_value = _compile_fhir_path(value_keys[2:], flame_logger)
+        self.count = 0
+        # entries (or QuestionnaireResponse items) discarded by the row/column id filters
+        self.filtered = 0
+        self.total_count = total_count
+        self.log_progress = log_progress
+        count_mod = 10 ** (len(str(total_count)) - 2) if total_count is not None else 1000
+        self.count_mod = count_mod if count_mod > 1 else 1
+
+    def flatten(self,
+                entries: Iterable[dict[str, Any]],
+                add: Callable[[Any, Any, Any], None]) -> int:
+        """
+        Extracts the cells of the given entries
+        :param entries: the entries of (a part of) a page
+        :param add: called with column id, row id and value of each cell
+        :return: the number of entries
+        """
+        row_id_filters, col_id_filters = self.row_id_filters, self.col_id_filters
+        get_col_id, get_value = self.get_col_id, self.get_value
+        log_progress, count_mod = self.log_progress, self.count_mod
+        first_count = self.count
+        for i, entry in enumerate(entries):
+            self.count += 1
+            if log_progress and ((self.count == 1) or not (self.count % count_mod)):
+                self._log_count(self.count)
 
             # extract from resource
-            if input_resource == 'Observation':
-                col_id = _search_fhir_resource(fhir_entry=entry, flame_logger=flame_logger, keys=col_keys)
-                row_id = _search_fhir_resource(fhir_entry=entry, flame_logger=flame_logger, keys=row_keys)
-                value = _search_fhir_resource(fhir_entry=entry, flame_logger=flame_logger, keys=value_keys)
+            if self.input_resource == 'Observation':
+                col_id = get_col_id(entry)
+                row_id = self.get_row_id(entry)
+                value = get_value(entry)
                 if row_id_filters is not None:
                     if (row_id is None) or (not any([row_id_filter in row_id for row_id_filter in row_id_filters])):
+                        self.filtered += 1
                         continue
                 elif col_id_filters is not None:
                     if (col_id is None) or (not any([col_id_filter in col_id for col_id_filter in col_id_filters])):
+                        self.filtered += 1
                         continue
-                if col_id not in df_dict.keys():
-                    df_dict[col_id] = {}
-                if row_id not in df_dict[col_id].keys():
-                    df_dict[col_id][row_id] = ''
-                df_dict[col_id][row_id] = value
-
-            elif input_resource == 'QuestionnaireResponse':
+                add(col_id, row_id, value)
+            else:
                 for item in entry['resource']['item']:
-                    col_id = _search_fhir_resource(fhir_entry=item,
-                                                   flame_logger=flame_logger,
-                                                   keys=col_keys,
-                                                   current=2)
-                    value = _search_fhir_resource(fhir_entry=item,
-                                                  flame_logger=flame_logger,
-                                                  keys=value_keys,
-                                                  current=2)
+                    col_id = get_col_id(item)
+                    value = get_value(item)
                     if col_id_filters is not None:
                         if (col_id is None) or (not any([col_id_filter in col_id for col_id_filter in col_id_filters])):
+                            self.filtered += 1
                             continue
-                    if col_id not in df_dict.keys():
-                        df_dict[col_id] = {}
-                    df_dict[col_id][str(i)] = value
-            else:
-                try:
-                    raise IOError(f"Unknown resource specified (given={input_resource}, known={_KNOWN_RESOURCES})")
-                except IOError as e:
-                    flame_logger.raise_error(f"Error while parsing fhir data: {repr(e)}")
-
-        # get next data
-        if (data_client is None) or (isinstance(data_client, bool)):
-            break
-        else:
-            next_query = ''
-            for e in fhir_data['link']:
-                link_relation, link_url = str(e['relation']), str(e['url'])
-                if link_relation == 'next':
-                    next_query = link_url.split('/fhir/')[-1]
-                    flame_logger.new_log(f"Parsing next batch query={next_query}",
-                                         log_type=LogTypeLiteral.DEBUG.value)
-            if next_query:
-                fhir_data = [r for r in data_client.get_fhir_data([next_query]) if r][0][next_query]
-            else:
-                flame_logger.new_log("Fhir data parsing finished")
-                break
+                    add(col_id, str(i), value)
+        return self.count - first_count
 
-    # set output format
-    if output_type == "file":
-        output = _dict_to_csv(data=df_dict, row_col_name=row_col_name, separator=separator, flame_logger=flame_logger)
-    else:
-        output = df_dict
+    def advance(self, number_of_entries: int, number_filtered: int = 0) -> None:
+        """
+        Counts entries flattened elsewhere (by worker processes), logging the progress like flatten
+        :param number_of_entries: the number of entries
+        :param number_filtered: the number of entries (or items) discarded by the filters
+        """
+        self.filtered += number_filtered
+        previous_count = self.count
+        self.count += number_of_entries
+        if (previous_count == 0) and (self.count > 0):
+            self._log_count(1)
+        for count in range((previous_count // self.count_mod + 1) * self.count_mod, self.count + 1, self.count_mod):
+            if count > 1:
+                self._log_count(count)
 
-    return output
+    def _log_count(self, count: int) -> None:
+        self.flame_logger.new_log(f"Parsing fhir data entry no={count}" +
+                                  (f" of {self.total_count}" if self.total_count is not None else ""))
+
+
+class _FhirFlattenWorkers:
+    """
+    Worker processes flattening the raw json pages of a fhir search in parallel. Each worker decodes a page and
+    flattens its entries into a table of its own, which is merged into the conversion's table in page order, so the
+    result is identical to the one of the serial conversion.
+
+    The workers run fhir_worker as a module in a fresh interpreter (neither forked from the calling process, with its
+    running threads, nor re-importing the analysis' main script), and communicate through their stdin and stdout.
+    Pages are assigned round robin with one page in flight per worker, the result of a worker's previous page is
+    merged before its next page is sent.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 flattener_args: tuple,
+                 flattener: _FhirEntryFlattener,
+                 table: '_FhirTableBuilder') -> None:
+        self.workers = workers
+        self.flattener_args = flattener_args
+        self.flattener = flattener
+        self.table = table
+        # started on the first page submitted
+        self._processes: list[subprocess.Popen] = []
+        self._in_flight: deque[subprocess.Popen] = deque()
+        self._submitted = 0
+
+    def submit(self, page: bytes) -> None:
+        if not self._processes:
+            self._start()
+        if len(self._in_flight) == len(self._processes):
+            self._merge_next()
+        process = self._processes[self._submitted % len(self._processes)]
+        self._submitted += 1
+        try:
+            _write_message(process.stdin, page)
+        except OSError as e:
+            self.flattener.flame_logger.raise_error(f"Failed to hand a fhir data page to a flattening worker process: "
+                                                    f"{repr(e)}")
+            return
+        self._in_flight.append(process)
+
+    def drain(self) -> None:
+        while self._in_flight:
+            self._merge_next()
+
+    def close(self) -> None:
+        for process in self._processes:
+            try:
+                _write_message(process.stdin, None)
+                process.stdin.close()
+                process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
+            process.stdout.close()
+        self._processes = []
+        self._in_flight.clear()
+
+    def _start(self) -> None:
+        flame_logger = self.flattener.flame_logger
+        flame_logger.new_log(f"Flattening fhir data pages on {self.workers} worker processes",
+                             log_type=LogTypeLiteral.DEBUG.value)
+        # the workers import the sdk from where this process did
+        env = dict(os.environ)
+        package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        env['PYTHONPATH'] = os.pathsep.join([package_root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        for _ in range(self.workers):
+            process = subprocess.Popen([sys.executable, '-m', 'flamesdk.resources.utils.fhir_worker'],
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       env=env)
+            self._processes.append(process)
+            _write_message(process.stdin, self.flattener_args)
+
+    def _merge_next(self) -> None:
+        process = self._in_flight.popleft()
+        try:
+            result = _read_message(process.stdout)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            result = repr(e)
+        if not isinstance(result, tuple):
+            self.flattener.flame_logger.raise_error(f"Failed to flatten a fhir data page in a worker process: "
+                                                    f"{result}")
+            return
+        table, number_of_entries, number_filtered, logs = result
+        for msg, log_type in logs:
+            self.flattener.flame_logger.new_log(msg, log_type=log_type)
+        self.table.merge(table)
+        self.flattener.advance(number_of_entries, number_filtered)
+
+
+def _write_message(file: IO[bytes], message: Any) -> None:
+    # length-prefixed pickle, exchanged with the flattening worker processes
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    file.write(struct.pack('<Q', len(data)))
+    file.write(data)
+    file.flush()
 
 
-def _dict_to_csv(data: dict[Any, dict[Any, Any]],
-                 row_col_name: str,
-                 separator: str,
-                 flame_logger: FlameLogger) -> StringIO:
-    flame_logger.new_log("Writing fhir data dict to csv...", halt_submission=True)
-    columns = list(data.keys())
-    row_ids = dict.fromkeys(row_id for col in data.values() for row_id in col)
-    lines = [separator.join([row_col_name] + [str(c) for c in columns])]
-    for row_id in row_ids:
-        line = [str(row_id)]
-        for col in columns:
-            line.append(str(data[col].get(row_id, '')))
-        lines.append(separator.join(line))
+def _read_message(file: IO[bytes]) -> Any:
+    header = file.read(8)
+    if len(header) < 8:
+        raise EOFError("Flattening worker process ended unexpectedly")
+    size, = struct.unpack('<Q', header)
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError("Flattening worker process ended unexpectedly")
+    return pickle.loads(data)
 
+
+def _table_to_csv(table: '_FhirTableBuilder',
+                  row_col_name: str,
+                  separator: str,
+                  flame_logger: FlameLogger) -> StringIO:
+    flame_logger.new_log("Writing fhir data to csv...", halt_submission=True)
     io = StringIO()
-    io.write('\n'.join(lines))
+    _write_csv_lines(table.iter_csv_lines(row_col_name, separator), io)
     io.seek(0)
     flame_logger.new_log("success")
     return io
 
 
-def _search_fhir_resource(fhir_entry: Union[dict[str, Any], list[Any]],
-                          flame_logger: FlameLogger,
-                          keys: list[str],
-                          current: int = 0) -> Optional[Any]:
-    key = keys[current]
-    if (current < (len(keys) - 1)) or (type(fhir_entry) == list):
-        if type(fhir_entry) == dict:
-            if key in fhir_entry.keys():
-                next_value = _search_fhir_resource(fhir_entry[key], flame_logger, keys, current + 1)
-                if next_value is not None:
-                    return next_value
-            else:
-                return None
-        elif type(fhir_entry) == list:
-            for e in fhir_entry:
-                next_value = _search_fhir_resource(e, flame_logger, keys, current)
-                if next_value is not None:
-                    return next_value
-        else:
-            return None
+def _table_to_csv_sink(table: '_FhirTableBuilder',
+                       row_col_name: str,
+                       separator: str,
+                       sink: Union[str, os.PathLike, IO[str]],
+                       flame_logger: FlameLogger) -> Union[str, os.PathLike, IO[str]]:
+    """
+    Writes the csv output line by line into a file path or a writable text file-like object, without holding the
+    csv in memory.
+    :return: the given sink
+    """
+    flame_logger.new_log(f"Writing fhir data to csv sink={sink}...", halt_submission=True)
+    if isinstance(sink, (str, os.PathLike)):
+        with open(sink, 'w', encoding='utf-8', newline='') as file:
+            _write_csv_lines(table.iter_csv_lines(row_col_name, separator), file)
     else:
-        if current == (len(keys) - 1):
-            if type(fhir_entry) == dict:
-                try:
-                    value = fhir_entry[key]
-                except KeyError:
-                    key = [k for k in fhir_entry.keys() if key in k][0]
-                    if key:
-                        value = fhir_entry[key]
-                    else:
-                        flame_logger.new_log(f"Unable to find field '{key}' in fhir data at level={current + 1} "
-                                             f"(keys found: fhir_entry.keys())",
-                                             log_type=LogTypeLiteral.WARNING.value)
-                        return None
-                return value
-            else:
-                return None
+        _write_csv_lines(table.iter_csv_lines(row_col_name, separator), sink)
+    flame_logger.new_log("success")
+    return sink
+
+
+def _write_csv_lines(lines: Iterator[str], file: IO[str]) -> None:
+    # lines are separated (not terminated) by line breaks, as in the former joined csv string
+    for i, line in enumerate(lines):
+        if i:
+            file.write('\n')
+        file.write(line)
+
+
+def _table_to_columns(table: '_FhirTableBuilder',
+                      row_col_name: str,
+                      output_type: Literal["numpy", "pandas", "arrow"],
+                      flame_logger: FlameLogger) -> Union[dict[str, Any], Any]:
+    """
+    Converts the fhir data table to columns with the layout of the csv output (the first column holds the row ids),
+    without a string round trip. Missing values become None (Arrow) or NaN/None (NumPy and pandas).
+    :return: a dict of NumPy arrays per column name (numpy), a pandas.DataFrame (pandas) or a pyarrow.Table (arrow)
+    """
+    package_name = _COLUMNAR_OUTPUT_PACKAGES[output_type]
+    try:
+        package = importlib.import_module(package_name)
+    except ImportError:
+        flame_logger.raise_error(f"Output type '{output_type}' requires the package '{package_name}' "
+                                 f"(install it with 'pip install {package_name}')")
+        return None
+    flame_logger.new_log(f"Converting fhir data to {output_type} columns...", halt_submission=True)
+
+    columns = {str(row_col_name): table.row_ids_in_order()}
+    for col_id, values in table.iter_columns():
+        columns[str(col_id)] = values
+
+    if output_type == 'arrow':
+        output = package.table({name: _to_arrow_array(package, values) for name, values in columns.items()})
+    else:
+        np = package if output_type == 'numpy' else importlib.import_module('numpy')
+        output = {name: _to_numpy_array(np, values) for name, values in columns.items()}
+        if output_type == 'pandas':
+            output = package.DataFrame(output, copy=False)
+    flame_logger.new_log("success")
+    return output
+
+
+def _to_numpy_array(np: Any, values: list[Any]) -> Any:
+    # integer columns become int64 (float64 if values are missing), numeric columns float64, fully present boolean
+    # columns bool and everything else object (e.g. strings, as with pandas)
+    present_types = {type(v) for v in values if v is not None}
+    has_missing = (None in values)
+    try:
+        if present_types and (present_types <= {int}) and not has_missing:
+            return np.array(values, dtype=np.int64)
+        elif present_types and (present_types <= {int, float}):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif (present_types == {bool}) and not has_missing:
+            return np.array(values, dtype=np.bool_)
+    except OverflowError:
+        pass
+    array = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        array[i] = v
+    return array
+
+
+def _to_arrow_array(pa: Any, values: list[Any]) -> Any:
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed value types, fall back to the values' string representation as written to csv
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def _compile_fhir_path(keys: list[str], flame_logger: FlameLogger) -> Callable[[Any], Optional[Any]]:
+    """
+    Compiles a key sequence into an accessor function with the semantics of _search_fhir_resource: dicts are
+    descended by key, lists are searched element by element for the first non-None result, and the last key falls
+    back to the first field containing it (e.g. 'value' -> 'valueQuantity'). The fallback field is resolved once per
+    entry shape (i.e. the field names of the dict) and cached.
+    :param keys: the key sequence
+    :param flame_logger: the logger used to report unresolvable fields (once per entry shape)
+    :return: the accessor, returning the value found or None
+    """
+    last_key = keys[-1]
+    fuzzy_keys: dict[tuple[str, ...], Optional[str]] = {}
+
+    def get_last(fhir_entry: Any) -> Optional[Any]:
+        entry_type = type(fhir_entry)
+        if entry_type is dict:
+            if last_key in fhir_entry:
+                return fhir_entry[last_key]
+            shape = tuple(fhir_entry)
+            try:
+                key = fuzzy_keys[shape]
+            except KeyError:
+                key = fuzzy_keys[shape] = next((k for k in fhir_entry if last_key in k), None)
+                if key is None:
+                    flame_logger.new_log(f"Unable to find field '{last_key}' in fhir data at level={len(keys)} "
+                                         f"(keys found: {list(shape)})",
+                                         log_type=LogTypeLiteral.WARNING.value)
+            return fhir_entry[key] if key is not None else None
+        elif entry_type is list:
+            for e in fhir_entry:
+                value = get_last(e)
+                if value is not None:
+                    return value
+        return None
+
+    accessor = get_last
+    for key in reversed(keys[:-1]):
+        accessor = _compile_fhir_path_step(key, accessor)
+    return accessor
+
+
+def _compile_fhir_path_step(key: str, get_next: Callable[[Any], Optional[Any]]) -> Callable[[Any], Optional[Any]]:
+    def get_step(fhir_entry: Any) -> Optional[Any]:
+        entry_type = type(fhir_entry)
+        if entry_type is dict:
+            if key in fhir_entry:
+                return get_next(fhir_entry[key])
+        elif entry_type is list:
+            for e in fhir_entry:
+                value = get_step(e)
+                if value is not None:
+                    return value
+        return None
+
+    return get_step
+
+
+class _FhirTableBuilder:
+    """
+    Memory-compact table of the (column id, row id, value) cells extracted from fhir data.
+
+    Row and column ids are interned to integer indices. Each column stores the row indices and values of its cells in
+    growable typed arrays ('q' for int and 'd' for float values, falling back to a list on other or mixed types) in
+    the order they were added. A later cell overwrites an earlier one of the same row and column. The row order of
+    the outputs follows the former dict-of-dicts: columns in order of appearance, rows by first appearance within them.
+    """
+
+    def __init__(self) -> None:
+        self.col_ids: list[Any] = []
+        self.row_ids: list[Any] = []
+        self._col_index: dict[Any, int] = {}
+        self._row_index: dict[Any, int] = {}
+        self._col_rows: list[array] = []
+        self._col_values: list[Union[array, list[Any]]] = []
+        # value type of each typed column (int or float), None for columns backed by a list
+        self._col_types: list[Optional[type]] = []
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self._col_rows)
+
+    def add(self, col_id: Any, row_id: Any, value: Any) -> None:
+        col = self._col_index.get(col_id)
+        if col is None:
+            col = self._add_column(col_id, value)
+        row = self._row_index.get(row_id)
+        if row is None:
+            row = self._row_index[row_id] = len(self.row_ids)
+            self.row_ids.append(row_id)
+
+        values = self._col_values[col]
+        value_type = self._col_types[col]
+        if (value_type is not None) and (type(value) is not value_type):
+            values = self._promote_column(col)
+        try:
+            values.append(value)
+        except OverflowError:
+            self._promote_column(col).append(value)
+        self._col_rows[col].append(row)
+
+    def merge(self, other: '_FhirTableBuilder') -> None:
+        """
+        Appends the cells of another table, as if they had been added to this one after its own cells
+        :param other: the table to merge
+        """
+        rows = array('q')
+        for row_id in other.row_ids:
+            row = self._row_index.get(row_id)
+            if row is None:
+                row = self._row_index[row_id] = len(self.row_ids)
+                self.row_ids.append(row_id)
+            rows.append(row)
+
+        for col_id, other_rows, other_values, other_type in zip(other.col_ids, other._col_rows, other._col_values,
+                                                               other._col_types):
+            col = self._col_index.get(col_id)
+            if col is None:
+                col = self._col_index[col_id] = len(self.col_ids)
+                self.col_ids.append(col_id)
+                self._col_rows.append(array('q'))
+                self._col_values.append(array(other_values.typecode) if other_type is not None else [])
+                self._col_types.append(other_type)
+            values = self._col_values[col]
+            if self._col_types[col] is not other_type:
+                if self._col_types[col] is not None:
+                    values = self._promote_column(col)
+                other_values = other_values.tolist() if other_type is not None else other_values
+            values.extend(other_values)
+            self._col_rows[col].extend(map(rows.__getitem__, other_rows))
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the indices are rebuilt from the ids, which keeps the tables sent by worker processes compact
+        state = dict(self.__dict__)
+        del state['_col_index'], state['_row_index']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._col_index = {col_id: col for col, col_id in enumerate(self.col_ids)}
+        self._row_index = {row_id: row for row, row_id in enumerate(self.row_ids)}
+
+    def _add_column(self, col_id: Any, value: Any) -> int:
+        col = self._col_index[col_id] = len(self.col_ids)
+        self.col_ids.append(col_id)
+        self._col_rows.append(array('q'))
+        value_type = type(value)
+        if value_type is int:
+            self._col_values.append(array('q'))
+        elif value_type is float:
+            self._col_values.append(array('d'))
         else:
-            flame_logger.new_log(f"Unexpected data type found (found type={type(fhir_entry)})",
-                                 log_type=LogTypeLiteral.WARNING.value)
-            return None
+            value_type = None
+            self._col_values.append([])
+        self._col_types.append(value_type)
+        return col
+
+    def _promote_column(self, col: int) -> list[Any]:
+        # promote the column to a list of python objects (the values are retained exactly)
+        values = self._col_values[col] = self._col_values[col].tolist()
+        self._col_types[col] = None
+        return values
+
+    def to_dict(self) -> dict[Any, dict[Any, Any]]:
+        row_ids = self.row_ids
+        return {col_id: dict(zip([row_ids[row] for row in rows], values))
+                for col_id, rows, values in zip(self.col_ids, self._col_rows, self._col_values)}
+
+    def row_ids_in_order(self) -> list[Any]:
+        return [self.row_ids[row] for row in self._row_order()[1]]
+
+    def iter_columns(self) -> Iterator[tuple[Any, list[Any]]]:
+        """
+        Iterates over the columns, with their values aligned to the row order (None for missing cells)
+        :return: iterator of column id and values
+        """
+        ranks, ordered_rows = self._row_order()
+        for col in range(len(self.col_ids)):
+            column = [None] * len(ordered_rows)
+            col_ranks, positions = self._sorted_column(col, ranks)
+            values = self._col_values[col]
+            for rank, position in zip(col_ranks, positions):
+                column[rank] = values[position]
+            yield self.col_ids[col], column
+
+    def iter_csv_lines(self, row_col_name: str, separator: str, chunk_size: int = 4096) -> Iterator[str]:
+        """
+        Iterates over the lines of the csv output (header first, without line breaks). The columns are sorted by row
+        order once and then consumed chunk by chunk of rows, so no dense row x column structure of the whole table
+        is built.
+        :param row_col_name: header of the row id column
+        :param separator: the value separator
+        :param chunk_size: number of rows assembled at a time
+        :return: iterator of csv lines
+        """
+        yield separator.join([row_col_name] + [str(c) for c in self.col_ids])
+        ranks, ordered_rows = self._row_order()
+        columns = [(*self._sorted_column(col, ranks), self._col_values[col]) for col in range(len(self.col_ids))]
+        cursors = [0] * len(columns)
+        row_ids = self.row_ids
+        for start in range(0, len(ordered_rows), chunk_size):
+            stop = min(start + chunk_size, len(ordered_rows))
+            chunk = [[str(row_ids[row]) for row in ordered_rows[start:stop]]]
+            for col, (col_ranks, positions, values) in enumerate(columns):
+                cursor = cursors[col]
+                end = bisect_left(col_ranks, stop, cursor)
+                if (end - cursor) == (stop - start):
+                    # all rows of the chunk have a value in this column
+                    cells = list(map(str, map(values.__getitem__, positions[cursor:end])))
+                else:
+                    cells = [''] * (stop - start)
+                    for k in range(cursor, end):
+                        cells[col_ranks[k] - start] = str(values[positions[k]])
+                cursors[col] = end
+                chunk.append(cells)
+            for line in zip(*chunk):
+                yield separator.join(line)
+
+    def _row_order(self) -> tuple[array, array]:
+        # rank of each row index, and the row indices by rank
+        ranks = array('q', [-1]) * len(self.row_ids)
+        ordered_rows = array('q')
+        for rows in self._col_rows:
+            for row in rows:
+                if ranks[row] < 0:
+                    ranks[row] = len(ordered_rows)
+                    ordered_rows.append(row)
+        return ranks, ordered_rows
+
+    def _sorted_column(self, col: int, ranks: array) -> tuple[array, Sequence[int]]:
+        # ranks of the column's rows in ascending order, and the position of each row's (last) value
+        rows = self._col_rows[col]
+        col_ranks = array('q', map(ranks.__getitem__, rows))
+        if all(map(lt, col_ranks, islice(col_ranks, 1, None))):
+            # the common case: each row is set once and the rows were added in row order
+            return col_ranks, range(len(rows))
+        last_positions = dict(zip(rows, range(len(rows))))
+        col_ranks = array('q', map(ranks.__getitem__, last_positions.keys()))
+        positions = array('q', last_positions.values())
+        order = sorted(range(len(col_ranks)), key=col_ranks.__getitem__)
+        return array('q', map(col_ranks.__getitem__, order)), array('q', map(positions.__getitem__, order))
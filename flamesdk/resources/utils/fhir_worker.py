@@ -0,0 +1,62 @@
+import json
+import sys
+from collections.abc import Iterable
+from typing import Any, Union
+
+from flamesdk.resources.utils.constants import LogTypeLiteral
+from flamesdk.resources.utils.fhir import _FhirEntryFlattener, _FhirTableBuilder, _read_message, _write_message
+from flamesdk.resources.utils.logging import FlameLogger
+
+
+class _CollectingLogger(FlameLogger):
+    """
+    Logger of a worker process, collecting the logs to be sent back with each page's result instead of printing them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(silent=True)
+        self.logs: list[tuple[str, str]] = []
+
+    def new_log(self,
+                msg: Union[str, bytes, Iterable],
+                sep: str = '',
+                end: str = '',
+                log_type: str = LogTypeLiteral.INFO.value,
+                append: bool = False,
+                halt_submission: bool = False) -> None:
+        self.logs.append((str(msg), log_type))
+
+    def pop_logs(self) -> list[tuple[str, str]]:
+        logs, self.logs = self.logs, []
+        return logs
+
+
+def main() -> None:
+    """
+    Flattens fhir data pages for fhir._FhirFlattenWorkers: reads the flattener arguments, followed by the json bytes
+    of one page after another (and None at the end) from stdin, and writes a result for each page to stdout. A result
+    is the table of the page's cells with the numbers of entries and of filtered entries and the logs, or the
+    representation of the exception the page failed with.
+    """
+    tasks, results = sys.stdin.buffer, sys.stdout.buffer
+    # anything printed while flattening must not end up in the result stream
+    sys.stdout = sys.stderr
+    flame_logger = _CollectingLogger()
+    flattener = _FhirEntryFlattener(*_read_message(tasks), flame_logger=flame_logger, log_progress=False)
+    while True:
+        page = _read_message(tasks)
+        if page is None:
+            break
+        try:
+            table = _FhirTableBuilder()
+            filtered = flattener.filtered
+            number_of_entries = flattener.flatten(json.loads(page)['entry'], table.add)
+            result: Any = (table, number_of_entries, flattener.filtered - filtered, flame_logger.pop_logs())
+        except Exception as e:
+            flame_logger.pop_logs()
+            result = repr(e)
+        _write_message(results, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,175 @@
+import atexit
 import string
 import time
-from typing import Union
-import queue
+from typing import Any, Optional, Union
 import logging
 import json
 import sys
 import threading
+from collections import deque
 from collections.abc import Iterable
 
 from flamesdk.resources.utils.constants import AnalysisStatus, LogTypeLiteral
 
 
+class _QueuedLog:
+    __slots__ = ('record', 'level', 'taken')
+
+    def __init__(self, record: dict[str, Any]) -> None:
+        self.record = record
+        self.level = LogTypeLiteral(record['log_type']).level
+        self.taken = False
+
+
+class LogQueue:
+    def __init__(self, max_size: int = 10000) -> None:
+        """
+        Bounded, thread-safe queue of log records awaiting submission to the PO service. If the queue is full, the
+        oldest debug record is dropped first, then the oldest record below error level. Error records are never dropped
+        (they may exceed max_size).
+        :param max_size: maximum number of queued records
+        """
+        self.max_size = max_size
+        self.dropped = 0
+        self._records: deque[_QueuedLog] = deque()
+        # references into _records for the overflow policy, references to taken records are discarded lazily
+        self._debug_logs: deque[_QueuedLog] = deque()
+        self._droppable_logs: deque[_QueuedLog] = deque()
+        self._size = 0
+        self._unfinished = 0
+        self._condition = threading.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def put(self, record: dict[str, Any]) -> None:
+        """
+        Adds a log record to the queue, applying the overflow policy if the queue is full.
+        :param record: the log record
+        :return:
+        """
+        with self._condition:
+            self._add(_QueuedLog(record))
+            self._condition.notify_all()
+
+    def requeue(self, records: list[dict[str, Any]]) -> None:
+        """
+        Puts records back at the front of the queue (in the given order), e.g. after their submission failed. The
+        overflow policy applies as for new records.
+        :param records: the log records
+        :return:
+        """
+        with self._condition:
+            for record in reversed(records):
+                self._add(_QueuedLog(record), front=True)
+            self._condition.notify_all()
+
+    def get_batch(self, max_items: int, window: float = 0.0, block: bool = True) -> list[dict[str, Any]]:
+        """
+        Removes up to max_items records from the queue. If block is set, waits for the first record and then up to
+        window seconds for the batch to fill up. Every returned record has to be confirmed with task_done.
+        :param max_items: the maximum batch size
+        :param window: time in seconds to wait for further records after the first one
+        :param block: whether to wait for records
+        :return: the list of log records (in submission order)
+        """
+        with self._condition:
+            if block:
+                while self._size == 0:
+                    self._condition.wait()
+                deadline = time.monotonic() + window
+                while self._size < max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            batch = []
+            while self._records and (len(batch) < max_items):
+                item = self._records.popleft()
+                item.taken = True
+                self._size -= 1
+                batch.append(item.record)
+            for references in (self._debug_logs, self._droppable_logs):
+                while references and references[0].taken:
+                    references.popleft()
+            return batch
+
+    def task_done(self, number_of_records: int = 1) -> None:
+        with self._condition:
+            self._unfinished -= number_of_records
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._condition.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until all queued records have been submitted (or dropped).
+        :param timeout: optional time in seconds to wait
+        :return: whether the queue was drained within timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def _add(self, item: _QueuedLog, front: bool = False) -> None:
+        if (self._size >= self.max_size) and (not self._make_room(item)):
+            self.dropped += 1
+            return
+        queues = [self._records]
+        if item.level <= LogTypeLiteral.DEBUG.level:
+            queues.append(self._debug_logs)
+        elif item.level < LogTypeLiteral.ERROR.level:
+            queues.append(self._droppable_logs)
+        for queue in queues:
+            if front:
+                queue.appendleft(item)
+            else:
+                queue.append(item)
+        self._size += 1
+        self._unfinished += 1
+
+    def _make_room(self, item: _QueuedLog) -> bool:
+        candidates = [self._debug_logs]
+        if item.level > LogTypeLiteral.DEBUG.level:
+            candidates.append(self._droppable_logs)
+        for references in candidates:
+            while references:
+                victim = references.popleft()
+                if not victim.taken:
+                    # removed right away (the oldest records are near the front), so max_size bounds the memory
+                    self._records.remove(victim)
+                    self._size -= 1
+                    self._unfinished -= 1
+                    self.dropped += 1
+                    return True
+        # never drop errors, even if this exceeds the queue limit
+        return item.level >= LogTypeLiteral.ERROR.level
+
+
 class FlameLogger:
-    def __init__(self, silent: bool = False) -> None:
+    def __init__(self,
+                 silent: bool = False,
+                 max_queue_size: int = 10000,
+                 batch_size: int = 100,
+                 flush_interval: float = 0.5,
+                 max_send_retries: int = 3) -> None:
         """
         Initialize the FlameLog class with a silent mode.
         :param silent: If True, logs will not be printed to console.
+        :param max_queue_size: maximum number of logs waiting for submission (debug logs are dropped first if exceeded)
+        :param batch_size: maximum number of logs submitted to the PO service per request
+        :param flush_interval: time in seconds a log may wait for further logs to join its batch
+        :param max_send_retries: number of times logs are re-queued after their submission to the PO service failed
         """
-        self.queue = queue.Queue()
+        self.queue = LogQueue(max_queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_send_retries = max_send_retries
+        self._shipper_thread = None
+        self._reported_drops = 0
+        self._send_failure: Optional[str] = None
         self.po_api = None  # Placeholder for PO_API instance
         self.silent = silent
         self.runstatus = AnalysisStatus.STARTING.value  # Default status for logs
@@ -31,6 +183,10 @@ class FlameLogger:
         :param po_api: An instance of POAPI.
         """
         self.po_api = po_api
+        if self._shipper_thread is None:
+            self._shipper_thread = threading.Thread(target=self._ship_logs, name="flamesdk-log-shipper", daemon=True)
+            self._shipper_thread.start()
+            atexit.register(self.flush, 5)
 
     def set_runstatus(self, status: str) -> None:
         """
@@ -72,11 +228,21 @@ class FlameLogger:
                 raise ValueError("POAPI instance is not set. Use add_po_api() to set it.")
             except ValueError as e:
                 self.raise_error(repr(e))
-        if not self.queue.empty():
-            while not self.queue.empty():
-                log_dict = self.queue.get()
-                self.po_api.stream_logs(log_dict['msg'], log_dict['log_type'], log_dict['status'], log_dict['progress'])
-                self.queue.task_done()
+        while not self.queue.empty():
+            batch = self.queue.get_batch(self.batch_size, block=False)
+            self._send_batch(batch)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until all queued logs have been submitted to the POAPI.
+        :param timeout: optional time in seconds to wait
+        :return: whether all logs were submitted within timeout
+        """
+        if self.po_api is None:
+            return self.queue.empty()
+        if (self._shipper_thread is None) or (not self._shipper_thread.is_alive()):
+            self.send_logs_from_queue()
+        return self.queue.join(timeout)
 
     def new_log(self,
                 msg: Union[str, bytes, Iterable],
@@ -153,36 +319,54 @@ class FlameLogger:
         time.sleep(seconds)
 
     def _submit_logs(self, log: str, log_type: str, status: str) -> None:
-        if self.po_api is None:
-            log_dict = {
-                "msg": log,
-                "log_type": log_type,
-                "status": status,
-                "progress": self.progress
-            }
-            self.queue.put(log_dict)
-        else:
-            try:
-                self.send_logs_from_queue()
-                self.po_api.stream_logs(log, log_type, status, self.progress)
-            except Exception as e:
-                # If sending fails, we can still queue the log
-                log_dict = {
-                    "msg": log,
-                    "log_type": log_type,
-                    "status": status,
-                    "progress": self.progress
-                }
-                self.queue.put(log_dict)
-
-                # But also create new error log for queue
-                error_log_dict = {
-                    "msg": f"Failed to send log to POAPI: {repr(e)}",
-                    "log_type": LogTypeLiteral.WARNING.value,
-                    "status": status,
-                    "progress": self.progress
-                }
-                self.queue.put(error_log_dict)
+        log_dict = {
+            "msg": log,
+            "log_type": log_type,
+            "status": status,
+            "progress": self.progress
+        }
+        self.queue.put(log_dict)
+
+    def _ship_logs(self) -> None:
+        """
+        Background loop submitting queued logs to the POAPI in batches (by size or time window).
+        """
+        while True:
+            batch = self.queue.get_batch(self.batch_size, self.flush_interval)
+            self._send_batch(batch)
+
+    def _send_batch(self, batch: list[dict[str, Any]]) -> None:
+        number_of_queued_logs = len(batch)
+        if not batch:
+            return
+        dropped = self.queue.dropped
+        if dropped > self._reported_drops:
+            batch.append({"msg": f"Dropped {dropped - self._reported_drops} logs, because the log queue was full "
+                                 f"(max_queue_size={self.queue.max_size})",
+                          "log_type": LogTypeLiteral.WARNING.value,
+                          "status": self.runstatus,
+                          "progress": self.progress})
+            self._reported_drops = dropped
+        failure_report = None
+        if self._send_failure is not None:
+            failure_report = {"msg": self._send_failure,
+                              "log_type": LogTypeLiteral.WARNING.value,
+                              "status": self.runstatus,
+                              "progress": self.progress}
+            batch.append(failure_report)
+        try:
+            self.po_api.stream_logs_batch(batch)
+            self._send_failure = None
+        except Exception as e:
+            # If sending fails, retry the logs (up to max_send_retries times) and report it with the next batch
+            retried = [log for log in batch
+                       if (log is not failure_report) and (log.get("retries", 0) < self.max_send_retries)]
+            for log in retried:
+                log["retries"] = log.get("retries", 0) + 1
+            self.queue.requeue(retried)
+            self._send_failure = f"Failed to send {len(batch)} logs to POAPI ({len(retried)} re-queued): {repr(e)}"
+        finally:
+            self.queue.task_done(number_of_queued_logs)
 
 
 class JsonFormatter(logging.Formatter):
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+from httpx import Headers
+
+
+# The cache is disabled unless a directory is configured through environment variables or configure_response_cache()
+_CACHE_SETTINGS = {
+    'directory': os.getenv('FLAME_DATA_CACHE_DIR') or None,
+    'max_bytes': int(os.getenv('FLAME_DATA_CACHE_MAX_BYTES', 1024 ** 3)),
+}
+
+_CACHE_LOCK = threading.Lock()
+# headers describing the transferred rather than the (decoded) stored body
+_TRANSFER_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+_RESPONSE_CACHE: Optional['ResponseCache'] = None
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of data source responses (FHIR bundles and S3 objects), bounded in size with least
+    recently used eviction.
+
+    Each response is stored as a body file (decoded) and a json file of metadata (its headers, without those describing
+    the transfer encoding, the validators ETag and Last-Modified, its size and time of storage), both named after the
+    sha256 of the source, kind and query (or key) of the request. Only responses carrying validators are stored, so that
+    every use can be revalidated with a conditional request. Hits only update the time of last use in memory, the
+    metadata files are not rewritten.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # cache key -> metadata, loaded from the directory on first use
+        self._entries: Optional[dict[str, dict[str, Any]]] = None
+
+    @staticmethod
+    def key(source_name: str, kind: str, query: str) -> str:
+        return hashlib.sha256(f"{source_name}\n{kind}\n{query}".encode('utf-8')).hexdigest()
+
+    def conditional_headers(self, key: str) -> dict[str, str]:
+        """
+        Returns the headers revalidating the cached response of the given key
+        :param key: the cache key
+        :return: If-None-Match and/or If-Modified-Since headers, empty if the key is not cached
+        """
+        with self._lock:
+            meta = self._load_entries().get(key)
+        if meta is None:
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def read(self, key: str) -> Optional[tuple[bytes, list[tuple[str, str]]]]:
+        """
+        Reads the cached body of the given key and marks it as recently used
+        :param key: the cache key
+        :return: the body and the headers of the cached response, or None if the key is not cached (anymore)
+        """
+        with self._lock:
+            meta = self._load_entries().get(key)
+            if meta is None:
+                return None
+            meta['last_access'] = time.time()
+        try:
+            with open(self._body_path(key), 'rb') as file:
+                body = file.read()
+        except OSError:
+            body = None
+        if (body is None) or (len(body) != meta['size']):
+            self.remove(key)
+            return None
+        return body, [tuple(header) for header in meta.get('headers', [])]
+
+    def store(self, key: str, body: bytes, headers: Headers) -> bool:
+        """
+        Stores a response, if it carries a validator and fits into the cache, evicting the least recently used
+        responses as needed
+        :param key: the cache key
+        :param body: the (decoded) response body
+        :param headers: the response headers
+        :return: whether the response was stored
+        """
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if not (etag or last_modified) or (len(body) > self.max_bytes):
+            return False
+        meta = {'etag': etag,
+                'last_modified': last_modified,
+                'headers': [(name, value) for name, value in headers.multi_items()
+                            if name.lower() not in _TRANSFER_HEADERS],
+                'size': len(body),
+                'last_access': time.time()}
+        with self._lock:
+            entries = self._load_entries()
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_atomic(self._body_path(key), body)
+            self._write_meta(key, meta)
+            entries[key] = meta
+            self._evict(entries)
+        return True
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._load_entries().pop(key, None)
+            for path in (self._body_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(meta['size'] for meta in self._load_entries().values())
+
+    def _evict(self, entries: dict[str, dict[str, Any]]) -> None:
+        total_size = sum(meta['size'] for meta in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+            if total_size <= self.max_bytes:
+                break
+            total_size -= entries.pop(key)['size']
+            for path in (self._body_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _load_entries(self) -> dict[str, dict[str, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isdir(self.directory):
+                for filename in os.listdir(self.directory):
+                    if not filename.endswith('.meta.json'):
+                        continue
+                    key = filename[:-len('.meta.json')]
+                    try:
+                        with open(self._meta_path(key), 'r', encoding='utf-8') as file:
+                            meta = json.load(file)
+                        if os.path.getsize(self._body_path(key)) == meta['size']:
+                            self._entries[key] = meta
+                    except (OSError, ValueError, KeyError):
+                        continue
+        return self._entries
+
+    def _write_meta(self, key: str, meta: dict[str, Any]) -> None:
+        self._write_atomic(self._meta_path(key), json.dumps(meta).encode('utf-8'))
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.body")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.meta.json")
+
+
+def configure_response_cache(directory: Optional[str] = None, max_bytes: Optional[int] = None) -> None:
+    """
+    Updates the settings of the on-disk response cache of the data sources.
+    :param directory: the cache directory (an empty string disables the cache)
+    :param max_bytes: the maximum total size of the cached response bodies
+    :return:
+    """
+    global _RESPONSE_CACHE
+    with _CACHE_LOCK:
+        if directory is not None:
+            _CACHE_SETTINGS['directory'] = directory or None
+        if max_bytes is not None:
+            _CACHE_SETTINGS['max_bytes'] = max_bytes
+        _RESPONSE_CACHE = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the shared response cache, or None if no cache directory is configured.
+    :return:
+    """
+    global _RESPONSE_CACHE
+    with _CACHE_LOCK:
+        if (_RESPONSE_CACHE is None) and _CACHE_SETTINGS['directory']:
+            _RESPONSE_CACHE = ResponseCache(_CACHE_SETTINGS['directory'], _CACHE_SETTINGS['max_bytes'])
+        return _RESPONSE_CACHE
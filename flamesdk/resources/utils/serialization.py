@@ -0,0 +1,418 @@
+import ast
+import importlib
+import pickle
+import struct
+import time
+import zlib
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional, Union
+
+from flamesdk.resources.utils.constants import LogTypeLiteral
+
+if TYPE_CHECKING:
+    from flamesdk.resources.utils.logging import FlameLogger
+
+
+# Framed payloads start with MAGIC, followed by the frame version, the length of the whole (padded) header, the name
+# of the codec and (since version 2) the name of the compression and the uncompressed size of the payload (0 if unknown
+# for uncompressed streamed payloads). Payloads
+# without the magic are plain pickles (as written by earlier versions of the sdk).
+MAGIC = b'FLMS'
+FRAME_VERSION = 2
+_FRAME_PREFIX = struct.Struct('<4sBHB')
+_FRAME_COMPRESSION = struct.Struct('<BQ')
+# payloads (and the buffers within them) start at multiples of this alignment, so that arrays can be viewed in place
+_ALIGNMENT = 64
+
+# payloads below this size are not compressed automatically (not worth the time)
+MIN_COMPRESSION_SIZE = 64 * 1024
+# automatic compression is skipped if a sample of the payload does not shrink below this ratio
+MAX_SAMPLE_COMPRESSION_RATIO = 0.9
+_SAMPLES = 4
+_SAMPLE_SIZE = 16 * 1024
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class Codec:
+    """
+    A named pair of encoder and decoder. The encoder returns the payload as list of bytes-like chunks (avoiding
+    concatenations of large buffers), the decoder receives the payload as memoryview over the received data, and may
+    return objects viewing that memory instead of copying it. Codecs with an accepts predicate are chosen automatically
+    for the objects it accepts.
+    """
+
+    def __init__(self,
+                 name: str,
+                 encode: Callable[[Any], list[BytesLike]],
+                 decode: Callable[[memoryview], Any],
+                 accepts: Optional[Callable[[Any], bool]] = None) -> None:
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.accepts = accepts
+
+
+_CODECS: dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    Registers a codec (replacing a registered codec of the same name)
+    :param codec: the codec
+    :return:
+    """
+    if not (0 < len(codec.name.encode('ascii')) < 256):
+        raise ValueError(f"Invalid codec name '{codec.name}'")
+    _CODECS[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return _CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec '{name}' (registered codecs: {list(_CODECS.keys())})")
+
+
+def select_codec(obj: Any) -> str:
+    """
+    Returns the name of the first registered codec accepting the given object, 'pickle5' if none does
+    :param obj: the object to serialize
+    :return:
+    """
+    for codec in _CODECS.values():
+        if (codec.accepts is not None) and codec.accepts(obj):
+            return codec.name
+    return 'pickle5'
+
+
+def serialize(obj: Any,
+              codec: Optional[str] = None,
+              compression: Optional[str] = None,
+              flame_logger: Optional['FlameLogger'] = None) -> bytes:
+    """
+    Serializes an object into a framed payload
+    :param obj: the object to serialize
+    :param codec: name of the codec to use, chosen by the type of the object if None
+    :param compression: 'auto' (the best available compression, if the payload is large and compressible enough), the
+    name of a compression ('zstd', 'lz4' or 'zlib') to compress in any case, or None
+    :param flame_logger: optional logger reporting compression ratio and time (debug logs)
+    :return: the framed payload
+    """
+    codec = get_codec(codec if codec is not None else select_codec(obj))
+    chunks = codec.encode(obj)
+    size = sum(memoryview(chunk).nbytes for chunk in chunks)
+    automatic = compression == 'auto'
+    compression = _choose_compression(chunks, size, compression)
+    if compression is None:
+        return b''.join([_frame_header(codec.name, None, size)] + chunks)
+
+    start = time.perf_counter()
+    compressed = _COMPRESSIONS[compression][1](chunks)
+    if automatic and (len(compressed) >= size):
+        # the sample was misleading, the payload is sent as is
+        return b''.join([_frame_header(codec.name, None, size)] + chunks)
+    if flame_logger is not None:
+        flame_logger.new_log(f"Compressed {codec.name} payload with {compression}: {size} -> {len(compressed)} bytes "
+                             f"(ratio {len(compressed) / max(size, 1):.3f}) in {time.perf_counter() - start:.3f}s",
+                             log_type=LogTypeLiteral.DEBUG.value)
+    return _frame_header(codec.name, compression, size) + compressed
+
+
+def deserialize(data: BytesLike, flame_logger: Optional['FlameLogger'] = None, writable: bool = True) -> Any:
+    """
+    Deserializes a framed payload with the codec (and decompression) named in its header, or a plain pickle (payloads
+    without header)
+    :param data: the received data
+    :param flame_logger: optional logger reporting decompression time (debug logs)
+    :param writable: whether decoded arrays have to be writable, i.e. a read-only payload (like response bytes) is
+    copied once into a writable buffer which the arrays view. If False, arrays view the given data directly (zero-copy)
+    and are read-only unless the data is writable
+    :return: the deserialized object
+    """
+    view = memoryview(data).cast('B')
+    if view[:len(MAGIC)] != MAGIC:
+        return pickle.loads(view)
+    codec_name, compression, size, header_size = read_frame_header(view)
+    payload = view[header_size:]
+    if compression is not None:
+        start = time.perf_counter()
+        payload = memoryview(_COMPRESSIONS[compression][2](payload, size))
+        if flame_logger is not None:
+            flame_logger.new_log(f"Decompressed {codec_name} payload with {compression}: {len(view) - header_size} -> "
+                                 f"{size} bytes in {time.perf_counter() - start:.3f}s",
+                                 log_type=LogTypeLiteral.DEBUG.value)
+    if writable and payload.readonly:
+        payload = memoryview(bytearray(payload))
+    return get_codec(codec_name).decode(payload)
+
+
+def read_frame_header(view: memoryview) -> tuple[str, Optional[str], int, int]:
+    """
+    Reads the header of a framed payload
+    :param view: the framed payload
+    :return: the names of the codec and of the compression (None if uncompressed), the uncompressed size of the
+    payload and the size of the header
+    """
+    magic, version, header_size, name_length = _FRAME_PREFIX.unpack_from(view)
+    if version > FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version} (supported up to {FRAME_VERSION})")
+    offset = _FRAME_PREFIX.size
+    codec_name = bytes(view[offset:offset + name_length]).decode('ascii')
+    if version < 2:
+        return codec_name, None, len(view) - header_size, header_size
+    offset += name_length
+    compression_length, size = _FRAME_COMPRESSION.unpack_from(view, offset)
+    offset += _FRAME_COMPRESSION.size
+    compression = bytes(view[offset:offset + compression_length]).decode('ascii') or None
+    if (compression is not None) and (compression not in _COMPRESSIONS):
+        raise ValueError(f"Unknown compression '{compression}'")
+    return codec_name, compression, size, header_size
+
+
+def stream_frame_header(codec_name: str) -> bytes:
+    """
+    Returns the frame header of an uncompressed payload streamed after it (of unknown size, recorded as 0)
+    :param codec_name: name of the codec of the payload
+    :return:
+    """
+    return _frame_header(get_codec(codec_name).name, None, 0)
+
+
+def _frame_header(codec_name: str, compression: Optional[str], size: int) -> bytes:
+    name = codec_name.encode('ascii')
+    compression = (compression or '').encode('ascii')
+    header = (_FRAME_PREFIX.pack(MAGIC, FRAME_VERSION, 0, len(name)) + name
+              + _FRAME_COMPRESSION.pack(len(compression), size) + compression)
+    header_size = _aligned(len(header))
+    return (_FRAME_PREFIX.pack(MAGIC, FRAME_VERSION, header_size, len(name))
+            + header[_FRAME_PREFIX.size:].ljust(header_size - _FRAME_PREFIX.size, b'\0'))
+
+
+def _aligned(size: int) -> int:
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _padding(size: int) -> bytes:
+    return b'\0' * (_aligned(size) - size)
+
+
+def _import_optional(package_name: str, codec_name: str) -> Any:
+    try:
+        return importlib.import_module(package_name)
+    except ImportError:
+        raise ImportError(f"Codec '{codec_name}' requires the package '{package_name}' "
+                          f"(install it with 'pip install {package_name}')")
+
+
+def _is_instance_of(obj: Any, module_name: str, class_names: tuple[str, ...]) -> bool:
+    # checks the type without importing the (optional) module of the class
+    return any((cls.__module__.split('.')[0] == module_name) and (cls.__name__ in class_names)
+               for cls in type(obj).__mro__)
+
+
+######################################## pickle5 ########################################
+# pickle (protocol 5) with out-of-band buffers: header of the number of buffers, the length of the pickle and of each
+# buffer, followed by the pickle and the buffers, each padded to the alignment. Decoding hands the buffers to pickle as
+# memoryviews of the payload, so that e.g. numpy arrays are reconstructed as views over the received data.
+_PICKLE5_COUNT = struct.Struct('<I')
+_PICKLE5_LENGTH = struct.Struct('<Q')
+
+
+def _encode_pickle5(obj: Any) -> list[BytesLike]:
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+    header = _PICKLE5_COUNT.pack(len(raw_buffers)) + b''.join(_PICKLE5_LENGTH.pack(length)
+                                                              for length in [len(data)] + [b.nbytes
+                                                                                           for b in raw_buffers])
+    chunks = [header, _padding(len(header)), data, _padding(len(data))]
+    for buffer in raw_buffers:
+        chunks += [buffer, _padding(buffer.nbytes)]
+    return chunks
+
+
+def _decode_pickle5(view: memoryview) -> Any:
+    number_of_buffers, = _PICKLE5_COUNT.unpack_from(view)
+    lengths = [_PICKLE5_LENGTH.unpack_from(view, _PICKLE5_COUNT.size + i * _PICKLE5_LENGTH.size)[0]
+               for i in range(number_of_buffers + 1)]
+    offset = _aligned(_PICKLE5_COUNT.size + len(lengths) * _PICKLE5_LENGTH.size)
+    slices = []
+    for length in lengths:
+        slices.append(view[offset:offset + length])
+        offset += _aligned(length)
+    return pickle.loads(slices[0], buffers=slices[1:])
+
+
+######################################## npy ########################################
+# a single numpy array in the .npy format, decoded as view over the received data
+def _accepts_npy(obj: Any) -> bool:
+    # plain arrays only (subclasses like masked arrays would lose their extra state)
+    return (type(obj).__module__ == 'numpy') and (type(obj).__name__ == 'ndarray') and not obj.dtype.hasobject
+
+
+def _encode_npy(array: Any) -> list[BytesLike]:
+    np = _import_optional('numpy', 'npy')
+    if not isinstance(array, np.ndarray) or array.dtype.hasobject:
+        raise ValueError("Codec 'npy' only supports numpy arrays without python objects")
+    fortran_order = array.flags.f_contiguous and not array.flags.c_contiguous
+    if not (fortran_order or array.flags.c_contiguous):
+        array = np.ascontiguousarray(array)
+    header = {'descr': np.lib.format.dtype_to_descr(array.dtype),
+              'fortran_order': fortran_order,
+              'shape': array.shape}
+    # same header layout as np.save (version 1.0, padded so that the data starts at a multiple of 64 bytes)
+    header_repr = repr(header).encode('latin1')
+    header_length = _aligned(10 + len(header_repr) + 1) - 10
+    prefix = b'\x93NUMPY\x01\x00' + struct.pack('<H', header_length) + header_repr.ljust(header_length - 1) + b'\n'
+    return [prefix, memoryview(array.reshape(-1, order='F' if fortran_order else 'C')).cast('B')]
+
+
+def _decode_npy(view: memoryview) -> Any:
+    np = _import_optional('numpy', 'npy')
+    if bytes(view[:6]) != b'\x93NUMPY':
+        raise ValueError("Invalid npy payload")
+    if view[6] == 1:
+        header_length, = struct.unpack_from('<H', view, 8)
+        header_start = 10
+    else:
+        header_length, = struct.unpack_from('<I', view, 8)
+        header_start = 12
+    header = ast.literal_eval(bytes(view[header_start:header_start + header_length]).decode('latin1'))
+    dtype = np.lib.format.descr_to_dtype(header['descr'])
+    count = 1
+    for dim in header['shape']:
+        count *= dim
+    array = np.frombuffer(view, dtype=dtype, count=count, offset=header_start + header_length)
+    return array.reshape(header['shape'], order='F' if header['fortran_order'] else 'C')
+
+
+######################################## arrow ########################################
+# arrow tables (and record batches) in the arrow IPC stream format, decoded with buffers viewing the received data
+def _accepts_arrow(obj: Any) -> bool:
+    return _is_instance_of(obj, 'pyarrow', ('Table', 'RecordBatch'))
+
+
+def _encode_arrow(table: Any) -> list[BytesLike]:
+    pa = _import_optional('pyarrow', 'arrow')
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    elif not isinstance(table, pa.Table):
+        raise ValueError("Codec 'arrow' only supports pyarrow tables and record batches")
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return [memoryview(sink.getvalue())]
+
+
+def _decode_arrow(view: memoryview) -> Any:
+    pa = _import_optional('pyarrow', 'arrow')
+    with pa.ipc.open_stream(pa.py_buffer(view)) as reader:
+        return reader.read_all()
+
+
+######################################## msgpack ########################################
+# plain data (dicts, lists, strings, numbers, bytes) in the msgpack format, only used if requested explicitly
+def _encode_msgpack(obj: Any) -> list[BytesLike]:
+    msgpack = _import_optional('msgpack', 'msgpack')
+    return [msgpack.packb(obj, use_bin_type=True)]
+
+
+def _decode_msgpack(view: memoryview) -> Any:
+    msgpack = _import_optional('msgpack', 'msgpack')
+    return msgpack.unpackb(view, raw=False)
+
+
+register_codec(Codec('npy', _encode_npy, _decode_npy, accepts=_accepts_npy))
+register_codec(Codec('arrow', _encode_arrow, _decode_arrow, accepts=_accepts_arrow))
+register_codec(Codec('pickle5', _encode_pickle5, _decode_pickle5))
+register_codec(Codec('msgpack', _encode_msgpack, _decode_msgpack))
+# bytes as they are (e.g. streamed files), only used if requested explicitly
+register_codec(Codec('raw', lambda data: [memoryview(data).cast('B')], lambda view: bytes(view)))
+
+
+######################################## compression ########################################
+# compression of the whole payload (after the frame header): name -> (package, compress, decompress), in order of
+# preference for automatic compression. compress receives the payload's chunks (avoiding their concatenation),
+# decompress the compressed payload and its uncompressed size.
+def _zlib_compress(chunks: list[BytesLike]) -> bytes:
+    compressor = zlib.compressobj(6)
+    return b''.join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
+
+
+def _zlib_decompress(data: memoryview, size: int) -> bytes:
+    return zlib.decompress(data, bufsize=max(size, 1))
+
+
+def _zstd_compress(chunks: list[BytesLike]) -> bytes:
+    compressor = _import_optional('zstandard', 'zstd').ZstdCompressor(level=3).compressobj()
+    return b''.join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
+
+
+def _zstd_decompress(data: memoryview, size: int) -> bytes:
+    return _import_optional('zstandard', 'zstd').ZstdDecompressor().decompress(data, max_output_size=size)
+
+
+def _lz4_compress(chunks: list[BytesLike]) -> bytes:
+    lz4_frame = _import_optional('lz4.frame', 'lz4')
+    with lz4_frame.LZ4FrameCompressor() as compressor:
+        return b''.join([compressor.begin()] + [compressor.compress(chunk) for chunk in chunks]
+                        + [compressor.flush()])
+
+
+def _lz4_decompress(data: memoryview, size: int) -> bytes:
+    return _import_optional('lz4.frame', 'lz4').decompress(data)
+
+
+_COMPRESSIONS: dict[str, tuple[str, Callable[[list[BytesLike]], bytes], Callable[[memoryview, int], bytes]]] = {
+    'zstd': ('zstandard', _zstd_compress, _zstd_decompress),
+    'lz4': ('lz4.frame', _lz4_compress, _lz4_decompress),
+    'zlib': ('zlib', _zlib_compress, _zlib_decompress),
+}
+
+
+def available_compressions() -> list[str]:
+    """
+    Returns the names of the compressions whose packages are installed, in order of preference
+    :return:
+    """
+    available = []
+    for name, (package_name, _, _) in _COMPRESSIONS.items():
+        try:
+            importlib.import_module(package_name)
+            available.append(name)
+        except ImportError:
+            continue
+    return available
+
+
+def _choose_compression(chunks: list[BytesLike], size: int, compression: Optional[str]) -> Optional[str]:
+    if compression is None:
+        return None
+    elif compression != 'auto':
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}' (known compressions: {list(_COMPRESSIONS.keys())})")
+        _import_optional(_COMPRESSIONS[compression][0], compression)
+        return compression
+    elif size < MIN_COMPRESSION_SIZE:
+        return None
+    # compress evenly spaced samples of the payload with the fastest setting, skipping incompressible payloads (e.g.
+    # already compressed images or random floating point data)
+    sample = _sample(chunks, size)
+    if len(zlib.compress(sample, 1)) > MAX_SAMPLE_COMPRESSION_RATIO * len(sample):
+        return None
+    return available_compressions()[0]
+
+
+def _sample(chunks: list[BytesLike], size: int) -> bytes:
+    starts = [i * (size - _SAMPLE_SIZE) // max(_SAMPLES - 1, 1) for i in range(_SAMPLES)]
+    parts, offset = [], 0
+    for chunk in chunks:
+        chunk = memoryview(chunk).cast('B')
+        for start in starts:
+            # the part of each sample that lies within this chunk
+            begin, end = max(start, offset), min(start + _SAMPLE_SIZE, offset + chunk.nbytes)
+            if begin < end:
+                parts.append(chunk[begin - offset:end - offset])
+        offset += chunk.nbytes
+    return b''.join(parts)
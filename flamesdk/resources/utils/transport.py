@@ -0,0 +1,142 @@
+import os
+import threading
+from importlib.util import find_spec
+from typing import Generator, Optional
+
+from httpx import AsyncHTTPTransport, HTTPTransport, Limits, Auth, Request, Response
+
+
+# Pool settings can be overridden through environment variables or configure_transport()
+_TRANSPORT_SETTINGS = {
+    'max_connections': int(os.getenv('FLAME_HTTP_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.getenv('FLAME_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)),
+    'keepalive_expiry': float(os.getenv('FLAME_HTTP_KEEPALIVE_EXPIRY', 30.0)),
+    'http2': os.getenv('FLAME_HTTP2', 'false').lower() in ('1', 'true', 'yes'),
+}
+
+_TRANSPORT_LOCK = threading.Lock()
+_ASYNC_TRANSPORT: Optional[AsyncHTTPTransport] = None
+_SYNC_TRANSPORT: Optional[HTTPTransport] = None
+
+
+def configure_transport(max_connections: Optional[int] = None,
+                        max_keepalive_connections: Optional[int] = None,
+                        keepalive_expiry: Optional[float] = None,
+                        http2: Optional[bool] = None) -> None:
+    """
+    Updates the settings of the shared keep-alive transports. Only clients created afterwards use the new settings.
+    :param max_connections: maximum number of concurrent connections per transport
+    :param max_keepalive_connections: maximum number of idle connections kept open per transport
+    :param keepalive_expiry: time in seconds after which idle connections are closed
+    :param http2: whether to speak HTTP/2 (prior knowledge) to nginx, requires the optional 'h2' package
+    :return:
+    """
+    global _ASYNC_TRANSPORT, _SYNC_TRANSPORT
+    with _TRANSPORT_LOCK:
+        for key, value in (('max_connections', max_connections),
+                           ('max_keepalive_connections', max_keepalive_connections),
+                           ('keepalive_expiry', keepalive_expiry),
+                           ('http2', http2)):
+            if value is not None:
+                _TRANSPORT_SETTINGS[key] = value
+        _ASYNC_TRANSPORT, _SYNC_TRANSPORT = None, None
+
+
+def get_pool_limits() -> Limits:
+    """
+    Returns the connection pool limits of the shared transports.
+    :return:
+    """
+    return Limits(max_connections=_TRANSPORT_SETTINGS['max_connections'],
+                  max_keepalive_connections=_TRANSPORT_SETTINGS['max_keepalive_connections'],
+                  keepalive_expiry=_TRANSPORT_SETTINGS['keepalive_expiry'])
+
+
+def http2_enabled() -> bool:
+    """
+    Returns whether HTTP/2 is requested and available (i.e. the 'h2' package is installed).
+    :return:
+    """
+    return _TRANSPORT_SETTINGS['http2'] and (find_spec('h2') is not None)
+
+
+def get_async_transport() -> AsyncHTTPTransport:
+    """
+    Returns the keep-alive transport shared by all asynchronous service clients (message broker, kong, hub-adapter).
+    The transport must only be used on the SDK's background event loop.
+    :return:
+    """
+    global _ASYNC_TRANSPORT
+    with _TRANSPORT_LOCK:
+        if _ASYNC_TRANSPORT is None:
+            http2 = http2_enabled()
+            _ASYNC_TRANSPORT = AsyncHTTPTransport(limits=get_pool_limits(), http1=not http2, http2=http2)
+        return _ASYNC_TRANSPORT
+
+
+def get_sync_transport() -> HTTPTransport:
+    """
+    Returns the keep-alive transport shared by all synchronous service clients (storage, PO).
+    :return:
+    """
+    global _SYNC_TRANSPORT
+    with _TRANSPORT_LOCK:
+        if _SYNC_TRANSPORT is None:
+            http2 = http2_enabled()
+            _SYNC_TRANSPORT = HTTPTransport(limits=get_pool_limits(), http1=not http2, http2=http2)
+        return _SYNC_TRANSPORT
+
+
+class BearerTokenAuth(Auth):
+    def __init__(self, token: Optional[str] = None) -> None:
+        """
+        httpx authentication that injects the current bearer token into every request. Rotating the token is an atomic
+        swap, clients and their connection pools are kept, and requests already in flight keep the token they were
+        sent with.
+        :param token: the initial bearer token
+        """
+        self._token = token
+        self._token_lock = threading.Lock()
+
+    @property
+    def token(self) -> Optional[str]:
+        with self._token_lock:
+            return self._token
+
+    def set_token(self, token: str) -> None:
+        """
+        Replaces the token used for all subsequent requests.
+        :param token: the new bearer token
+        :return:
+        """
+        with self._token_lock:
+            self._token = token
+
+    def auth_flow(self, request: Request) -> Generator[Request, Response, None]:
+        token = self.token
+        if token is not None:
+            request.headers["Authorization"] = f"Bearer {token}"
+        yield request
+
+
+_KEYCLOAK_AUTH = BearerTokenAuth()
+
+
+def get_keycloak_auth(keycloak_token: Optional[str] = None) -> BearerTokenAuth:
+    """
+    Returns the keycloak token authentication shared by all service clients (message broker, hub-adapter, storage, PO).
+    :param keycloak_token: optional token to set before returning
+    :return:
+    """
+    if keycloak_token is not None:
+        _KEYCLOAK_AUTH.set_token(keycloak_token)
+    return _KEYCLOAK_AUTH
+
+
+def set_keycloak_token(keycloak_token: str) -> None:
+    """
+    Rotates the keycloak token for all service clients at once.
+    :param keycloak_token: the new keycloak token
+    :return:
+    """
+    _KEYCLOAK_AUTH.set_token(keycloak_token)
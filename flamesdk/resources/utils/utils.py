@@ -1,11 +1,12 @@
 from httpx import AsyncClient, Timeout, TransportError, HTTPStatusError
-import asyncio
 import time
 import base64
 import json
 
 from flamesdk.resources.utils.logging import FlameLogger
 from flamesdk.resources.utils.constants import LogTypeLiteral
+from flamesdk.resources.utils.event_loop import run_coroutine
+from flamesdk.resources.utils.transport import get_async_transport
 
 
 def wait_until_nginx_online(nginx_name: str, flame_logger: FlameLogger) -> None:
@@ -13,8 +14,8 @@ def wait_until_nginx_online(nginx_name: str, flame_logger: FlameLogger) -> None:
     nginx_is_online = False
     while not nginx_is_online:
         try:
-            client = AsyncClient(base_url=f"http://{nginx_name}")
-            response = asyncio.run(client.get("/healthz", timeout=Timeout(5, connect=60.05, pool=3.05)))
+            client = AsyncClient(base_url=f"http://{nginx_name}", transport=get_async_transport())
+            response = run_coroutine(client.get("/healthz", timeout=Timeout(5, connect=60.05, pool=3.05)))
             try:
                 response.raise_for_status()
                 nginx_is_online = True
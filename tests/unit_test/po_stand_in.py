@@ -0,0 +1,36 @@
+"""
+Local stand-in for the PO service recording the received logs, served on 127.0.0.1 (see the po_server fixtures).
+
+Without batch endpoint, POST /po/stream_logs/batch answers 404. The first `failures` requests answer 500.
+"""
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInPOServer(ThreadingHTTPServer):
+    """Local stand-in for the PO service recording the received logs."""
+    def __init__(self, batch_endpoint: bool = True, failures: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), _POHandler)
+        self.batch_endpoint = batch_endpoint
+        self.failures = failures
+        self.requests: list[tuple[str, object]] = []
+
+
+class _POHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(500)
+        elif (self.path == "/po/stream_logs/batch") and (not self.server.batch_endpoint):
+            self.send_response(404)
+        else:
+            self.server.requests.append((self.path, body))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        pass
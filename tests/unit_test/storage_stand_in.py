@@ -0,0 +1,97 @@
+"""
+Offline stand-in for the storage service, to be mounted as httpx.MockTransport(StorageStandIn().handle).
+
+Implements the intermediate data endpoints: PUT /intermediate (one copy encrypted for one remote node), PUT
+/intermediate/broadcast (one copy encrypted under a content key, which is wrapped for each remote node) and GET
+/intermediate/{id} (the decrypted copy). The "encryption" is a sha256 keystream, standing in for the real ciphers.
+Final results (PUT /final) and local data (PUT /local, GET /local/{id}) are kept as uploaded.
+"""
+import hashlib
+import os
+import uuid
+from email.parser import BytesParser
+from email.policy import default
+
+from httpx import Request, Response
+
+
+def _keystream_xor(key: bytes, data: bytes) -> bytes:
+    stream = b''.join(hashlib.sha256(key + i.to_bytes(8, 'big')).digest() for i in range(len(data) // 32 + 1))
+    return bytes(a ^ b for a, b in zip(data, stream))
+
+
+def _node_key(node_id: str) -> bytes:
+    # stands in for the public key of each remote node
+    return hashlib.sha256(node_id.encode()).digest()
+
+
+class StorageStandIn:
+    def __init__(self, broadcast: bool = True, unsupported_status: int = 404) -> None:
+        self.broadcast = broadcast
+        self.unsupported_status = unsupported_status  # response status of broadcasts, if not supported
+        self.uploads = []  # (path, size of the uploaded file)
+        self.blobs = {}  # blob id -> (encrypted) payload
+        self.copies = {}  # copy id -> (blob id, remote node id, wrapped content key)
+        self.files = []  # (path, filename, form fields, payload, whether the upload was chunked) of each upload
+
+    def stored_bytes(self) -> int:
+        return sum(len(blob) for blob in self.blobs.values()) + sum(len(copy[2]) for copy in self.copies.values())
+
+    def handle(self, request: Request) -> Response:
+        path = request.url.path.split('/storage', 1)[-1]
+        if (request.method == 'PUT') and (path in ('/final', '/local')):
+            fields, payload = self._parse_form(request)
+            self.uploads.append((path, len(payload)))
+            if path == '/final':
+                return Response(200, json={'status': 'success'})
+            self.blobs[f"local-{len(self.blobs)}"] = payload
+            return Response(200, json={'url': f"http://storage/local/local-{len(self.blobs) - 1}"})
+        elif (request.method == 'GET') and path.startswith('/local/') and (path[7:] in self.blobs):
+            return Response(200, content=self.blobs[path[7:]])
+        elif (request.method == 'PUT') and (path == '/intermediate'):
+            fields, payload = self._parse_form(request)
+            self.uploads.append((path, len(payload)))
+            return self._store(payload, fields['remote_node_id'])
+        elif (request.method == 'PUT') and (path == '/intermediate/broadcast'):
+            if not self.broadcast:
+                return Response(self.unsupported_status, json={'detail': 'Not Supported'})
+            fields, payload = self._parse_form(request)
+            self.uploads.append((path, len(payload)))
+            return self._store(payload, *fields['remote_node_ids'])
+        elif (request.method == 'GET') and path.startswith('/intermediate/') and (path[14:] in self.copies):
+            blob_id, node_id, wrapped_key = self.copies[path[14:]]
+            content_key = _keystream_xor(_node_key(node_id), wrapped_key)
+            return Response(200, content=_keystream_xor(content_key, self.blobs[blob_id]))
+        return Response(404, json={'detail': 'Not Found'})
+
+    def _store(self, payload: bytes, *node_ids: str) -> Response:
+        content_key = os.urandom(32)
+        blob_id = str(uuid.uuid4())
+        self.blobs[blob_id] = _keystream_xor(content_key, payload)
+        urls = {}
+        for node_id in node_ids:
+            copy_id = str(uuid.uuid4())
+            self.copies[copy_id] = (blob_id, node_id, _keystream_xor(_node_key(node_id), content_key))
+            urls[node_id] = {'url': f"http://storage/intermediate/{copy_id}"}
+        if len(node_ids) == 1:
+            return Response(200, json=urls[node_ids[0]])
+        return Response(200, json={'results': urls})
+
+    def _parse_form(self, request: Request) -> tuple[dict, bytes]:
+        message = BytesParser(policy=default).parsebytes(b'Content-Type: ' + request.headers['content-type'].encode()
+                                                         + b'\r\n\r\n' + request.read())
+        fields, payload, filename = {}, b'', None
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is not None:
+                payload, filename = part.get_payload(decode=True), part.get_filename()
+            elif name in fields:
+                fields[name] = fields[name] + [part.get_content()] if isinstance(fields[name], list) \
+                    else [fields[name], part.get_content()]
+            else:
+                fields[name] = part.get_content()
+        if ('remote_node_ids' in fields) and not isinstance(fields['remote_node_ids'], list):
+            fields['remote_node_ids'] = [fields['remote_node_ids']]
+        self.files.append((request.url.path.split('/storage', 1)[-1], filename, fields, payload,
+                           request.headers.get('transfer-encoding') == 'chunked'))
+        return fields, payload
@@ -1,10 +1,17 @@
 # Python
+import asyncio
+import json
+import subprocess
+import time
 import pytest
+from urllib.parse import parse_qsl
 from unittest.mock import AsyncMock, patch
 from flamesdk.resources.utils.logging import FlameLogger
-from httpx import AsyncClient
+from httpx import AsyncClient, ConnectError, MockTransport, ReadError, Request, Response
 
-from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient
+from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient, _BundleStreamParser, _read_bundle_head
+from flamesdk.resources.client_apis.data_api import DataAPI
+from flamesdk.resources.utils.fhir import fhir_to_csv
 
 # Dummy response mimicking httpx.Response
 class DummyResponse:
@@ -19,6 +26,15 @@ class DummyResponse:
     def raise_for_status(self):
         pass
 
+def _listing(keys, prefixes=(), next_token=None):
+    return ('<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            + "".join(f"<Contents><Key>{key}</Key><LastModified>2024-01-01T00:00:00.000Z</LastModified>"
+                      f"<ETag>&quot;etag-{key}&quot;</ETag><Size>{len(key)}</Size></Contents>" for key in keys)
+            + "".join(f"<CommonPrefixes><Prefix>{prefix}</Prefix></CommonPrefixes>" for prefix in prefixes)
+            + f"<IsTruncated>{'true' if next_token else 'false'}</IsTruncated>"
+            + (f"<NextContinuationToken>{next_token}</NextContinuationToken>" if next_token else "")
+            + "</ListBucketResult>")
+
 # Dummy async get function to return our DummyResponse instance.
 async def dummy_get(url, **kwargs):
     if url.startswith("/kong/datastore/"):
@@ -28,8 +44,8 @@ async def dummy_get(url, **kwargs):
         # Response for fhir endpoint requests
         return DummyResponse({"result": "fhir-data"})
     elif url.endswith("/s3"):
-        # Response for _get_s3_dataset_names returning a key wrapped in <Key> tags
-        return DummyResponse(text_data="<Key>key1</Key>")
+        # Response for _get_s3_dataset_names returning a ListObjectsV2 listing with a single key
+        return DummyResponse(text_data=_listing(["key1"]))
     elif "/s3/" in url:
         # Response for individual S3 requests
         return DummyResponse(content=b"s3-data")
@@ -49,15 +65,16 @@ def test_refresh_token():
         flame_logger = FlameLogger()
         # Create DataApiClient with initial keycloak_token "key_token"
         client = DataApiClient("proj_id", "nginx", "data_token", "key_token", flame_logger)
-        # Check initial Authorization header in hub_client
-        initial_auth = client.hub_client.headers.get("Authorization")
-        assert initial_auth == "Bearer key_token"
+        hub_client = client.hub_client
+        # Check initial token of hub_client
+        assert hub_client.auth.token == "key_token"
         # Refresh token with a new keycloak token
         new_token = "new_key_token"
         client.refresh_token(new_token)
-        # Verify that the hub_client has been updated with the new token
-        updated_auth = client.hub_client.headers.get("Authorization")
-        assert updated_auth == f"Bearer {new_token}"
+        # Verify that the hub_client has been kept and is updated with the new token
+        assert client.hub_client is hub_client
+        request = next(hub_client.auth.auth_flow(Request("GET", "http://nginx/hub-adapter/")))
+        assert request.headers["Authorization"] == f"Bearer {new_token}"
 
 def test_get_data_fhir():
     fhir_queries = ["query1", "query2"]
@@ -70,6 +87,32 @@ def test_get_data_fhir():
         expected = {"query1": {"result": "fhir-data"}, "query2": {"result": "fhir-data"}}
         assert results == [expected]
 
+def test_get_data_fhir_concurrent():
+    fhir_queries = [f"query{i}" for i in range(5)]
+    in_flight = {"current": 0, "max": 0}
+
+    async def concurrent_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}, {"name": "source2"}]})
+        in_flight["current"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        await asyncio.sleep(0.01)
+        in_flight["current"] -= 1
+        if url == "source2/fhir/query3":
+            raise ConnectError("connection refused")
+        return DummyResponse({"url": url})
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=concurrent_get)):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger(), max_concurrency=3)
+        results = client.get_data(fhir_queries=fhir_queries)
+
+    # requests overlap, but never more than max_concurrency at once
+    assert in_flight["max"] == 3
+    # one dict per source in query order, the failed query is only missing for its source
+    assert results[0] == {query: {"url": f"source1/fhir/{query}"} for query in fhir_queries}
+    assert list(results[1].keys()) == ["query0", "query1", "query2", "query4"]
+
 def test_get_data_s3():
     s3_keys = ["key1"]
     with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get", new=AsyncMock(side_effect=dummy_get)):
@@ -81,6 +124,72 @@ def test_get_data_s3():
         expected = {"key1": b"s3-data"}
         assert results == [expected]
 
+def _s3_client(in_flight, objects):
+    async def chunked(data):
+        in_flight["current"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        await asyncio.sleep(0.01)
+        for start in range(0, len(data), 4):
+            yield data[start:start + 4]
+        in_flight["current"] -= 1
+
+    def handler(request):
+        if request.url.path.endswith("/kong/datastore/proj_id"):
+            return Response(200, json={"data": [{"name": "source1"}]})
+        if request.url.path.endswith("/s3"):
+            return Response(200, text=_listing([key for key in objects
+                                                if key.startswith(request.url.params.get("prefix", ""))]))
+        return Response(200, content=chunked(objects[request.url.path.split("/s3/", 1)[1]]))
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.get_async_transport",
+               return_value=MockTransport(handler)):
+        return DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger(), max_concurrency=2)
+
+
+def test_get_data_s3_concurrent():
+    in_flight = {"current": 0, "max": 0}
+    objects = {f"key{i}": f"object-{i}".encode() * 3 for i in range(5)}
+    client = _s3_client(in_flight, objects)
+    results = client.get_data(s3_keys=[])
+    assert results == [objects]
+    assert list(results[0].keys()) == list(objects.keys())
+    assert in_flight["max"] == 2
+
+
+def test_get_data_s3_spill_dir(tmp_path):
+    objects = {"images/scan1.dcm": b"x" * 37, "images/scan2.dcm": b"y" * 11}
+    client = _s3_client({"current": 0, "max": 0}, objects)
+    results = client.get_data(s3_keys=["images/scan2.dcm"], spill_dir=str(tmp_path))
+    path = tmp_path / "source1" / "images" / "scan2.dcm"
+    assert results == [{"images/scan2.dcm": str(path)}]
+    assert path.read_bytes() == b"y" * 11
+    assert [p.name for p in path.parent.iterdir()] == ["scan2.dcm"]
+
+
+def test_iter_s3_objects_follows_continuation_tokens():
+    requests = []
+
+    def handler(request):
+        if request.url.path.endswith("/kong/datastore/proj_id"):
+            return Response(200, json={"data": [{"name": "source1"}]})
+        params = dict(request.url.params)
+        requests.append(params)
+        if "continuation-token" not in params:
+            return Response(200, text=_listing(["data/a.csv", "data/b.csv"], next_token="token-1"))
+        return Response(200, text=_listing(["data/c.csv"], prefixes=["data/images/"]))
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.get_async_transport",
+               return_value=MockTransport(handler)):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+    listing = list(client.iter_s3_objects("source1", prefix="data/", delimiter="/"))
+    assert listing[0] == {"key": "data/a.csv", "size": 10, "etag": '"etag-data/a.csv"',
+                          "last_modified": "2024-01-01T00:00:00.000Z"}
+    assert [o if isinstance(o, str) else o["key"] for o in listing] == ["data/a.csv", "data/b.csv", "data/c.csv",
+                                                                         "data/images/"]
+    assert requests == [{"list-type": "2", "prefix": "data/", "delimiter": "/"},
+                        {"list-type": "2", "prefix": "data/", "delimiter": "/", "continuation-token": "token-1"}]
+
+
 @pytest.fixture
 def dummy_sources(monkeypatch):
     sources = [
@@ -105,4 +214,375 @@ def test_get_data_source_client_success(client):
 def test_get_data_source_client_not_found(client):
     with pytest.raises(ValueError) as exc_info:
         client.get_data_source_client("invalid_id")
-    assert "Data source with id invalid_id not found" in str(exc_info.value)
\ No newline at end of file
+    assert "Data source with id invalid_id not found" in str(exc_info.value)
+
+def _paged_get(requested_urls, number_of_pages=4):
+    async def paged_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}, {"name": "source2"}]})
+        requested_urls.append(url)
+        source_name, query = url.split("/fhir/")
+        page = int(query.split("page=")[-1]) if "page=" in query else 0
+        bundle = {"id": f"{source_name}-bundle-{page}",
+                  "total": number_of_pages,
+                  "entry": [{"resource": {"code": {"coding": [{"code": f"c{page}"}]},
+                                          "subject": {"reference": "patient"},
+                                          "valueQuantity": {"value": page}}}],
+                  "link": []}
+        if page < number_of_pages - 1:
+            bundle["link"].append({"relation": "next",
+                                   "url": f"http://fhir-server/fhir/Observation?page={page + 1}"})
+        return DummyResponse(bundle)
+    return paged_get
+
+
+def test_iter_fhir_pages_pinned_to_source():
+    requested_urls = []
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=_paged_get(requested_urls))):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        first_pages = client.get_data(fhir_queries=["Observation"])
+        assert client.get_bundle_source(first_pages[1]["Observation"]) == "source2"
+
+        pages = list(client.iter_fhir_pages("source2", "Observation?page=1", prefetch=2))
+
+    assert [page["id"] for page in pages] == ["source2-bundle-1", "source2-bundle-2", "source2-bundle-3"]
+    # the follow-up pages are only requested from the source that produced the bundle
+    assert requested_urls[2:] == [f"source2/fhir/Observation?page={i}" for i in range(1, 4)]
+
+
+def test_iter_fhir_pages_read_ahead_is_bounded():
+    requested_urls = []
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=_paged_get(requested_urls, number_of_pages=10))):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        pages = client.iter_fhir_pages("source1", "Observation", prefetch=2)
+        next(pages)
+        time.sleep(0.2)
+        # one page consumed, two queued, at most one more waiting to be queued
+        assert len(requested_urls) <= 4
+        pages.close()
+
+
+def test_bundle_sources_are_bounded(monkeypatch):
+    monkeypatch.setattr("flamesdk.resources.client_apis.clients.data_api_client.MAX_REMEMBERED_BUNDLES", 3)
+    requested_urls = []
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=_paged_get(requested_urls, number_of_pages=6))):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        pages = list(client.iter_fhir_pages("source2", "Observation?page=0", prefetch=2))
+    assert len(client._bundle_sources) == 3
+    assert [client.get_bundle_source(page) for page in pages] == [None] * 3 + ["source2"] * 3
+
+
+def test_iter_fhir_pages_failing_page_ends_iteration():
+    requested_urls = []
+    paged_get = _paged_get(requested_urls)
+
+    async def failing_get(url, **kwargs):
+        if url.endswith("page=2"):
+            raise ReadError("connection reset")
+        return await paged_get(url, **kwargs)
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=failing_get)):
+        client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        with patch.object(client.flame_logger, "raise_error") as raise_error:
+            pages = list(client.iter_fhir_pages("source1", "Observation?page=1", prefetch=2))
+
+    assert [page["id"] for page in pages] == ["source1-bundle-1"]
+    assert "ReadError" in raise_error.call_args[0][0]
+
+
+def test_fhir_to_csv_follows_pages_of_source():
+    requested_urls = []
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=_paged_get(requested_urls))):
+        flame_logger = FlameLogger()
+        data_api = DataAPI.__new__(DataAPI)
+        data_api.data_client = DataApiClient("proj_id", "nginx", "data_token", "key_token", flame_logger)
+        fhir_data = data_api.get_fhir_data(["Observation"])[0]["Observation"]
+
+        result = fhir_to_csv(fhir_data,
+                             col_key_seq="resource.code.coding.code",
+                             value_key_seq="resource.valueQuantity.value",
+                             input_resource="Observation",
+                             flame_logger=flame_logger,
+                             row_key_seq="resource.subject.reference",
+                             output_type="dict",
+                             data_client=data_api)
+
+    assert result == {f"c{i}": {"patient": i} for i in range(4)}
+    assert all(url.startswith("source1/") for url in requested_urls[2:])
+
+
+def test_bundle_stream_parser_chunked():
+    bundle = {"resourceType": "Bundle",
+              "id": "bundle-1",
+              "total": 12345,
+              "link": [{"relation": "next", "url": "http://fhir-server/fhir/Observation?page=1"}],
+              "entry": [{"resource": {"id": str(i), "value": i * 1.5, "text": "äö \"quoted\" ]}"}} for i in range(200)],
+              "meta": {"tag": [1, 2]}}
+    data = json.dumps(bundle, ensure_ascii=False).encode("utf-8")
+    for chunk_size in (1, 7, 4096, len(data)):
+        parser = _BundleStreamParser()
+        entries = []
+        for start in range(0, len(data), chunk_size):
+            entries.extend(parser.feed(data[start:start + chunk_size]))
+        entries.extend(parser.close())
+        assert entries == bundle["entry"]
+        assert parser.bundle == {key: value for key, value in bundle.items() if key != "entry"}
+
+    with pytest.raises(ValueError):
+        parser = _BundleStreamParser()
+        parser.feed(data[:-10])
+        parser.close()
+
+
+def _streaming_client(number_of_pages=3, entries_per_page=50, failing_page=None):
+    def bundle(page):
+        result = {"id": f"source1-bundle-{page}",
+                  "total": number_of_pages * entries_per_page,
+                  "entry": [{"resource": {"code": {"coding": [{"code": f"c{j % 5}"}]},
+                                          "subject": {"reference": f"Patient/{page}-{j // 5}"},
+                                          "valueQuantity": {"value": page * 1000 + j}}}
+                            for j in range(entries_per_page)],
+                  "link": []}
+        if page < number_of_pages - 1:
+            result["link"].append({"relation": "next", "url": f"http://fhir-server/fhir/Observation?page={page + 1}"})
+        return result
+
+    async def chunked(data, fail=False):
+        for start in range(0, len(data), 100):
+            if fail and (start >= len(data) // 2):
+                raise ReadError("connection reset")
+            yield data[start:start + 100]
+
+    def handler(request):
+        if request.url.path.endswith("/kong/datastore/proj_id"):
+            return Response(200, json={"data": [{"name": "source1"}]})
+        page = int(request.url.params.get("page", 0))
+        return Response(200, content=chunked(json.dumps(bundle(page)).encode(), fail=page == failing_page))
+
+    transport = MockTransport(handler)
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.get_async_transport", return_value=transport):
+        return DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger()), bundle
+
+
+def test_iter_fhir_page_streams():
+    client, bundle = _streaming_client()
+    pages = []
+    for page in client.iter_fhir_page_streams("source1", "Observation?page=1", read_ahead=2):
+        entries = list(page)
+        pages.append((entries, page.bundle["id"]))
+    assert pages == [(bundle(1)["entry"], "source1-bundle-1"), (bundle(2)["entry"], "source1-bundle-2")]
+    assert client.get_bundle_source({"id": "source1-bundle-2"}) == "source1"
+
+
+def test_iter_fhir_page_streams_failing_page_ends_iteration():
+    client, bundle = _streaming_client(failing_page=2)
+    pages = []
+    with patch.object(client.flame_logger, "raise_error") as raise_error:
+        for page in client.iter_fhir_page_streams("source1", "Observation?page=1", read_ahead=2):
+            pages.append((len(list(page)), page.bundle))
+    assert pages[0] == (50, {key: value for key, value in bundle(1).items() if key != "entry"})
+    # the failing page ends after the entries streamed before the error, without its remaining fields
+    assert (len(pages) == 2) and (pages[1][0] < 50) and (pages[1][1] is None)
+    assert "ReadError" in raise_error.call_args[0][0]
+
+
+def test_fhir_to_csv_stream_entries_matches_pages():
+    client, _ = _streaming_client()
+    data_api = DataAPI.__new__(DataAPI)
+    data_api.data_client = client
+    first_page = data_api.get_fhir_data(["Observation"])[0]["Observation"]
+    outputs = [fhir_to_csv(first_page,
+                           col_key_seq="resource.code.coding.code",
+                           value_key_seq="resource.valueQuantity.value",
+                           input_resource="Observation",
+                           flame_logger=FlameLogger(),
+                           row_key_seq="resource.subject.reference",
+                           data_client=data_api,
+                           stream_entries=stream_entries).read()
+               for stream_entries in (False, True)]
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].split("\n")) == 1 + 3 * 10
+
+
+def test_fhir_to_csv_workers_match_serial():
+    client, _ = _streaming_client(number_of_pages=7, entries_per_page=40)
+    data_api = DataAPI.__new__(DataAPI)
+    data_api.data_client = client
+    first_page = data_api.get_fhir_data(["Observation"])[0]["Observation"]
+    for output_type, row_id_filters in (("file", None), ("dict", None), ("file", ["Patient/3-", "Patient/5-1"])):
+        outputs = []
+        for workers in (1, 3):
+            with patch("flamesdk.resources.utils.fhir.subprocess.Popen", wraps=subprocess.Popen) as popen:
+                output = fhir_to_csv(first_page,
+                                     col_key_seq="resource.code.coding.code",
+                                     value_key_seq="resource.valueQuantity.value",
+                                     input_resource="Observation",
+                                     flame_logger=FlameLogger(),
+                                     row_key_seq="resource.subject.reference",
+                                     row_id_filters=row_id_filters,
+                                     output_type=output_type,
+                                     data_client=data_api,
+                                     workers=workers)
+            assert popen.call_count == (workers if workers > 1 else 0)
+            outputs.append(output.read() if output_type == "file" else output)
+        assert outputs[0] == outputs[1]
+        if output_type == "dict":
+            assert [list(col) for col in outputs[0].values()] == [list(col) for col in outputs[1].values()]
+    assert len(outputs[0].split("\n")) == 1 + 8 + 1
+
+
+def test_read_bundle_head():
+    entries = [{"resource": {"id": str(i)}} for i in range(100)]
+    link = [{"relation": "next", "url": "http://fhir-server/fhir/Observation?page=1"}]
+    # the fields preceding the entries are decoded on their own, entries preceding the link require the whole bundle
+    content = json.dumps({"id": "bundle", "link": link, "entry": entries}).encode()
+    assert _read_bundle_head(content, chunk_size=16) == {"id": "bundle", "link": link}
+    content = json.dumps({"id": "bundle", "entry": entries, "link": link}).encode()
+    assert _read_bundle_head(content, chunk_size=16) == {"id": "bundle", "entry": entries, "link": link}
+
+
+def _fhir_query_data_api(get):
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=get)):
+        data_api = DataAPI.__new__(DataAPI)
+        data_api.data_client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+    return data_api
+
+
+def test_fhir_to_csv_pushdown():
+    requested_urls = []
+
+    async def pushdown_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}]})
+        requested_urls.append(url)
+        # the server ignores the code filter for one entry, which the client-side filter has to catch
+        entries = [{"resource": {"code": {"coding": [{"code": code}]},
+                                 "subject": {"reference": "Patient/1"},
+                                 "valueQuantity": {"value": value}}}
+                   for code, value in (("8310-5", 36.6), ("8867-4", 80))]
+        return DummyResponse({"id": "bundle", "total": 2, "entry": entries, "link": []})
+
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=pushdown_get)):
+        data_api = DataAPI.__new__(DataAPI)
+        data_api.data_client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        result = fhir_to_csv("Observation?_count=100",
+                             col_key_seq="resource.code.coding.code",
+                             value_key_seq="resource.valueQuantity.value",
+                             input_resource="Observation",
+                             flame_logger=FlameLogger(),
+                             row_key_seq="resource.subject.reference",
+                             col_id_filters=["8310-5"],
+                             output_type="dict",
+                             data_client=data_api,
+                             pushdown=True,
+                             exact_filters=True)
+
+    assert requested_urls == ["source1/fhir/Observation?_count=100&_elements=code,valueQuantity,subject&code=8310-5"]
+    assert result == {"8310-5": {"Patient/1": 36.6}}
+
+
+def test_fhir_to_csv_pushdown_keeps_substring_filters_client_side():
+    requested_urls = []
+
+    async def subject_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}]})
+        requested_urls.append(url)
+        # the server matches the subject search parameter exactly
+        subject = dict(parse_qsl(url.partition("?")[2])).get("subject")
+        entries = [{"resource": {"code": {"coding": [{"code": "8310-5"}]},
+                                 "subject": {"reference": reference},
+                                 "valueQuantity": {"value": value}}}
+                   for reference, value in (("Patient/1", 36.6), ("Patient/12", 37.2), ("Patient/2", 38.0))
+                   if subject in (None, reference)]
+        return DummyResponse({"id": "bundle", "total": len(entries), "entry": entries, "link": []})
+
+    data_api = _fhir_query_data_api(subject_get)
+    results = []
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=subject_get)):
+        for exact_filters in (False, True):
+            results.append(fhir_to_csv("Observation",
+                                       col_key_seq="resource.code.coding.code",
+                                       value_key_seq="resource.valueQuantity.value",
+                                       input_resource="Observation",
+                                       flame_logger=FlameLogger(),
+                                       row_key_seq="resource.subject.reference",
+                                       row_id_filters=["Patient/1"],
+                                       output_type="dict",
+                                       data_client=data_api,
+                                       pushdown=True,
+                                       exact_filters=exact_filters))
+
+    # the substring filter is only applied client-side unless the filters are declared exact
+    assert requested_urls == ["source1/fhir/Observation?_elements=code,valueQuantity,subject",
+                              "source1/fhir/Observation?_elements=code,valueQuantity,subject&subject=Patient/1"]
+    assert results[0] == {"8310-5": {"Patient/1": 36.6, "Patient/12": 37.2}}
+    assert results[1] == {"8310-5": {"Patient/1": 36.6}}
+
+
+def test_fhir_to_csv_merges_all_sources():
+    requested_urls = []
+
+    async def source_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}, {"name": "source2"}]})
+        requested_urls.append(url)
+        source_name, query = url.split("/fhir/")
+        page = int(query.split("page=")[-1]) if "page=" in query else 0
+        bundle = {"id": f"{source_name}-bundle-{page}",
+                  "total": 2,
+                  "entry": [{"resource": {"code": {"coding": [{"code": f"c{page}"}]},
+                                          "subject": {"reference": f"{source_name}-patient"},
+                                          "valueQuantity": {"value": page}}}],
+                  "link": []}
+        if page == 0:
+            bundle["link"].append({"relation": "next", "url": "http://fhir-server/fhir/Observation?page=1"})
+        return DummyResponse(bundle)
+
+    data_api = _fhir_query_data_api(source_get)
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=source_get)):
+        result = fhir_to_csv("Observation",
+                             col_key_seq="resource.code.coding.code",
+                             value_key_seq="resource.valueQuantity.value",
+                             input_resource="Observation",
+                             flame_logger=FlameLogger(),
+                             row_key_seq="resource.subject.reference",
+                             output_type="dict",
+                             data_client=data_api)
+
+    assert result == {"c0": {"source1-patient": 0, "source2-patient": 0},
+                      "c1": {"source1-patient": 1, "source2-patient": 1}}
+    # the next page of each bundle is requested from the source that produced it
+    assert sorted(requested_urls[2:]) == ["source1/fhir/Observation?page=1", "source2/fhir/Observation?page=1"]
+
+
+def test_fhir_to_csv_reports_missing_data():
+    async def failing_get(url, **kwargs):
+        if url.startswith("/kong/datastore/"):
+            return DummyResponse({"data": [{"name": "source1"}, {"name": "source2"}]})
+        raise ConnectError("refused", request=Request("GET", url))
+
+    data_api = _fhir_query_data_api(failing_get)
+    flame_logger = FlameLogger()
+    with patch("flamesdk.resources.client_apis.clients.data_api_client.AsyncClient.get",
+               new=AsyncMock(side_effect=failing_get)), \
+            patch.object(flame_logger, "raise_error", side_effect=RuntimeError) as raise_error:
+        with pytest.raises(RuntimeError):
+            fhir_to_csv("Observation",
+                        col_key_seq="resource.code.coding.code",
+                        value_key_seq="resource.valueQuantity.value",
+                        input_resource="Observation",
+                        flame_logger=flame_logger,
+                        row_key_seq="resource.subject.reference",
+                        output_type="dict",
+                        data_client=data_api)
+    assert "No fhir data was returned" in raise_error.call_args[0][0]
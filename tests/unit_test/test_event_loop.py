@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import pytest
+
+from flamesdk.resources.utils.event_loop import get_event_loop, run_coroutine
+
+
+async def _current_loop_and_thread():
+    return asyncio.get_running_loop(), threading.current_thread()
+
+
+def test_run_coroutine_reuses_background_loop():
+    loop_1, thread_1 = run_coroutine(_current_loop_and_thread())
+    loop_2, thread_2 = run_coroutine(_current_loop_and_thread())
+    assert loop_1 is loop_2 is get_event_loop()
+    assert thread_1 is thread_2
+    assert thread_1 is not threading.current_thread()
+    assert loop_1.is_running()
+
+
+def test_run_coroutine_propagates_exceptions():
+    async def fail():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        run_coroutine(fail())
+
+
+def test_run_coroutine_timeout_cancels():
+    cancelled = threading.Event()
+
+    async def sleep_forever():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(Exception):
+        run_coroutine(sleep_forever(), timeout=0.05)
+    assert cancelled.wait(1)
+
+
+def test_run_coroutine_from_loop_thread_raises():
+    async def nested():
+        with pytest.raises(RuntimeError):
+            run_coroutine(asyncio.sleep(0))
+        return True
+
+    assert run_coroutine(nested())
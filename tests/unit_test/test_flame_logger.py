@@ -1,9 +1,15 @@
+import socket
+import threading
+from types import SimpleNamespace
+
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 
-from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.client_apis.po_api import POAPI
+from flamesdk.resources.utils.logging import FlameLogger, LogQueue
 from flamesdk.resources.utils.constants import LogTypeLiteral
+from po_stand_in import StandInPOServer
 
 
 @pytest.fixture
@@ -29,8 +35,86 @@ def test_new_log_without_po_client(flame_logger):
 
 def test_send_logs_from_queue(flame_logger, mock_po_client):
     flame_logger.new_log("Test log message", log_type=LogTypeLiteral.INFO.value)
-    flame_logger.add_po_client(mock_po_client)
+    flame_logger.add_po_api(mock_po_client)
 
     flame_logger.send_logs_from_queue()
     assert flame_logger.queue.empty() == True
 
+
+
+def test_logs_are_shipped_in_batches(mock_po_client):
+    flame_logger = FlameLogger(batch_size=10, flush_interval=0.05)
+    flame_logger.add_po_api(mock_po_client)
+    for i in range(25):
+        flame_logger.new_log(f"log {i}", log_type=LogTypeLiteral.INFO.value)
+    assert flame_logger.flush(timeout=5)
+    shipped = [log["msg"] for call in mock_po_client.stream_logs_batch.call_args_list for log in call.args[0]]
+    assert shipped == [f"log {i}" for i in range(25)]
+    assert all(len(call.args[0]) <= 10 for call in mock_po_client.stream_logs_batch.call_args_list)
+    mock_po_client.stream_logs.assert_not_called()
+
+
+def _log(msg, log_type):
+    return {"msg": msg, "log_type": log_type, "status": "executing", "progress": 0}
+
+
+def test_log_queue_overflow_drops_debug_first_and_keeps_errors():
+    log_queue = LogQueue(max_size=3)
+    log_queue.put(_log("info", LogTypeLiteral.INFO.value))
+    log_queue.put(_log("debug", LogTypeLiteral.DEBUG.value))
+    log_queue.put(_log("error 1", LogTypeLiteral.ERROR.value))
+    log_queue.put(_log("warning", LogTypeLiteral.WARNING.value))  # drops the debug log
+    log_queue.put(_log("error 2", LogTypeLiteral.ERROR.value))  # drops the info log
+    log_queue.put(_log("debug 2", LogTypeLiteral.DEBUG.value))  # dropped itself
+    log_queue.put(_log("error 3", LogTypeLiteral.ERROR.value))  # drops the warning
+    log_queue.put(_log("error 4", LogTypeLiteral.ERROR.value))  # exceeds the limit, errors are never dropped
+    assert log_queue.dropped == 4
+    batch = log_queue.get_batch(10, block=False)
+    assert [log["msg"] for log in batch] == ["error 1", "error 2", "error 3", "error 4"]
+    log_queue.task_done(len(batch))
+    assert log_queue.join(timeout=0)
+
+
+def test_log_queue_overflow_releases_dropped_records():
+    log_queue = LogQueue(max_size=5)
+    for i in range(1000):
+        log_queue.put(_log(f"debug {i}", LogTypeLiteral.DEBUG.value))
+    assert len(log_queue._records) == 5
+    assert log_queue.dropped == 995
+    assert [log["msg"] for log in log_queue.get_batch(10, block=False)] == [f"debug {i}" for i in range(995, 1000)]
+
+
+def _po_api(address):
+    config = SimpleNamespace(nginx_name=f"{address[0]}:{address[1]}", keycloak_token="token", analysis_id="analysis")
+    return POAPI(config, FlameLogger(silent=True), LogTypeLiteral.DEBUG.level)
+
+
+def test_failed_log_batches_are_retried():
+    server = StandInPOServer(failures=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        flame_logger = FlameLogger(max_send_retries=2)
+        flame_logger.po_api = _po_api(server.server_address)
+        flame_logger.new_log("error", log_type=LogTypeLiteral.ERROR.value)
+        flame_logger.new_log("info", log_type=LogTypeLiteral.INFO.value)
+        # the first request fails with 500, the logs are sent again with the report of the failure
+        flame_logger.send_logs_from_queue()
+        assert flame_logger.queue.join(timeout=0)
+        assert len(server.requests) == 1
+        shipped = [log["log"] for log in server.requests[0][1]]
+        assert shipped[:2] == ["error", "info"]
+        assert shipped[2].startswith("Failed to send 2 logs to POAPI (2 re-queued)") and (len(shipped) == 3)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # logs are given up after max_send_retries failed retries (nothing is listening on the port of a closed socket)
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        flame_logger.po_api = _po_api(closed.getsockname())
+    flame_logger.new_log("lost", log_type=LogTypeLiteral.ERROR.value)
+    with patch.object(flame_logger.po_api, "stream_logs_batch", wraps=flame_logger.po_api.stream_logs_batch) as send:
+        flame_logger.send_logs_from_queue()
+    assert [[log["msg"] for log in call.args[0]].count("lost") for call in send.call_args_list] == [1, 1, 1]
+    assert flame_logger._send_failure.startswith("Failed to send 2 logs to POAPI (0 re-queued): ConnectError")
+    assert flame_logger.queue.join(timeout=0)
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+# imported lazily, when the services (or columnar outputs) are used; import timing is left to
+# benchmarks/bench_import_time.py
+HEAVY_MODULES = ('fastapi', 'uvicorn', 'starlette', 'httpx', 'pandas')
+
+
+def test_import_does_not_load_heavy_dependencies():
+    for statement in ("import flamesdk", "from flamesdk import FlameCoreSDK"):
+        result = subprocess.run([sys.executable, '-c',
+                                 f"import sys\n"
+                                 f"{statement}\n"
+                                 f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '', f"'{statement}' loaded {result.stdout.strip()}"
@@ -2,6 +2,8 @@ import os
 import pytest
 import asyncio
 import datetime
+import threading
+import time
 from httpx import Response, Request
 #from asyncmock import AsyncMock
 from flamesdk.resources.client_apis.clients.message_broker_client import MessageBrokerClient, Message
@@ -39,15 +41,21 @@ def client(monkeypatch, dummy_get_self_config):
     monkeypatch.setattr(MessageBrokerClient, "get_self_config", dummy_get_self_config)
     async def fake_connect(self):
         pass
+    async def fake_get_participants(self, analysis_id: str):
+        return [{"nodeId": "test_node", "nodeType": "test_role"}, {"nodeId": "nodeB", "nodeType": "default"}]
     monkeypatch.setattr(MessageBrokerClient, "_connect", fake_connect)
+    monkeypatch.setattr(MessageBrokerClient, "_get_participants", fake_get_participants)
     flame_logger = FlameLogger()
     return MessageBrokerClient(DummyNodeConfig(), flame_logger)
 
 def test_refresh_token(client):
+    http_client = client._message_broker
     new_token = "new_dummy_token"
     client.refresh_token(new_token)
-    updated_auth = client._message_broker.headers.get("Authorization")
-    assert updated_auth == f"Bearer {new_token}"
+    # the token is swapped in place, the client (and its connection pool) is kept
+    assert client._message_broker is http_client
+    request = next(http_client.auth.auth_flow(Request("GET", "http://dummy_nginx/message-broker/healthz")))
+    assert request.headers["Authorization"] == f"Bearer {new_token}"
 
 def test_delete_message_by_id(client):
     # Create a dummy outgoing message without 'meta' field.
@@ -55,7 +63,8 @@ def test_delete_message_by_id(client):
         "data": "test message"
     }
     dummy_message = Message(message=msg_body, config=client.nodeConfig, outgoing=True,
-                            message_number=1, category="test", recipients=["rec1"])
+                            flame_logger=client.flame_logger, message_number=1, category="test",
+                            recipients=["rec1"])
     client.list_of_outgoing_messages.append(dummy_message)
     deleted_count = client.delete_message_by_id(dummy_message.body["meta"]["id"], "outgoing")
     assert deleted_count == 1
@@ -93,8 +102,9 @@ def test_clear_messages(client):
             "akn_id": "nodeX",
         }
     }
-    msg1 = Message(message=msg_body_read, config=client.nodeConfig, outgoing=False)
-    msg2 = Message(message=msg_body_unread, config=client.nodeConfig, outgoing=False)
+    msg1 = Message(message=msg_body_read, config=client.nodeConfig, outgoing=False, flame_logger=client.flame_logger)
+    msg2 = Message(message=msg_body_unread, config=client.nodeConfig, outgoing=False,
+                   flame_logger=client.flame_logger)
     client.list_of_incoming_messages.extend([msg1, msg2])
     deleted_count = client.clear_messages("incoming", status="read")
     assert deleted_count == 1
@@ -124,4 +134,111 @@ def test_receive_message(client, monkeypatch):
     client.receive_message(msg_body)
     received_msg = client.list_of_incoming_messages[-1]
     # Verify that recipients have been set to the sender.
-    assert received_msg.recipients == [msg_body["meta"]["sender"]]
\ No newline at end of file
+    assert received_msg.recipients == [msg_body["meta"]["sender"]]
+
+def test_await_message_woken_by_receive_message(client, monkeypatch):
+    # A message arriving on another thread (as with the webhook) must wake the waiter without polling delay.
+    async def dummy_ack(self, message):
+        return
+    monkeypatch.setattr(MessageBrokerClient, "acknowledge_message", dummy_ack)
+    msg_body = {
+        "data": "wake up",
+        "meta": {
+            "id": "incoming-2",
+            "sender": "nodeB",
+            "status": "unread",
+            "type": "incoming",
+            "category": "test",
+            "number": 1,
+            "created_at": str(datetime.datetime.now()),
+            "arrived_at": None,
+            "akn_id": None,
+        }
+    }
+    timer = threading.Timer(0.05, client.receive_message, args=(msg_body,))
+
+    async def wait():
+        timer.start()
+        start = time.perf_counter()
+        node_id, messages = await asyncio.wait_for(client.await_message("nodeB", "test"), timeout=2)
+        return node_id, messages, time.perf_counter() - start
+
+    node_id, messages, elapsed = asyncio.run(wait())
+    assert node_id == "nodeB"
+    assert messages[0].body["meta"]["id"] == "incoming-2"
+    assert elapsed < 0.5
+
+
+def test_await_message_acknowledgement_woken_by_receive_message(client):
+    outgoing = Message(message={"data": "ping"}, config=client.nodeConfig, outgoing=True,
+                       flame_logger=client.flame_logger, message_number=1, category="test", recipients=["nodeB"])
+    ack_body = {"data": "ping", "meta": dict(outgoing.body["meta"], akn_id="nodeB")}
+    timer = threading.Timer(0.05, client.receive_message, args=(ack_body,))
+
+    async def wait():
+        timer.start()
+        return await asyncio.wait_for(client.await_message_acknowledgement(outgoing, "nodeB"), timeout=2)
+
+    assert asyncio.run(wait()) == "nodeB"
+
+
+def _incoming_message(client, message_id, sender="nodeA", category="test", status="unread"):
+    body = {
+        "data": message_id,
+        "meta": {
+            "id": message_id,
+            "sender": sender,
+            "status": status,
+            "type": "incoming",
+            "category": category,
+            "number": 1,
+            "created_at": str(datetime.datetime.now()),
+            "arrived_at": None,
+            "akn_id": "nodeX",
+        }
+    }
+    return Message(message=body, config=client.nodeConfig, outgoing=False, flame_logger=client.flame_logger)
+
+
+def test_message_store_indexes_follow_status_changes(client):
+    messages = [_incoming_message(client, f"msg-{i}", category="even" if i % 2 == 0 else "odd") for i in range(6)]
+    client.incoming_messages.extend(messages)
+    assert [m.body["meta"]["id"] for m in client.incoming_messages.find("nodeA", "even")] == ["msg-0", "msg-2", "msg-4"]
+    messages[2].set_read()
+    assert [m.body["meta"]["id"] for m in client.incoming_messages.find("nodeA", "even")] == ["msg-0", "msg-4"]
+    assert client.incoming_messages.find("nodeA", "even", "read") == [messages[2]]
+    assert client.incoming_messages.find("nodeA", "odd", message_id="msg-3") == [messages[3]]
+    assert client.clear_messages("incoming", status="read") == 1
+    assert client.clear_messages("incoming", status="unread", min_age=60) == 0
+    assert len(client.list_of_incoming_messages) == 5
+    assert client.list_of_incoming_messages[-1] is messages[5]
+    assert client.clear_messages("incoming", status="all") == 5
+    assert len(client.list_of_incoming_messages) == 0
+
+
+def test_message_store_clear_by_age(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    old_message = _incoming_message(client, "old")
+    client.incoming_messages.add(old_message)
+    now[0] += 100
+    client.incoming_messages.add(_incoming_message(client, "new"))
+    now[0] += 10
+    assert client.clear_messages("incoming", status="unread", min_age=50) == 1
+    assert [m.body["meta"]["id"] for m in client.list_of_incoming_messages] == ["new"]
+
+
+def test_delete_message_by_id_removes_all_duplicates(client):
+    client.incoming_messages.extend([_incoming_message(client, "dup"), _incoming_message(client, "dup"),
+                                     _incoming_message(client, "other")])
+    assert client.delete_message_by_id("dup", "incoming") == 2
+    assert client.delete_message_by_id("dup", "incoming") == 0
+    assert [m.body["meta"]["id"] for m in client.list_of_incoming_messages] == ["other"]
+
+
+def test_partner_nodes_prefetched_during_init(client, monkeypatch):
+    async def fail_get_participants(self, analysis_id: str):
+        raise AssertionError("participants should have been prefetched")
+    monkeypatch.setattr(MessageBrokerClient, "_get_participants", fail_get_participants)
+    partner_nodes = asyncio.run(client.get_partner_nodes("test_node", client.nodeConfig.analysis_id))
+    assert partner_nodes == [{"nodeId": "nodeB", "nodeType": "default"}]
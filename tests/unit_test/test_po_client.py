@@ -0,0 +1,54 @@
+import socket
+import threading
+
+import pytest
+from httpx import ConnectError, HTTPStatusError
+
+from flamesdk.resources.client_apis.clients.po_client import POClient
+from flamesdk.resources.utils.logging import FlameLogger
+from po_stand_in import StandInPOServer
+
+
+@pytest.fixture(params=[True, False], ids=["batch_endpoint", "fallback"])
+def po_server(request):
+    server = StandInPOServer(batch_endpoint=request.param)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def test_stream_logs_batch(po_server):
+    client = POClient(f"127.0.0.1:{po_server.server_address[1]}", "token", FlameLogger())
+    logs = [{"log": f"log {i}", "log_type": "info", "status": "executing", "progress": i} for i in range(3)]
+    client.stream_logs_batch(logs, "analysis")
+    if po_server.batch_endpoint:
+        assert len(po_server.requests) == 1
+        path, body = po_server.requests[0]
+        assert path == "/po/stream_logs/batch"
+        assert [log["log"] for log in body] == ["log 0", "log 1", "log 2"]
+        assert all(log["analysis_id"] == "analysis" for log in body)
+    else:
+        assert [path for path, _ in po_server.requests] == ["/po/stream_logs"] * 3
+        assert [body["progress"] for _, body in po_server.requests] == [0, 1, 2]
+
+
+def test_stream_logs_batch_raises_on_failure():
+    server = StandInPOServer(failures=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = POClient(f"127.0.0.1:{server.server_address[1]}", "token", FlameLogger())
+        logs = [{"log": "log", "log_type": "error", "status": "executing", "progress": 0}]
+        with pytest.raises(HTTPStatusError):
+            client.stream_logs_batch(logs, "analysis")
+        client.stream_logs_batch(logs, "analysis")
+        assert [path for path, _ in server.requests] == ["/po/stream_logs/batch"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # nothing is listening on the port of a closed socket
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        port = closed.getsockname()[1]
+    with pytest.raises(ConnectError):
+        POClient(f"127.0.0.1:{port}", "token", FlameLogger()).stream_logs_batch(logs, "analysis")
@@ -0,0 +1,80 @@
+import gzip
+import json
+from unittest.mock import patch
+
+from httpx import Headers, MockTransport, Response
+
+from flamesdk.resources.client_apis.clients.data_api_client import DataApiClient
+from flamesdk.resources.utils import response_cache
+from flamesdk.resources.utils.event_loop import run_coroutine
+from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.utils.response_cache import ResponseCache
+
+
+def test_store_and_read_persist_across_instances(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1024)
+    key = cache.key('source1', 'fhir', 'source1/fhir/Patient')
+    assert cache.read(key) is None
+    assert not cache.store(key, b'no validators', Headers({'Content-Type': 'application/json'}))
+    assert cache.store(key, b'{"id": 1}', Headers({'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}))
+
+    reopened = ResponseCache(str(tmp_path), max_bytes=1024)
+    assert reopened.read(key)[0] == b'{"id": 1}'
+    assert reopened.conditional_headers(key) == {'If-None-Match': '"v1"',
+                                                 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=25)
+    keys = [cache.key('source1', 's3', f"key{i}") for i in range(3)]
+    cache.store(keys[0], b'0' * 10, Headers({'ETag': '"0"'}))
+    cache.store(keys[1], b'1' * 10, Headers({'ETag': '"1"'}))
+    assert cache.read(keys[0])[0] == b'0' * 10  # keys[1] becomes the least recently used
+    cache.store(keys[2], b'2' * 10, Headers({'ETag': '"2"'}))
+    assert cache.read(keys[1]) is None
+    assert cache.read(keys[0])[0] == b'0' * 10
+    assert cache.read(keys[2])[0] == b'2' * 10
+    assert cache.size() == 20
+
+
+def test_data_api_client_revalidates_cached_responses(tmp_path):
+    bundle = {"resourceType": "Bundle", "id": "bundle-1", "entry": [{"resource": {"id": "p1"}}], "link": []}
+    requests = []
+
+    def handler(request):
+        if request.url.path.endswith("/kong/datastore/proj_id"):
+            return Response(200, json={"data": [{"name": "source1"}]})
+        requests.append((request.url.path, request.headers.get("If-None-Match")))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(304, headers={"ETag": '"v1"'})
+        return Response(200,
+                        headers={"ETag": '"v1"', "Content-Type": "application/fhir+json", "Content-Encoding": "gzip"},
+                        content=gzip.compress(json.dumps(bundle).encode()))
+
+    response_cache.configure_response_cache(directory=str(tmp_path))
+    try:
+        with patch("flamesdk.resources.client_apis.clients.data_api_client.get_async_transport",
+                   return_value=MockTransport(handler)):
+            client = DataApiClient("proj_id", "nginx", "data_token", "key_token", FlameLogger())
+        first = client.get_data(fhir_queries=["Patient"])
+        second = client.get_data(fhir_queries=["Patient"])
+        # the cached response is replayed with the headers it was received with
+        responses = [run_coroutine(client._get_cached("source1", "fhir", "source1/fhir/Patient")) for _ in range(2)]
+    finally:
+        response_cache.configure_response_cache(directory='')
+    assert first == second == [{"Patient": bundle}]
+    for response in responses:
+        assert response.json() == bundle
+        assert response.headers["Content-Type"] == "application/fhir+json"
+        assert "Content-Encoding" not in response.headers
+    assert requests == [("/kong/source1/fhir/Patient", None)] + [("/kong/source1/fhir/Patient", '"v1"')] * 3
+
+
+def test_hits_do_not_rewrite_metadata(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1024)
+    key = cache.key('source1', 's3', 'key')
+    cache.store(key, b'body', Headers({'ETag': '"v1"'}))
+    meta_path = tmp_path / f"{key}.meta.json"
+    stored_meta = meta_path.read_bytes()
+    assert cache.read(key)[0] == b'body'
+    assert meta_path.read_bytes() == stored_meta
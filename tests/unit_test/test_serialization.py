@@ -0,0 +1,130 @@
+import os
+import pickle
+import struct
+
+import pytest
+
+from flamesdk.resources.client_apis.clients.storage_client import StorageClient
+from flamesdk.resources.utils import serialization
+from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.utils.serialization import (Codec, available_compressions, deserialize, read_frame_header,
+                                                    register_codec, select_codec, serialize)
+
+
+def _codec_name(payload):
+    return read_frame_header(memoryview(payload))[0]
+
+
+def test_legacy_pickles_and_pickle5_round_trip():
+    data = {'weights': [0.5, 1.5], 'round': 3, 'name': 'model'}
+    assert deserialize(pickle.dumps(data)) == data
+    payload = serialize(data)
+    assert _codec_name(payload) == 'pickle5'
+    assert deserialize(payload) == data
+
+
+def test_numpy_arrays_decode_writable():
+    np = pytest.importorskip('numpy')
+    array = np.arange(24, dtype='float32').reshape(4, 6)
+    for obj in (array, np.asfortranarray(array), array[:, ::2]):
+        payload = serialize(obj)
+        assert _codec_name(payload) == 'npy'
+        decoded = deserialize(payload)
+        np.testing.assert_array_equal(decoded, obj)
+        decoded += 1
+        # zero-copy decoding views the received payload, read-only for immutable bytes
+        decoded = deserialize(payload, writable=False)
+        np.testing.assert_array_equal(decoded, obj)
+        assert not decoded.flags.writeable and not decoded.flags.owndata
+
+    # arrays nested in other objects are pickled out-of-band
+    payload = serialize({'layer': array, 'bias': 0.1})
+    assert _codec_name(payload) == 'pickle5'
+    decoded = deserialize(payload)
+    np.testing.assert_array_equal(decoded['layer'], array)
+    decoded['layer'] += 1
+    assert not deserialize(payload, writable=False)['layer'].flags.owndata
+
+
+def test_arrow_and_msgpack_round_trip():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.table({'patient': ['p1', 'p2'], 'value': [1.5, 2.5]})
+    payload = serialize(table)
+    assert _codec_name(payload) == 'arrow'
+    assert deserialize(payload).equals(table)
+
+    pytest.importorskip('msgpack')
+    data = {'counts': [1, 2, 3], 'label': 'x', 'raw': b'\x00\x01'}
+    payload = serialize(data, codec='msgpack')
+    assert _codec_name(payload) == 'msgpack'
+    assert deserialize(payload) == data
+
+
+def test_registered_codec_is_selected_and_decoded():
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    register_codec(Codec('test-point',
+                         encode=lambda p: [f"{p.x},{p.y}".encode()],
+                         decode=lambda view: tuple(int(v) for v in bytes(view).decode().split(',')),
+                         accepts=lambda obj: isinstance(obj, Point)))
+    try:
+        assert select_codec(Point(1, 2)) == 'test-point'
+        assert deserialize(serialize(Point(1, 2))) == (1, 2)
+        with pytest.raises(ValueError):
+            serialize(Point(1, 2), codec='unknown')
+    finally:
+        serialization._CODECS.pop('test-point')
+
+
+def test_push_result_records_codec(monkeypatch):
+    requests = []
+
+    class DummyClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def put(self, path, files, data, **kwargs):
+            requests.append((path, data, files['file'][1].read()))
+            return type('R', (), {'json': lambda self: {'url': 'http://storage/local/id-1'},
+                                  'raise_for_status': lambda self: None})()
+
+    monkeypatch.setattr('flamesdk.resources.client_apis.clients.storage_client.Client', DummyClient)
+    client = StorageClient('nginx', 'token', FlameLogger())
+    client.push_result([1, 2, 3], tag='weights', type='local', codec='msgpack')
+    client.push_result({'foo': 'bar'}, type='final', output_type='pickle')
+
+    (_, local_data, local_body), (_, final_data, final_body) = requests
+    assert local_data == {'tag': 'weights', 'codec': 'msgpack'} and deserialize(local_body) == [1, 2, 3]
+    # final results stay plain pickles, to be downloaded by analysts
+    assert 'codec' not in final_data and pickle.loads(final_body) == {'foo': 'bar'}
+
+
+def test_compression_is_chosen_by_size_and_compressibility():
+    compressible = {'rows': [f"patient-{i % 10},value" for i in range(20000)]}
+    payload = serialize(compressible, compression='auto')
+    _, compression, size, _ = read_frame_header(memoryview(payload))
+    assert (compression in available_compressions()) and (len(payload) < size / 5)
+    assert deserialize(payload) == compressible
+
+    # small and incompressible payloads are sent as they are
+    for data in ({'round': 1}, os.urandom(256 * 1024)):
+        payload = serialize(data, compression='auto')
+        assert read_frame_header(memoryview(payload))[1] is None
+        assert deserialize(payload) == data
+
+    # an explicit compression is applied in any case
+    for compression in available_compressions():
+        payload = serialize({'round': 1}, compression=compression)
+        assert read_frame_header(memoryview(payload))[1] == compression
+        assert deserialize(payload) == {'round': 1}
+    with pytest.raises(ValueError):
+        serialize({'round': 1}, compression='unknown')
+
+
+def test_version_1_frames_stay_readable():
+    body = pickle.dumps([1, 2, 3], protocol=5)
+    header = struct.pack('<4sBHB', b'FLMS', 1, 64, 7) + b'pickle5'
+    legacy_body = struct.pack('<IQ', 0, len(body)).ljust(64, b'\0') + body
+    assert deserialize(header.ljust(64, b'\0') + legacy_body) == [1, 2, 3]
@@ -1,13 +1,22 @@
+import io
+import threading
+import time
+
 import pytest
+from unittest.mock import patch
+from httpx import MockTransport
 
 from flamesdk.resources.client_apis.clients.storage_client import StorageClient
 from flamesdk.resources.utils.logging import FlameLogger
+from flamesdk.resources.utils.serialization import deserialize, serialize
+from storage_stand_in import StorageStandIn
 
 
 class DummyClient:
     def __init__(self, *args, **kwargs):
         self.base_url = kwargs.get('base_url')
         self.headers = kwargs.get('headers')
+        self.auth = kwargs.get('auth')
         self.follow_redirects = kwargs.get('follow_redirects')
         self.last_request = None
     def post(self, *args, **kwargs):
@@ -38,8 +47,10 @@ def test_refresh_token(monkeypatch):
     monkeypatch.setattr('flamesdk.resources.client_apis.clients.storage_client.Client', DummyClient)
     flame_logger = FlameLogger()
     client = StorageClient('nginx', 'token', flame_logger)
+    http_client = client.client
     client.refresh_token('newtoken')
-    assert client.client.headers['Authorization'] == 'Bearer newtoken'
+    assert client.client is http_client
+    assert client.client.auth.token == 'newtoken'
 
 def test_push_result(monkeypatch):
     monkeypatch.setattr('flamesdk.resources.client_apis.clients.storage_client.Client', DummyClient)
@@ -49,3 +60,113 @@ def test_push_result(monkeypatch):
     client.client.post = lambda *a, **k: type('R', (), {'json': lambda self: {'status': 'success'}})()
     result = client.push_result(result={'foo': 'bar'})
     assert result['status'] == 'success'
+
+def test_push_result_to_nodes(monkeypatch):
+    monkeypatch.setattr('flamesdk.resources.client_apis.clients.storage_client.Client', DummyClient)
+    client = StorageClient('nginx', 'token', FlameLogger(), max_concurrency=3)
+    in_flight = {'current': 0, 'max': 0}
+    lock = threading.Lock()
+    uploads = []
+
+    def put(path, files, data, **kwargs):
+        with lock:
+            in_flight['current'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['current'])
+        time.sleep(0.02)
+        with lock:
+            in_flight['current'] -= 1
+            uploads.append((path, data['remote_node_id'], files['file'][1].read()))
+        url = f"http://storage/intermediate/id-{data['remote_node_id']}"
+        return type('R', (), {'json': lambda self: {'url': url}, 'raise_for_status': lambda self: None})()
+    client.client.put = put
+
+    serialize_calls = []
+    monkeypatch.setattr('flamesdk.resources.client_apis.clients.storage_client.serialize',
+                        lambda obj, codec, **kwargs: serialize_calls.append(codec) or serialize(obj, codec, **kwargs))
+    node_ids = [f"node{i}" for i in range(6)]
+    result = client.push_result_to_nodes({'weights': [1, 2, 3]}, node_ids, type='global')
+
+    assert list(result.keys()) == node_ids
+    assert result['node4'] == {'status': 'success', 'url': 'http://storage/intermediate/id-node4', 'id': 'id-node4'}
+    assert serialize_calls == ['pickle5']
+    assert in_flight['max'] == 3
+    assert sorted(node_id for _, node_id, _ in uploads) == node_ids
+    assert all((path == '/intermediate') and (deserialize(body) == {'weights': [1, 2, 3]})
+               for path, _, body in uploads)
+
+
+def _stand_in_client(stand_in):
+    with patch('flamesdk.resources.client_apis.clients.storage_client.get_sync_transport',
+               return_value=MockTransport(stand_in.handle)):
+        return StorageClient('nginx', 'token', FlameLogger())
+
+
+@pytest.mark.parametrize('broadcast_supported, unsupported_status', [(True, 404), (False, 404), (False, 405)])
+def test_push_result_to_nodes_broadcast(broadcast_supported, unsupported_status):
+    stand_in = StorageStandIn(broadcast=broadcast_supported, unsupported_status=unsupported_status)
+    client = _stand_in_client(stand_in)
+    payload = {'weights': list(range(1000))}
+    node_ids = [f"node{i}" for i in range(5)]
+
+    result = client.push_result_to_nodes(payload, node_ids, type='global', broadcast=True)
+
+    assert list(result.keys()) == node_ids
+    assert all(r['status'] == 'success' and r['url'].endswith(r['id']) for r in result.values())
+    assert [client.get_intermediate_data(query=r['id']) for r in result.values()] == [payload] * len(node_ids)
+    size = len(serialize(payload))
+    if broadcast_supported:
+        # a single upload and stored copy of the payload, only the wrapped keys are per receiver
+        assert stand_in.uploads == [('/intermediate/broadcast', size)]
+        assert stand_in.stored_bytes() == size + 32 * len(node_ids)
+    else:
+        # the 404 (or 405) of the broadcast endpoint falls back to (and sticks with) one upload per receiver
+        assert stand_in.uploads == [('/intermediate', size)] * len(node_ids)
+        assert not client._broadcast_supported
+
+
+def test_push_result_streams_files_and_generators(tmp_path):
+    stand_in = StorageStandIn()
+    client = _stand_in_client(stand_in)
+    chunks_read = []
+
+    def chunks():
+        for i in range(8):
+            chunks_read.append(i)
+            yield bytes([i]) * 300_000
+
+    # final results are streamed as they are, from a path (named after the file) or from an iterator
+    path = tmp_path / 'model.bin'
+    path.write_bytes(b'weights' * 100_000)
+    client.push_result(path, type='final', output_type='bytes')
+    client.push_result(chunks(), type='final', output_type='bytes', filename='chunks.bin')
+    (_, path_name, _, path_payload, path_chunked), (_, _, _, chunks_payload, chunks_chunked) = stand_in.files
+    assert (path_name, path_payload, path_chunked) == ('model.bin', path.read_bytes(), False)
+    assert chunks_payload == b''.join(bytes([i]) * 300_000 for i in range(8)) and chunks_chunked
+    assert chunks_read == list(range(8))
+
+    # intermediate data is framed as raw payload and retrieved as bytes, a plain str stays a regular result
+    with open(path, 'rb') as file:
+        response = client.push_result(file, tag='stream', type='local')
+    assert stand_in.files[-1][2]['codec'] == 'raw'
+    assert client.get_intermediate_data(query=response['id'], type='local') == path.read_bytes()
+    response = client.push_result(path, tag='stream', type='local')
+    assert not stand_in.files[-1][4]  # the length of a framed file is known
+    assert client.get_intermediate_data(query=response['id'], type='local') == path.read_bytes()
+    response = client.push_result(str(path), tag='stream', type='local')
+    assert client.get_intermediate_data(query=response['id'], type='local') == str(path)
+
+    # text file objects and iterators other than generators are regular results as well
+    text = io.StringIO('a,b')
+    client.push_result(text, type='final', output_type='str')
+    assert stand_in.files[-1][3] == str(text).encode()
+    response = client.push_result(iter([1, 2]), tag='stream', type='local')
+    assert list(client.get_intermediate_data(query=response['id'], type='local')) == [1, 2]
+
+
+def test_push_result_to_nodes_streams_spooled_generators():
+    stand_in = StorageStandIn(broadcast=False)
+    client = _stand_in_client(stand_in)
+    payload = [b'intermediate-', b'data-', b'chunks']
+    result = client.push_result_to_nodes((chunk for chunk in payload), ['node1', 'node2'], type='global', broadcast=True)
+    # the generator is read once, and its bytes uploaded for each receiver after the broadcast was rejected
+    assert [client.get_intermediate_data(query=r['id']) for r in result.values()] == [b''.join(payload)] * 2
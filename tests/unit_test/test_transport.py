@@ -0,0 +1,37 @@
+from httpx import Request
+
+from flamesdk.resources.utils import transport
+from flamesdk.resources.client_apis.clients.po_client import POClient
+from flamesdk.resources.client_apis.clients.storage_client import StorageClient
+from flamesdk.resources.utils.logging import FlameLogger
+
+
+def test_sync_clients_share_transport():
+    flame_logger = FlameLogger()
+    po_client = POClient('nginx', 'token', flame_logger)
+    storage_client = StorageClient('nginx', 'token', flame_logger)
+    assert po_client.client._transport is storage_client.client._transport is transport.get_sync_transport()
+
+
+def test_configure_transport_updates_limits():
+    previous_async, previous_sync = transport.get_async_transport(), transport.get_sync_transport()
+    transport.configure_transport(max_connections=7, max_keepalive_connections=3)
+    try:
+        limits = transport.get_pool_limits()
+        assert (limits.max_connections, limits.max_keepalive_connections) == (7, 3)
+        assert transport.get_async_transport() is not previous_async
+        assert transport.get_sync_transport() is not previous_sync
+    finally:
+        transport.configure_transport(max_connections=100, max_keepalive_connections=20)
+
+
+def test_token_rotation_is_shared_and_in_place():
+    flame_logger = FlameLogger()
+    po_client = POClient('nginx', 'token', flame_logger)
+    storage_client = StorageClient('nginx', 'token', flame_logger)
+    http_client = storage_client.client
+    transport.set_keycloak_token('rotated')
+    assert storage_client.client is http_client
+    for client in (po_client.client, storage_client.client):
+        request = next(client.auth.auth_flow(Request("GET", "http://nginx/")))
+        assert request.headers["Authorization"] == "Bearer rotated"
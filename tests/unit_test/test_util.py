@@ -1,7 +1,12 @@
-from flamesdk.resources.utils.fhir import fhir_to_csv
+import json
+import pickle
+from unittest.mock import patch
+from flamesdk.resources.utils.fhir import (fhir_to_csv, _compile_fhir_path, _FhirEntryFlattener, _FhirFlattenWorkers,
+                                          _FhirTableBuilder, _table_to_csv)
 from flamesdk.resources.utils.utils import extract_remaining_time_from_token
 from flamesdk.resources.utils.logging import FlameLogger
 import ast
+import pytest
 import time
 
 def test_extract_remaining_time_from_token():
@@ -47,3 +52,162 @@ def test_multi_param_questionnaire():
                         input_resource="QuestionnaireResponse",
                         flame_logger=flame_logger)
     assert output is not None
+
+
+def test_compiled_fhir_path():
+    flame_logger = FlameLogger()
+    entry = {"resource": {"code": {"coding": [{"system": "other"},
+                                              {"code": "c1"}]},
+                          "component": [{"valueString": None},
+                                        {"valueQuantity": {"value": 4.2}}],
+                          "subject": {"reference": "Patient/1"}}}
+    # lists are searched for the first non-None result
+    assert _compile_fhir_path("resource.code.coding.code".split('.'), flame_logger)(entry) == "c1"
+    assert _compile_fhir_path("resource.subject.reference".split('.'), flame_logger)(entry) == "Patient/1"
+    # the last key falls back to the first field containing it, resolved per entry shape
+    get_value = _compile_fhir_path("resource.component.value".split('.'), flame_logger)
+    assert get_value(entry) == {"value": 4.2}
+    assert get_value({"resource": {"component": [{"valueInteger": 3}]}}) == 3
+    # missing fields
+    assert _compile_fhir_path("resource.missing.code".split('.'), flame_logger)(entry) is None
+    assert _compile_fhir_path("resource.subject.unknown".split('.'), flame_logger)(entry) is None
+
+
+def _columnar_bundle():
+    entries = []
+    for patient, (weight, status) in enumerate([(70, "ok"), (82, "ok"), (None, "pending")]):
+        entries.append({"resource": {"code": {"coding": [{"code": "status"}]},
+                                     "subject": {"reference": f"Patient/{patient}"},
+                                     "valueString": status}})
+        if weight is not None:
+            entries.append({"resource": {"code": {"coding": [{"code": "weight"}]},
+                                         "subject": {"reference": f"Patient/{patient}"},
+                                         "valueInteger": weight}})
+    entries.append({"resource": {"code": {"coding": [{"code": "height"}]},
+                                 "subject": {"reference": "Patient/0"},
+                                 "valueInteger": 180}})
+    return {"total": len(entries), "entry": entries, "link": []}
+
+
+def _columnar_fhir_to_csv(output_type):
+    return fhir_to_csv(_columnar_bundle(),
+                       col_key_seq="resource.code.coding.code",
+                       value_key_seq="resource.value",
+                       row_key_seq="resource.subject.reference",
+                       input_resource="Observation",
+                       row_col_name="patient",
+                       output_type=output_type,
+                       flame_logger=FlameLogger())
+
+
+def test_fhir_to_numpy():
+    np = pytest.importorskip("numpy")
+    output = _columnar_fhir_to_csv("numpy")
+    assert list(output.keys()) == ["patient", "status", "weight", "height"]
+    assert output["patient"].tolist() == ["Patient/0", "Patient/1", "Patient/2"]
+    assert output["status"].tolist() == ["ok", "ok", "pending"]
+    assert output["weight"].dtype == np.float64
+    assert output["weight"][:2].tolist() == [70.0, 82.0] and np.isnan(output["weight"][2])
+    assert output["height"][0] == 180
+
+
+def test_fhir_to_pandas():
+    pd = pytest.importorskip("pandas")
+    output = _columnar_fhir_to_csv("pandas")
+    csv_output = pd.read_csv(_columnar_fhir_to_csv("file"))
+    pd.testing.assert_frame_equal(output, csv_output, check_dtype=False)
+    assert output["weight"].dtype == "float64"
+
+
+def test_fhir_to_arrow():
+    pa = pytest.importorskip("pyarrow")
+    output = _columnar_fhir_to_csv("arrow")
+    assert output.column_names == ["patient", "status", "weight", "height"]
+    assert output.schema.field("weight").type == pa.int64()
+    assert output.column("weight").to_pylist() == [70, 82, None]
+
+
+def test_fhir_table_builder_matches_dict_of_dicts():
+    random = __import__("random").Random(7)
+    table = _FhirTableBuilder()
+    reference = {}
+    pool = [1, 2.5, "text", None, True, 2 ** 70, 3, 4.0]
+    for _ in range(2000):
+        col_id, row_id = f"col{random.randint(0, 20)}", f"row{random.randint(0, 300)}"
+        # columns start out typed (odd ones float, even ones int) and are promoted on the first mismatching value
+        if random.random() < 0.1:
+            value = random.choice(pool)
+        else:
+            value = random.random() if int(col_id[3:]) % 2 else 7
+        table.add(col_id, row_id, value)
+        reference.setdefault(col_id, {})[row_id] = value
+
+    assert table.to_dict() == reference
+    assert [list(d.keys()) for d in table.to_dict().values()] == [list(d.keys()) for d in reference.values()]
+
+    row_ids = list(dict.fromkeys(row_id for col in reference.values() for row_id in col))
+    expected_lines = ["id," + ",".join(reference.keys())]
+    for row_id in row_ids:
+        expected_lines.append(",".join([row_id] + [str(col.get(row_id, '')) for col in reference.values()]))
+    csv = _table_to_csv(table, row_col_name="id", separator=",", flame_logger=FlameLogger(silent=True))
+    assert csv.read() == "\n".join(expected_lines)
+
+
+def test_fhir_table_builder_merge_matches_add():
+    random = __import__("random").Random(11)
+    pool = [1, 2.5, "text", None, True, 2 ** 70, 3, 4.0]
+    table, parts = _FhirTableBuilder(), []
+    for _ in range(20):
+        part = _FhirTableBuilder()
+        for _ in range(100):
+            col_id, row_id = f"col{random.randint(0, 20)}", f"row{random.randint(0, 300)}"
+            value = random.choice(pool) if random.random() < 0.1 else (random.random() if random.random() < 0.5 else 7)
+            table.add(col_id, row_id, value)
+            part.add(col_id, row_id, value)
+        parts.append(part)
+
+    merged = _FhirTableBuilder()
+    for part in parts:
+        # as received from a worker process
+        merged.merge(pickle.loads(pickle.dumps(part)))
+    assert merged.to_dict() == table.to_dict()
+    assert list(merged.iter_csv_lines("id", ",")) == list(table.iter_csv_lines("id", ","))
+    assert list(merged.iter_columns()) == list(table.iter_columns())
+
+
+def test_fhir_flatten_workers_report_failed_pages():
+    flame_logger = FlameLogger(silent=True)
+    flattener_args = ("Observation", ["resource", "code"], ["resource", "value"], ["resource", "subject"], None, None)
+    flattener = _FhirEntryFlattener(*flattener_args, flame_logger=flame_logger)
+    table = _FhirTableBuilder()
+    workers = _FhirFlattenWorkers(2, flattener_args, flattener, table)
+    try:
+        with patch.object(flame_logger, "raise_error") as raise_error:
+            workers.submit(json.dumps({"entry": [{"resource": {"code": "c", "subject": "s", "value": 1}}]}).encode())
+            workers.submit(b'{"entry": [')
+            workers.drain()
+    finally:
+        workers.close()
+    assert table.to_dict() == {"c": {"s": 1}}
+    assert flattener.count == 1
+    assert "JSONDecodeError" in raise_error.call_args[0][0]
+
+
+def test_fhir_to_csv_stream_and_sink(tmp_path):
+    csv_output = _columnar_fhir_to_csv("file").read()
+
+    lines = _columnar_fhir_to_csv("stream")
+    assert not isinstance(lines, (str, list))
+    assert "\n".join(lines) == csv_output
+
+    path = tmp_path / "observations.csv"
+    output = fhir_to_csv(_columnar_bundle(),
+                         col_key_seq="resource.code.coding.code",
+                         value_key_seq="resource.value",
+                         row_key_seq="resource.subject.reference",
+                         input_resource="Observation",
+                         row_col_name="patient",
+                         sink=path,
+                         flame_logger=FlameLogger())
+    assert output == path
+    assert path.read_text(encoding="utf-8") == csv_output